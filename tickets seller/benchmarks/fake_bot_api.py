@@ -0,0 +1,113 @@
+import asyncio
+import itertools
+import time
+import uuid
+from collections import Counter
+from aiohttp import web
+
+class FakeBotApi:
+    """Локальная замена Telegram Bot API: записывает вызовы, умеет задержку и ответы 429"""
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 8081, latency: float = 0.0, flood_every: int = 0, retry_after: int = 1):
+        self.host = host
+        self.port = port
+        self.latency = latency  # секунд на каждый запрос
+        self.flood_every = flood_every  # каждый N-й sendDocument получает 429, 0 — никогда
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.flood_responses = 0
+        self.files = {}  # file_id -> содержимое для getFile и скачивания
+        self._message_ids = itertools.count(1)
+        self._runner = None
+    
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+    
+    @property
+    def base_file_url(self) -> str:
+        return f"http://{self.host}:{self.port}/file/bot"
+    
+    def add_file(self, content: bytes) -> str:
+        """Регистрирует файл, который бот сможет скачать, и возвращает его file_id"""
+        file_id = uuid.uuid4().hex
+        self.files[file_id] = content
+        return file_id
+    
+    def reset(self):
+        """Сбрасывает статистику вызовов между сценариями"""
+        self.calls.clear()
+        self.flood_responses = 0
+    
+    def _message(self, chat_id, **fields) -> dict:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id or 0), 'type': 'private'}
+        }
+        message.update(fields)
+        return message
+    
+    async def handle_method(self, request: web.Request) -> web.Response:
+        """Обрабатывает вызов метода Bot API"""
+        method = request.match_info['method']
+        params = await request.post()
+        self.calls[method] += 1
+        
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        
+        if method == 'sendDocument' and self.flood_every and self.calls[method] % self.flood_every == 0:
+            self.flood_responses += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after}
+            }, status=429)
+        
+        chat_id = params.get('chat_id')
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method == 'getUpdates':
+            result = []
+        elif method in ('sendMessage', 'editMessageText'):
+            result = self._message(chat_id, text=params.get('text', ''))
+        elif method == 'sendDocument':
+            file_id = uuid.uuid4().hex
+            result = self._message(chat_id, document={'file_id': file_id, 'file_unique_id': file_id})
+        elif method == 'getFile':
+            file_id = params.get('file_id')
+            if file_id not in self.files:
+                return web.json_response({'ok': False, 'error_code': 400, 'description': "Bad Request: file not found"}, status=400)
+            result = {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'file_size': len(self.files[file_id]),
+                'file_path': f"documents/{file_id}"
+            }
+        else:
+            result = True
+        
+        return web.json_response({'ok': True, 'result': result})
+    
+    async def handle_file(self, request: web.Request) -> web.Response:
+        """Отдает содержимое ранее зарегистрированного файла"""
+        file_id = request.match_info['path'].rsplit('/', 1)[-1]
+        if file_id not in self.files:
+            return web.Response(status=404)
+        return web.Response(body=self.files[file_id])
+    
+    async def start(self):
+        """Запускает HTTP-сервер"""
+        app = web.Application(client_max_size=100 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle_method)
+        app.router.add_get('/file/bot{token}/{path:.+}', self.handle_file)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+    
+    async def stop(self):
+        """Останавливает HTTP-сервер"""
+        if self._runner:
+            await self._runner.cleanup()
\ No newline at end of file
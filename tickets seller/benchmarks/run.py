@@ -0,0 +1,272 @@
+"""Нагрузочные сценарии бота против локального FakeBotApi.
+
+Запуск из папки проекта:
+    python -m benchmarks.run --users 200 --pending 300 --files 600 --latency 20 --flood-every 50
+
+Каждый запуск работает в своей временной папке с чистой базой, рабочие данные не затрагиваются.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_TOKEN = "123456:bench"
+
+class QueryCounter:
+    """Считает SQL-запросы, выполненные движком"""
+    
+    def __init__(self, engine):
+        from sqlalchemy import event
+        
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+    
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+def percentile(values: list, p: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def make_update(update_id: int, user_id: int, text: str = None, document: dict = None) -> dict:
+    """Собирает JSON обновления так, как его прислал бы Telegram"""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+    }
+    if text is not None:
+        message['text'] = text
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    if document is not None:
+        message['document'] = document
+    return {'update_id': update_id, 'message': message}
+
+async def process_updates(application, raw_updates: list) -> list:
+    """Прогоняет обновления через обработчики параллельно и возвращает задержку каждого (мс)"""
+    from telegram import Update
+    
+    async def process(raw_update):
+        update = Update.de_json(raw_update, application.bot)
+        started = time.perf_counter()
+        # Тот же путь, что и у обновлений из очереди: с ограничением concurrent_updates
+        await application.update_processor.process_update(update, application.process_update(update))
+        return (time.perf_counter() - started) * 1000
+    
+    return await asyncio.gather(*(process(raw_update) for raw_update in raw_updates))
+
+async def wait_for_deliveries():
+    """Ждет, пока фоновая очередь отправит все поставленные файлы"""
+    from database.executor import run_db
+    from services.delivery_queue import DeliveryQueue
+    
+    while await run_db(DeliveryQueue.count_active):
+        await asyncio.sleep(0.05)
+
+async def measure(name: str, application, api, counter, raw_updates: list, items_metric: str) -> dict:
+    """Выполняет сценарий и собирает метрики"""
+    api.reset()
+    queries_before = counter.count
+    started = time.perf_counter()
+    latencies = await process_updates(application, raw_updates)
+    # Время сценария включает отправку файлов очередью, задержки — только обработчики
+    await wait_for_deliveries()
+    elapsed = time.perf_counter() - started
+    
+    items = api.calls['sendDocument'] - api.flood_responses if items_metric == 'sendDocument' else items_metric
+    return {
+        'scenario': name,
+        'updates': len(raw_updates),
+        'items': items,
+        'seconds': round(elapsed, 3),
+        'items_per_sec': round(items / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 1),
+        'p99_ms': round(percentile(latencies, 99), 1),
+        'db_queries': counter.count - queries_before,
+        'api_calls': dict(api.calls),
+        'flood_429': api.flood_responses
+    }
+
+def build_zip(files: int) -> bytes:
+    """ZIP с заданным числом уникальных PDF"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for index in range(files):
+            zip_ref.writestr(f"ticket_{index}.pdf", f"%PDF-1.4 bench {index} {uuid.uuid4().hex}".encode())
+    return buffer.getvalue()
+
+def seed_links(count: int, seller_id: int) -> list:
+    """Создает одноразовые ссылки подписки и возвращает их токены"""
+    from sqlalchemy import insert
+    from database.session import Session
+    from database.models import SubscriptionLink
+    
+    tokens = [uuid.uuid4().hex[:12] for _ in range(count)]
+    session = Session()
+    try:
+        session.execute(insert(SubscriptionLink), [{'token': token, 'created_by': seller_id} for token in tokens])
+        session.commit()
+    finally:
+        session.close()
+    return tokens
+
+def seed_pending_users(count: int, first_user_id: int):
+    """Создает пользователей с подпиской, но без файла"""
+    from datetime import datetime
+    from sqlalchemy import insert
+    from database.session import Session
+    from database.models import User
+    
+    session = Session()
+    try:
+        session.execute(insert(User), [{
+            'user_id': first_user_id + index,
+            'username': f"pending{index}",
+            'first_name': f"Pending{index}",
+            'has_access': True,
+            'subscription_date': datetime.utcnow(),
+            'file_hash': uuid.uuid4().hex[:16],
+            'files_received': 0,
+            'pending_file': True
+        } for index in range(count)])
+        session.commit()
+    finally:
+        session.close()
+
+async def run_benchmarks(args) -> list:
+    """Поднимает FakeBotApi и приложение, выполняет сценарии по порядку"""
+    from telegram.ext import Application
+    from benchmarks.fake_bot_api import FakeBotApi
+    from config import Config
+    from database.session import engine
+    from database.executor import shutdown_db_executor
+    from main import setup_handlers
+    from services.delivery_queue import delivery_worker
+    
+    admin_id = Config.ADMIN_IDS[0]
+    api = FakeBotApi(port=args.port, latency=args.latency / 1000, flood_every=args.flood_every)
+    await api.start()
+    
+    application = (
+        Application.builder()
+        .token(BENCH_TOKEN)
+        .base_url(api.base_url)
+        .base_file_url(api.base_file_url)
+        .updater(None)
+        .concurrent_updates(Config.CONCURRENT_UPDATES)
+        .build()
+    )
+    setup_handlers(application)
+    counter = QueryCounter(engine)
+    results = []
+    
+    await application.initialize()
+    await delivery_worker.start(application)
+    try:
+        # Загрузка архива администратором
+        file_id = api.add_file(build_zip(args.files))
+        document = {'file_id': file_id, 'file_unique_id': file_id, 'file_name': 'bench.zip'}
+        results.append(await measure(
+            'zip_ingest', application, api, counter,
+            [make_update(1, admin_id, document=document)], args.files
+        ))
+        
+        # Одновременные активации подписок
+        tokens = seed_links(args.users, admin_id)
+        results.append(await measure(
+            'start_activation', application, api, counter,
+            [make_update(1000 + index, 10_000_000 + index, text=f"/start {token}") for index, token in enumerate(tokens)],
+            args.users
+        ))
+        
+        # Массовая отправка ожидающим
+        seed_pending_users(args.pending, 20_000_000)
+        results.append(await measure(
+            'send_pending', application, api, counter,
+            [make_update(2, admin_id, text="/send_pending")], 'sendDocument'
+        ))
+    finally:
+        await delivery_worker.stop()
+        await application.shutdown()
+        await api.stop()
+        shutdown_db_executor()
+    
+    return results
+
+def print_report(results: list):
+    """Печатает сводную таблицу"""
+    header = f"{'scenario':<18}{'updates':>8}{'items':>8}{'sec':>9}{'items/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'queries':>9}{'429':>6}"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(
+            f"{result['scenario']:<18}{result['updates']:>8}{result['items']:>8}{result['seconds']:>9}"
+            f"{result['items_per_sec']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}"
+            f"{result['db_queries']:>9}{result['flood_429']:>6}"
+        )
+    for result in results:
+        print(f"{result['scenario']}: {result['api_calls']}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочные сценарии бота против локального Bot API")
+    parser.add_argument('--users', type=int, default=200, help="одновременных активаций /start")
+    parser.add_argument('--pending', type=int, default=300, help="ожидающих пользователей для /send_pending")
+    parser.add_argument('--files', type=int, default=600, help="файлов в загружаемом архиве")
+    parser.add_argument('--latency', type=float, default=20.0, help="задержка ответа Bot API, мс")
+    parser.add_argument('--flood-every', type=int, default=0, help="каждый N-й sendDocument получает 429")
+    parser.add_argument('--rate', type=float, default=None, help="переопределить DELIVERY_GLOBAL_RATE")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--json', action='store_true', help="вывести результаты в JSON")
+    parser.add_argument('--keep', action='store_true', help="не удалять временную папку с базой и логами")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    
+    # Модули бота создают базу и логи по относительным путям при импорте,
+    # поэтому переходим во временную папку до первого импорта
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    sys.path.insert(0, PROJECT_ROOT)
+    os.chdir(workdir)
+    
+    from config import Config
+    if args.rate:
+        Config.DELIVERY_GLOBAL_RATE = args.rate
+    Config.create_folders()
+    
+    from database.session import init_db
+    init_db()
+    
+    try:
+        results = asyncio.run(run_benchmarks(args))
+    finally:
+        os.chdir(PROJECT_ROOT)
+        if args.keep:
+            print(f"Рабочая папка: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_report(results)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
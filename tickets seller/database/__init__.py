@@ -1,5 +1,5 @@
 from .session import Session, init_db
-from .models import User, File, Admin, SubscriptionLink, FileDelivery
+from .models import User, File, Admin, SubscriptionLink, FileDelivery, StatCounter, SchemaMigration
 
 __all__ = [
     'Session', 
@@ -8,5 +8,7 @@ __all__ = [
     'File', 
     'Admin',
     'SubscriptionLink',
-    'FileDelivery'
+    'FileDelivery',
+    'StatCounter',
+    'SchemaMigration'
 ]
\ No newline at end of file
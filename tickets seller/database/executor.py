@@ -0,0 +1,28 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+# Отдельный пул потоков для работы с БД: синхронные запросы SQLAlchemy
+# не блокируют цикл событий бота и не конкурируют с прочими to_thread-задачами
+_executor = ThreadPoolExecutor(
+    max_workers=Config.DB_EXECUTOR_WORKERS,
+    thread_name_prefix='db'
+)
+
+async def run_db(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с БД в пуле потоков БД"""
+    loop = asyncio.get_running_loop()
+    # Контекст (id корреляции для логов) переносится в поток, как в asyncio.to_thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, func, *args, **kwargs))
+
+def submit_db(func, *args, **kwargs):
+    """Ставит синхронную функцию в пул потоков БД, не дожидаясь результата"""
+    context = contextvars.copy_context()
+    return _executor.submit(context.run, func, *args, **kwargs)
+
+def shutdown_db_executor():
+    """Дожидается завершения запросов и останавливает пул потоков БД"""
+    _executor.shutdown(wait=True)
\ No newline at end of file
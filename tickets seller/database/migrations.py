@@ -0,0 +1,136 @@
+import os
+import hashlib
+from sqlalchemy import inspect, select, text
+from database.session import Base
+from database.models import SchemaMigration, DEFAULT_EVENT_ID
+from services.logger import bot_logger
+from config import Config
+
+def _add_column(connection, table: str, column_ddl: str):
+    """Добавляет колонку, если ее еще нет в таблице"""
+    column_name = column_ddl.split()[0]
+    existing = {column['name'] for column in inspect(connection).get_columns(table)}
+    if column_name not in existing:
+        connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column_ddl}")
+
+def _create_indexes(connection, *names: str):
+    """Создает объявленные в моделях индексы с указанными именами"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in names:
+                index.create(connection, checkfirst=True)
+
+def _claim_columns(connection):
+    """Колонки резервирования файлов и file_id Telegram"""
+    _add_column(connection, 'files', "claim_state VARCHAR DEFAULT 'free'")
+    _add_column(connection, 'files', "claimed_by INTEGER")
+    _add_column(connection, 'files', "claimed_at TIMESTAMP")
+    _add_column(connection, 'files', "telegram_file_id VARCHAR")
+    
+    # Уже выданные до появления резервирования файлы считаем отправленными
+    connection.execute(
+        text(
+            "UPDATE files SET claim_state = 'sent', claimed_by = distributed_to "
+            "WHERE distributed = :distributed AND claim_state = 'free'"
+        ),
+        {'distributed': True}
+    )
+
+def _hot_query_indexes(connection):
+    """Индексы под частые запросы сервисов и обработчиков"""
+    _create_indexes(
+        connection,
+        'ix_users_pending',
+        'ix_subscription_links_is_used',
+        'ix_files_free',
+        'ix_files_claim_state_claimed_at',
+        'ix_files_claimed_by',
+        'ix_files_distributed_to',
+        'ix_file_deliveries_user_file',
+        'ix_file_deliveries_file_id'
+    )
+
+def _content_hash(connection):
+    """Хэш содержимого файлов для поиска дубликатов"""
+    _add_column(connection, 'files', "content_hash VARCHAR")
+    
+    # Считаем хэши уже загруженных файлов, которые есть на диске
+    rows = connection.execute(text("SELECT id, file_path FROM files WHERE content_hash IS NULL")).all()
+    for file_id, file_path in rows:
+        if not file_path or not os.path.exists(file_path):
+            continue
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file_data:
+            for chunk in iter(lambda: file_data.read(64 * 1024), b''):
+                digest.update(chunk)
+        connection.execute(
+            text("UPDATE files SET content_hash = :content_hash WHERE id = :id"),
+            {'content_hash': digest.hexdigest(), 'id': file_id}
+        )
+    
+    _create_indexes(connection, 'ix_files_content_hash')
+
+def _subscriber_indexes(connection):
+    """Индексы постраничного списка и поиска подписчиков"""
+    _create_indexes(connection, 'ix_users_has_access_id', 'ix_users_username')
+
+def _events(connection):
+    """Мероприятия: уже загруженные файлы, ссылки и пользователи относятся к мероприятию по умолчанию"""
+    for table in ('files', 'subscription_links', 'users'):
+        _add_column(connection, table, f"event_id INTEGER DEFAULT {DEFAULT_EVENT_ID}")
+    
+    connection.execute(
+        text(
+            "INSERT INTO events (id, name, created_at) "
+            "SELECT :id, :name, CURRENT_TIMESTAMP "
+            "WHERE NOT EXISTS (SELECT 1 FROM events WHERE id = :id)"
+        ),
+        {'id': DEFAULT_EVENT_ID, 'name': Config.DEFAULT_EVENT_NAME}
+    )
+    if connection.dialect.name == 'postgresql':
+        # Строка вставлена с явным id — сдвигаем последовательность, иначе следующее мероприятие получит тот же id
+        connection.execute(text(
+            "SELECT setval(pg_get_serial_sequence('events', 'id'), (SELECT MAX(id) FROM events))"
+        ))
+    _create_indexes(connection, 'ix_users_event', 'ix_subscription_links_event', 'ix_files_event_free')
+
+def _reconcile_indexes(connection):
+    """Индексы поиска строк по путям файлов для сверки с диском"""
+    _create_indexes(connection, 'ix_files_file_path', 'ix_files_backup_path')
+
+def _job_delivery_marks(connection):
+    """Отметка доставки в задании на случай сбоя записи в files после отправки"""
+    _add_column(connection, 'delivery_jobs', "sent_at TIMESTAMP")
+    _add_column(connection, 'delivery_jobs', "telegram_file_id VARCHAR")
+
+def _pool_owner(connection):
+    """Владелец файлов пула: процесс освобождает только свои"""
+    _add_column(connection, 'files', "pooled_by VARCHAR")
+
+# Версии применяются по порядку и только один раз; новые миграции добавляются в конец
+MIGRATIONS = [
+    (1, "Колонки резервирования файлов и file_id Telegram", _claim_columns),
+    (2, "Индексы для частых запросов", _hot_query_indexes),
+    (3, "Хэш содержимого файлов", _content_hash),
+    (4, "Индексы списка и поиска подписчиков", _subscriber_indexes),
+    (5, "Мероприятия", _events),
+    (6, "Индексы сверки файлов с диском", _reconcile_indexes),
+    (7, "Отметка доставки в заданиях отправки", _job_delivery_marks),
+    (8, "Владелец файлов пула", _pool_owner),
+]
+
+def run_migrations(engine):
+    """Применяет к базе все еще не примененные миграции"""
+    with engine.connect() as connection:
+        applied = set(connection.execute(select(SchemaMigration.version)).scalars())
+    
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        
+        with engine.begin() as connection:
+            migrate(connection)
+            connection.execute(
+                SchemaMigration.__table__.insert().values(version=version, description=description)
+            )
+        bot_logger.logger.info(f"Применена миграция {version}: {description}")
\ No newline at end of file
@@ -1,7 +1,16 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Index
 from datetime import datetime
 from database.session import Base
 
+# Мероприятие, к которому относятся данные, загруженные до разделения по мероприятиям
+DEFAULT_EVENT_ID = 1
+
+class Event(Base):
+    __tablename__ = 'events'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
@@ -14,6 +23,18 @@ class User(Base):
     last_file_sent = Column(DateTime)
     files_received = Column(Integer, default=0)
     pending_file = Column(Boolean, default=False)
+    event_id = Column(Integer, default=DEFAULT_EVENT_ID, server_default=str(DEFAULT_EVENT_ID))
+    
+    __table_args__ = (
+        # Ожидающие файл пользователи и список подписчиков (порядок по id идет из rowid)
+        Index('ix_users_pending', 'has_access', 'files_received', 'pending_file'),
+        # Постраничный список подписчиков по ключу id
+        Index('ix_users_has_access_id', 'has_access', 'id'),
+        # Поиск подписчика по username (file_hash уникален и уже проиндексирован)
+        Index('ix_users_username', 'username'),
+        # Подписчики и ожидающие одного мероприятия
+        Index('ix_users_event', 'event_id', 'has_access', 'files_received'),
+    )
 
 class SubscriptionLink(Base):
     __tablename__ = 'subscription_links'
@@ -24,6 +45,12 @@ class SubscriptionLink(Base):
     used_by = Column(Integer, default=None)
     used_at = Column(DateTime, default=None)
     is_used = Column(Boolean, default=False)
+    event_id = Column(Integer, default=DEFAULT_EVENT_ID, server_default=str(DEFAULT_EVENT_ID))
+    
+    __table_args__ = (
+        Index('ix_subscription_links_is_used', 'is_used'),
+        Index('ix_subscription_links_event', 'event_id', 'is_used'),
+    )
 
 class File(Base):
     __tablename__ = 'files'
@@ -35,6 +62,31 @@ class File(Base):
     distributed_to = Column(Integer, default=None)
     distributed_at = Column(DateTime, default=None)
     backup_path = Column(String)
+    claim_state = Column(String, default='free', server_default='free')
+    claimed_by = Column(Integer, default=None)
+    claimed_at = Column(DateTime, default=None)
+    pooled_by = Column(String)  # процесс бота, в пуле которого лежит файл
+    telegram_file_id = Column(String)
+    content_hash = Column(String)  # SHA-256 содержимого для поиска дубликатов
+    event_id = Column(Integer, default=DEFAULT_EVENT_ID, server_default=str(DEFAULT_EVENT_ID))
+    
+    __table_args__ = (
+        # Поиск свободных файлов для резервирования по возрастанию id
+        Index('ix_files_free', 'distributed', 'claim_state', 'id'),
+        # Свободные файлы и счетчики одного мероприятия
+        Index('ix_files_event_free', 'event_id', 'distributed', 'claim_state', 'id'),
+        # Снятие зависших резерваций
+        Index('ix_files_claim_state_claimed_at', 'claim_state', 'claimed_at'),
+        # Проверка «у пользователя уже есть файл» при резервировании
+        Index('ix_files_claimed_by', 'claimed_by'),
+        # Восстановление билета пользователя
+        Index('ix_files_distributed_to', 'distributed_to', 'distributed_at'),
+        # Поиск уже загруженных копий при разборе архива
+        Index('ix_files_content_hash', 'content_hash'),
+        # Сверка файлов на диске с базой
+        Index('ix_files_file_path', 'file_path'),
+        Index('ix_files_backup_path', 'backup_path'),
+    )
 
 class FileDelivery(Base):
     __tablename__ = 'file_deliveries'
@@ -46,12 +98,55 @@ class FileDelivery(Base):
     error_message = Column(Text)
     recovery_attempts = Column(Integer, default=0)
     last_recovery_attempt = Column(DateTime)
+    
+    __table_args__ = (
+        Index('ix_file_deliveries_user_file', 'user_id', 'file_id'),
+        Index('ix_file_deliveries_file_id', 'file_id'),
+    )
+
+class DeliveryJob(Base):
+    __tablename__ = 'delivery_jobs'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    file_id = Column(Integer, nullable=False)
+    kind = Column(String, default='deliver', nullable=False)  # deliver или recover
+    state = Column(String, default='queued', nullable=False)  # queued, running, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    batch = Column(String)  # запуск рассылки, к которому относится задание
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    # Файл уже доставлен, но отметка в files не записалась: повторяется только она
+    sent_at = Column(DateTime)
+    telegram_file_id = Column(String)
+    
+    __table_args__ = (
+        # Выборка заданий, которым пришло время отправки
+        Index('ix_delivery_jobs_due', 'state', 'next_attempt_at'),
+        # Прогресс рассылки для администратора
+        Index('ix_delivery_jobs_batch', 'batch', 'state'),
+        # Резервации с активным заданием не считаются зависшими
+        Index('ix_delivery_jobs_file', 'file_id', 'state'),
+        # Повторный /recover, пока предыдущий еще в очереди
+        Index('ix_delivery_jobs_user', 'user_id', 'state'),
+    )
 
 class Admin(Base):
     __tablename__ = 'admins'
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, unique=True)
+    user_id = Column(Integer, unique=True)  # уникальность уже дает индекс
     username = Column(String)
     first_name = Column(String)
     added_by = Column(Integer)
-    added_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    added_at = Column(DateTime, default=datetime.utcnow)
+
+class StatCounter(Base):
+    __tablename__ = 'stat_counters'
+    name = Column(String, primary_key=True)
+    value = Column(Integer, default=0, nullable=False)
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+    version = Column(Integer, primary_key=True)
+    description = Column(String)
+    applied_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
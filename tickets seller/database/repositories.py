@@ -0,0 +1,239 @@
+from typing import List, Optional, Set, Tuple
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from database.session import Session
+from database.models import User, File, FileDelivery, Admin, Event, DEFAULT_EVENT_ID
+
+# Синхронные функции доступа к данным. Из обработчиков вызываются через
+# database.executor.run_db, возвращают отсоединенные от сессии объекты.
+
+class UserRepository:
+    """Запросы к пользователям"""
+    
+    @staticmethod
+    def get_by_user_id(user_id: int) -> Optional[User]:
+        """Пользователь по Telegram ID"""
+        session = Session()
+        try:
+            return session.query(User).filter_by(user_id=user_id).first()
+        finally:
+            session.close()
+    
+    @staticmethod
+    def has_access(user_id: int) -> bool:
+        """Есть ли у пользователя активная подписка"""
+        session = Session()
+        try:
+            has_access = session.query(User.has_access).filter_by(user_id=user_id).scalar()
+            return bool(has_access)
+        finally:
+            session.close()
+    
+    @staticmethod
+    def update_profile(user_id: int, username: str, first_name: str) -> Optional[User]:
+        """Сохраняет имя пользователя после активации подписки"""
+        session = Session()
+        try:
+            user = session.query(User).filter_by(user_id=user_id).first()
+            if user:
+                user.username = username
+                user.first_name = first_name
+                user.pending_file = True
+                session.commit()
+            return user
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def subscribers_page(cursor: int = 0, backward: bool = False, limit: int = 20) -> Tuple[List[User], bool, bool]:
+        """Страница подписчиков после id cursor (или перед ним) и признаки соседних страниц"""
+        session = Session()
+        try:
+            query = session.query(User).filter(User.has_access == True)
+            if backward:
+                query = query.filter(User.id < cursor).order_by(User.id.desc())
+            else:
+                query = query.filter(User.id > cursor).order_by(User.id)
+            
+            # Лишняя строка показывает, есть ли еще страница в этом направлении
+            users = query.limit(limit + 1).all()
+            has_more = len(users) > limit
+            users = users[:limit]
+            
+            if backward:
+                users.reverse()
+                return users, has_more, True
+            return users, cursor > 0, has_more
+        finally:
+            session.close()
+    
+    @staticmethod
+    def find_subscribers(term: str, limit: int = 20) -> List[User]:
+        """Поиск подписчика с доступом по точному username или уникальному ID (file_hash)"""
+        session = Session()
+        try:
+            # Как и в списке подписчиков, пользователи без доступа не показываются
+            return session.query(User).filter(
+                User.has_access == True,
+                (User.username == term.lstrip('@')) | (User.file_hash == term)
+            ).order_by(User.id).limit(limit).all()
+        finally:
+            session.close()
+
+class AdminRepository:
+    """Запросы к администраторам"""
+    
+    @staticmethod
+    def admin_ids() -> Set[int]:
+        """Telegram ID администраторов из базы"""
+        session = Session()
+        try:
+            return {row.user_id for row in session.query(Admin.user_id).all()}
+        finally:
+            session.close()
+    
+    @staticmethod
+    def add(user_id: int, username: str, first_name: str, added_by: int) -> bool:
+        """Добавляет администратора, если его еще нет"""
+        session = Session()
+        try:
+            if session.query(Admin.id).filter_by(user_id=user_id).first():
+                return False
+            session.add(Admin(user_id=user_id, username=username, first_name=first_name, added_by=added_by))
+            session.commit()
+            return True
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def remove(user_id: int) -> bool:
+        """Удаляет администратора"""
+        session = Session()
+        try:
+            deleted = session.query(Admin).filter_by(user_id=user_id).delete()
+            session.commit()
+            return deleted > 0
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def list_with_inviters() -> List[Tuple[Admin, str]]:
+        """Администраторы вместе с именем добавившего"""
+        session = Session()
+        try:
+            inviter = aliased(Admin)
+            rows = session.query(Admin, inviter.first_name).outerjoin(
+                inviter, inviter.user_id == Admin.added_by
+            ).order_by(Admin.id).all()
+            return [(admin, inviter_name if inviter_name is not None else "Система") for admin, inviter_name in rows]
+        finally:
+            session.close()
+
+class EventRepository:
+    """Запросы к мероприятиям"""
+    
+    @staticmethod
+    def list_all() -> List[Event]:
+        """Все мероприятия по порядку создания"""
+        session = Session()
+        try:
+            return session.query(Event).order_by(Event.id).all()
+        finally:
+            session.close()
+    
+    @staticmethod
+    def has_several() -> bool:
+        """Есть ли второе мероприятие (без подсчета всех)"""
+        session = Session()
+        try:
+            return session.query(Event.id).order_by(Event.id).offset(1).limit(1).first() is not None
+        finally:
+            session.close()
+    
+    @staticmethod
+    def get(event_id: int) -> Optional[Event]:
+        """Мероприятие по id"""
+        session = Session()
+        try:
+            return session.get(Event, event_id)
+        finally:
+            session.close()
+    
+    @staticmethod
+    def get_by_name(name: str) -> Optional[Event]:
+        """Мероприятие по точному названию"""
+        session = Session()
+        try:
+            return session.query(Event).filter_by(name=name.strip()).first()
+        finally:
+            session.close()
+    
+    @staticmethod
+    def get_or_create(name: str) -> Event:
+        """Мероприятие по названию; без названия — мероприятие по умолчанию"""
+        name = (name or "").strip()
+        session = Session()
+        try:
+            if not name:
+                return session.get(Event, DEFAULT_EVENT_ID)
+            
+            event = session.query(Event).filter_by(name=name).first()
+            if event:
+                return event
+            
+            event = Event(name=name)
+            session.add(event)
+            try:
+                session.commit()
+            except IntegrityError:
+                # Такое же мероприятие только что создала параллельная загрузка
+                session.rollback()
+                event = session.query(Event).filter_by(name=name).one()
+            return event
+        finally:
+            session.close()
+
+class FileRepository:
+    """Запросы к файлам"""
+    
+    @staticmethod
+    def get_last_distributed(user_id: int) -> Optional[File]:
+        """Последний выданный пользователю файл"""
+        session = Session()
+        try:
+            return session.query(File).filter_by(
+                distributed_to=user_id,
+                distributed=True
+            ).order_by(File.distributed_at.desc()).first()
+        finally:
+            session.close()
+
+class DeliveryRepository:
+    """Запросы к истории доставок"""
+    
+    @staticmethod
+    def recent_for_user(user_id: int, limit: int = 10) -> Tuple[List[Tuple[FileDelivery, str]], int]:
+        """Последние доставки пользователя с именами файлов и общее число доставок"""
+        session = Session()
+        try:
+            total = session.query(func.count(FileDelivery.id)).filter(FileDelivery.user_id == user_id).scalar()
+            rows = session.query(FileDelivery, File.original_name).outerjoin(
+                File, File.id == FileDelivery.file_id
+            ).filter(
+                FileDelivery.user_id == user_id
+            ).order_by(FileDelivery.id.desc()).limit(limit).all()
+            
+            # Показываем в хронологическом порядке
+            return [(delivery, file_name or "Неизвестно") for delivery, file_name in reversed(rows)], total
+        finally:
+            session.close()
\ No newline at end of file
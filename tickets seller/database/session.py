@@ -1,10 +1,111 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool, StaticPool
+from config import Config
 
 Base = declarative_base()
-engine = create_engine('sqlite:///subscription_bot.db', echo=False)
-Session = sessionmaker(bind=engine)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Настраивает каждое новое соединение SQLite"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={Config.DB_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={Config.DB_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size=-{Config.DB_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={Config.DB_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA temp_store={Config.DB_TEMP_STORE}")
+        cursor.execute(f"PRAGMA busy_timeout={Config.DB_BUSY_TIMEOUT_MS}")
+    finally:
+        cursor.close()
+
+def database_url() -> str:
+    """Адрес базы из Config: DATABASE_URL или файл SQLite DB_PATH"""
+    return Config.DATABASE_URL or f"sqlite:///{Config.DB_PATH}"
+
+def create_db_engine(db_path: str = None, url: str = None):
+    """Создает движок с настройками из Config (SQLite по пути или любая база по URL)"""
+    url = url or (f"sqlite:///{db_path}" if db_path else database_url())
+    
+    if not url.startswith('sqlite'):
+        # Серверная база: только пул соединений, прагмы SQLite не нужны
+        return create_engine(
+            url,
+            echo=Config.DB_ECHO,
+            pool_size=Config.DB_POOL_SIZE,
+            max_overflow=Config.DB_MAX_OVERFLOW,
+            pool_pre_ping=True
+        )
+    
+    db_path = url.split(':///', 1)[1] if ':///' in url else ':memory:'
+    if db_path in ('', ':memory:'):
+        # У каждого соединения своя память — держим одно общее
+        pool_options = {'poolclass': StaticPool}
+    else:
+        pool_options = {
+            'poolclass': QueuePool,
+            'pool_size': Config.DB_POOL_SIZE,
+            'max_overflow': Config.DB_MAX_OVERFLOW
+        }
+    
+    db_engine = create_engine(
+        url,
+        echo=Config.DB_ECHO,
+        connect_args={
+            # Соединения из пула используются в разных потоках
+            'check_same_thread': False,
+            'timeout': Config.DB_BUSY_TIMEOUT_MS / 1000
+        },
+        **pool_options
+    )
+    event.listen(db_engine, 'connect', _set_sqlite_pragmas)
+    return db_engine
+
+engine = create_db_engine()
+# Объекты остаются читаемыми после commit и закрытия сессии в потоке БД
+Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+def skip_locked_supported() -> bool:
+    """Поддерживает ли база SELECT ... FOR UPDATE SKIP LOCKED (несколько процессов бота)"""
+    return engine.dialect.name == 'postgresql'
+
+def lock_rows(query):
+    """Блокирует выбранные строки до конца транзакции, пропуская занятые другими процессами.
+    В SQLite запрос не меняется: писатель там всегда один"""
+    if skip_locked_supported():
+        return query.with_for_update(skip_locked=True)
+    return query
+
+def check_db_settings() -> dict:
+    """Логирует фактические настройки SQLite (или версию серверной базы) и возвращает их"""
+    from services.logger import bot_logger
+    
+    if engine.dialect.name != 'sqlite':
+        with engine.connect() as connection:
+            version = ".".join(str(part) for part in connection.dialect.server_version_info or ())
+        bot_logger.logger.info("База данных: %s %s", engine.dialect.name, version)
+        return {'dialect': engine.dialect.name, 'server_version': version}
+    
+    pragmas = ['journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout']
+    with engine.connect() as connection:
+        settings = {
+            pragma: connection.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+            for pragma in pragmas
+        }
+    
+    bot_logger.logger.info(
+        "Настройки SQLite: " + ", ".join(f"{name}={value}" for name, value in settings.items())
+    )
+    if str(settings['journal_mode']).upper() != Config.DB_JOURNAL_MODE.upper():
+        bot_logger.logger.warning(
+            f"SQLite работает в режиме {settings['journal_mode']} вместо {Config.DB_JOURNAL_MODE}"
+        )
+    return settings
 
 def init_db():
     """Инициализация базы данных"""
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    # Импортируем здесь: модели и миграции сами зависят от Base
+    from database.migrations import run_migrations
+    
+    Base.metadata.create_all(engine)
+    run_migrations(engine)
+    check_db_settings()
\ No newline at end of file
@@ -1,27 +1,34 @@
+import csv
+import io
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from services.auth import AuthService
 from services.logger import bot_logger
 from services.subscription import SubscriptionService
-from database.session import Session
-from database.models import User, File, Admin
+from database.executor import run_db
+from services.stats import StatsService
+from services.metrics import metrics
+from database.repositories import UserRepository, EventRepository
+from config import Config
 
 class AdminHandler:
     """Обработчики административных команд"""
     
     @staticmethod
     async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Панель администратора"""
+        """Панель администратора (команда или кнопка «Назад»)"""
         user = update.effective_user
         
-        if not AuthService.is_admin(user.id):
-            await update.message.reply_text("❌ Доступ запрещен")
+        if not await AuthService.is_admin(user.id):
+            await update.effective_message.reply_text("❌ Доступ запрещен")
             return
         
-        bot_logger.log_admin_action(user, "Открытие панели администратора")
+        await bot_logger.admin_action(user, "Открытие панели администратора")
         
         # Получаем статистику
-        users_without_files, free_files = AdminHandler._get_stats()
+        users_without_files, free_files = await AdminHandler._get_stats()
+        event_lines = await AdminHandler._get_event_lines()
         
         keyboard = [
             [InlineKeyboardButton("🔗 Создать ссылку подписки", callback_data="create_link")],
@@ -31,6 +38,7 @@ class AdminHandler:
             [InlineKeyboardButton(f"🚀 Отправить ожидающим ({users_without_files})", callback_data="send_pending")],
             [InlineKeyboardButton("📦 Архив свободных билетов", callback_data="free_tickets_archive")],
             [InlineKeyboardButton("👥 Список подписчиков", callback_data="subscribers_list")],
+            [InlineKeyboardButton("📑 Отчеты", callback_data="reports")],
             [InlineKeyboardButton("👑 Управление админами", callback_data="manage_admins")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -38,39 +46,329 @@ class AdminHandler:
         status_info = ""
         if users_without_files > 0:
             status_info = f"\n\n⚠️ *{users_without_files} пользователей ожидают файлы*\n🆓 Свободных файлов: {free_files}"
+        if event_lines:
+            status_info += "\n\n" + "\n".join(event_lines)
         
-        await update.message.reply_text(
-            f"👑 Панель управления{status_info}\n\n"
-            "Выберите действие:",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
+        text = f"👑 Панель управления{status_info}\n\nВыберите действие:"
+        if update.callback_query:
+            # По кнопке панель открывается в том же сообщении, update.message тут нет
+            await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        else:
+            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
     
     @staticmethod
-    def _get_stats():
+    async def _get_stats():
         """Получает статистику для админ-панели"""
-        session = Session()
         try:
-            users_without_files = session.query(User).filter(
-                User.has_access == True,
-                User.files_received == 0
-            ).count()
-            
-            free_files = session.query(File).filter_by(distributed=False).count()
-            return users_without_files, free_files
+            stats = await run_db(StatsService.get_stats)
+            return stats['users_without_files'], stats['free_files']
         except Exception as e:
             bot_logger.logger.error(f"Ошибка получения статистики: {e}")
             return 0, 0
-        finally:
-            session.close()
+    
+    @staticmethod
+    async def _get_event_lines() -> list:
+        """Свободные файлы и ожидающие по мероприятиям, если мероприятий несколько"""
+        try:
+            # Подсчет по мероприятиям нужен только при втором мероприятии
+            if not await run_db(EventRepository.has_several):
+                return []
+            event_stats = await run_db(StatsService.get_event_stats)
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка получения статистики мероприятий: {e}")
+            return []
+        
+        return [
+            f"🎟 {event.name}: свободно {stats['free_files']}, ожидают {stats['users_without_files']}"
+            for event, stats in event_stats
+        ]
     
     @staticmethod
     async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Добавление администратора"""
         user = update.effective_user
         
-        if not AuthService.is_admin(user.id):
+        if not await AuthService.is_admin(user.id):
+            await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+            return
+        
+        target = AdminHandler._get_target_user(update, context)
+        if not target:
+            await update.message.reply_text(
+                "ℹ️ Использование: /addadmin <ID пользователя>\n"
+                "или ответьте командой на сообщение пользователя."
+            )
+            return
+        
+        target_id, username, first_name = target
+        if await AuthService.add_admin(target_id, username, first_name, user.id):
+            await bot_logger.admin_action(user, "Добавление администратора", f"ID: {target_id}")
+            await update.message.reply_text(f"✅ Пользователь {target_id} назначен администратором.")
+        else:
+            await update.message.reply_text("❌ Не удалось добавить администратора (возможно, он уже добавлен).")
+    
+    @staticmethod
+    async def remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Удаление администратора"""
+        user = update.effective_user
+        
+        if not await AuthService.is_admin(user.id):
             await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
             return
         
-        # ... остальная логика добавления админа
\ No newline at end of file
+        target = AdminHandler._get_target_user(update, context)
+        if not target:
+            await update.message.reply_text("ℹ️ Использование: /removeadmin <ID пользователя>")
+            return
+        
+        target_id = target[0]
+        if await AuthService.remove_admin(target_id):
+            await bot_logger.admin_action(user, "Удаление администратора", f"ID: {target_id}")
+            await update.message.reply_text(f"✅ Пользователь {target_id} больше не администратор.")
+        else:
+            await update.message.reply_text("❌ Администратор не найден в базе.")
+    
+    @staticmethod
+    def _get_target_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Пользователь из аргумента команды или из сообщения, на которое ответили"""
+        reply = update.message.reply_to_message
+        if reply and reply.from_user:
+            return reply.from_user.id, reply.from_user.username or "", reply.from_user.first_name or ""
+        
+        if context.args and context.args[0].isdigit():
+            return int(context.args[0]), "", ""
+        
+        return None
+    
+    @staticmethod
+    def format_subscriber(index: int, sub) -> str:
+        """Строка с данными подписчика для списков"""
+        sub_date = sub.subscription_date.strftime('%d.%m.%Y') if sub.subscription_date else "неизвестно"
+        return (
+            f"{index}. {sub.first_name} (@{sub.username})\n"
+            f"   🆔 ID: {sub.file_hash}\n"
+            f"   📅 Подписка с: {sub_date}\n\n"
+        )
+    
+    @staticmethod
+    async def find_subscriber(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /findsub — поиск подписчика по username или ID"""
+        user = update.effective_user
+        
+        if not await AuthService.is_admin(user.id):
+            await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+            return
+        
+        if not context.args:
+            await update.message.reply_text("ℹ️ Использование: /findsub <username или ID>")
+            return
+        
+        term = context.args[0]
+        try:
+            subscribers = await run_db(UserRepository.find_subscribers, term)
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка поиска подписчика: {e}")
+            await update.message.reply_text("❌ Ошибка при поиске")
+            return
+        
+        if not subscribers:
+            await update.message.reply_text(f"🔍 Подписчик «{term}» не найден")
+            return
+        
+        result_text = "🔍 Найденные подписчики:\n\n"
+        for i, sub in enumerate(subscribers, 1):
+            result_text += AdminHandler.format_subscriber(i, sub)
+        
+        await update.message.reply_text(result_text)
+    
+    @staticmethod
+    async def bulk_links(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /links — пачка ссылок подписки одним файлом"""
+        user = update.effective_user
+        
+        if not await AuthService.is_admin(user.id):
+            await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+            return
+        
+        if not context.args or not context.args[0].isdigit() or not 0 < int(context.args[0]) <= Config.BULK_LINKS_MAX:
+            await update.message.reply_text(
+                f"ℹ️ Использование: /links <количество до {Config.BULK_LINKS_MAX}> [мероприятие]"
+            )
+            return
+        
+        count = int(context.args[0])
+        event_name = " ".join(context.args[1:])
+        event = await run_db(
+            EventRepository.get_by_name if event_name else EventRepository.get_or_create,
+            event_name
+        )
+        if not event:
+            await update.message.reply_text(f"❌ Мероприятие «{event_name}» не найдено")
+            return
+        
+        await bot_logger.admin_action(user, "Пакетное создание ссылок", f"{count} шт., мероприятие: {event.name}")
+        
+        links = await run_db(
+            SubscriptionService.create_subscription_links, user.id, count, context.bot.username, event.id
+        )
+        if not links:
+            await update.message.reply_text("❌ Ошибка при создании ссылок")
+            return
+        
+        await update.message.reply_document(
+            document=AdminHandler._links_csv(links, event.name),
+            filename=f"links_{event.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            caption=f"🔗 Создано ссылок: {len(links)}\n🎟 Мероприятие: {event.name}"
+        )
+    
+    @staticmethod
+    def _links_csv(links: list, event_name: str) -> bytes:
+        """CSV со ссылками; BOM нужен, чтобы Excel правильно открыл кириллицу"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+        writer.writerow(["Ссылка", "Мероприятие"])
+        writer.writerows([link, event_name] for link in links)
+        return buffer.getvalue().encode('utf-8-sig')
+    
+    @staticmethod
+    async def perf(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /perf — перцентили времени обработчиков и Bot API"""
+        user = update.effective_user
+        
+        if not await AuthService.is_admin(user.id):
+            await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+            return
+        
+        handler_times = metrics.summary('handler_duration_seconds')
+        handler_queries = metrics.summary('handler_db_queries')
+        
+        perf_text = "⏱ Обработчики (p50 / p95 / p99, мс):\n\n"
+        if not handler_times:
+            perf_text += "Нет данных\n"
+        # Самые медленные по p99 — первыми
+        for name, (count, p50, p95, p99) in sorted(handler_times.items(), key=lambda item: -item[1][3]):
+            queries_p95 = handler_queries.get(name, (0, 0, 0, 0))[2]
+            errors = metrics.counter('handler_errors_total', 'handler', name)
+            perf_text += (
+                f"{name}: {p50 * 1000:.0f} / {p95 * 1000:.0f} / {p99 * 1000:.0f}\n"
+                f"   вызовов: {count}, ошибок: {errors}, запросов к БД (p95): {queries_p95:.0f}\n"
+            )
+        
+        perf_text += "\n📡 Bot API (p50 / p95 / p99, мс):\n"
+        for method, (count, p50, p95, p99) in metrics.summary('bot_api_duration_seconds').items():
+            perf_text += f"{method}: {p50 * 1000:.0f} / {p95 * 1000:.0f} / {p99 * 1000:.0f} ({count} вызовов)\n"
+        perf_text += (
+            f"429 Too Many Requests: {metrics.counter('bot_api_flood_total', 'method', 'sendDocument')}\n"
+            f"Ошибок отправки: {metrics.counter('bot_api_errors_total', 'method', 'sendDocument')}\n"
+            f"🗄 Всего запросов к БД: {metrics.counter('db_queries_total')}"
+        )
+        
+        await update.message.reply_text(perf_text)
+    
+    @staticmethod
+    async def send_pending_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /send_pending — отправка файлов ожидающим"""
+        user = update.effective_user
+        
+        if not await AuthService.is_admin(user.id):
+            await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+            return
+        
+        await bot_logger.admin_action(user, "Автоматическая отправка файлов ожидающим")
+        
+        message = await update.message.reply_text("🔍 Ищу пользователей без файлов...")
+        await AdminHandler.run_send_pending(message.edit_text)
+    
+    @staticmethod
+    def _send_pending_reporter(edit_message, result: dict):
+        """Обратный вызов очереди: прогресс рассылки и итог в сообщении администратора"""
+        # Импортируем сервисы локально, чтобы избежать циклического импорта
+        from services.delivery_queue import DeliveryQueue
+        
+        reported = [None]
+        
+        async def report(progress: dict):
+            sent_count = progress['done']
+            failed_count = progress['failed']
+            if progress['active']:
+                # Повторы заданий дают отчеты с тем же счетом, а Telegram не принимает правку без изменений
+                text = f"🔄 Отправка файлов: {sent_count + failed_count}/{result['queued']}..."
+                if text != reported[0]:
+                    reported[0] = text
+                    await edit_message(text)
+                return
+            
+            processed_count = sent_count + failed_count + result['no_file']
+            result_message = (
+                f"✅ Автоматическая отправка завершена!\n\n"
+                f"📨 Успешно отправлено: {sent_count}/{processed_count}\n"
+                f"👥 Обработано пользователей: {processed_count}"
+            )
+            
+            if failed_count:
+                failed_users = await run_db(DeliveryQueue.failed_users, result['batch'], 5)
+                result_message += f"\n\n❌ Не удалось отправить {failed_count} пользователям:\n"
+                result_message += "\n".join(
+                    f"{user_obj.first_name} (@{user_obj.username})" for user_obj in failed_users
+                )
+                if failed_count > 5:
+                    result_message += f"\n... и еще {failed_count - 5}"
+            
+            await edit_message(result_message)
+        
+        return report
+    
+    @staticmethod
+    async def run_send_pending(edit_message):
+        """Ставит отправку ожидающим в очередь; прогресс и итог сообщает очередь через edit_message"""
+        try:
+            # Импортируем сервисы локально, чтобы избежать циклического импорта
+            from services.claims import ClaimService
+            from services.delivery_queue import DeliveryQueue, delivery_worker
+            
+            pending_count = await run_db(ClaimService.count_pending)
+            
+            if not pending_count:
+                await edit_message("✅ Все пользователи уже получили свои файлы!")
+                return
+            
+            free_count = await run_db(ClaimService.count_free)
+            
+            if not free_count:
+                await edit_message("❌ Нет свободных файлов для отправки!")
+                return
+            
+            if free_count < pending_count:
+                await edit_message(
+                    f"⚠️ Недостаточно свободных файлов!\n"
+                    f"Пользователей без файлов: {pending_count}\n"
+                    f"Свободных файлов: {free_count}"
+                )
+                return
+            
+            # Файлы не переходят между мероприятиями — нехватка проверяется по каждому
+            shortages = [
+                f"🎟 {event.name}: ожидают {stats['users_without_files']}, свободно {stats['free_files']}"
+                for event, stats in await run_db(StatsService.get_event_stats)
+                if stats['free_files'] < stats['users_without_files']
+            ]
+            if shortages:
+                await edit_message("⚠️ Недостаточно свободных файлов!\n\n" + "\n".join(shortages))
+                return
+            
+            await edit_message(
+                f"🔄 Начинаю отправку файлов {pending_count} пользователям..."
+            )
+            
+            # Отправкой занимается фоновая очередь, обработчик ее не ждет: прогресс
+            # и итог очередь сама пишет в это сообщение. Наблюдатель регистрируется
+            # до постановки заданий, чтобы не пропустить ни одного результата
+            result = {'batch': DeliveryQueue.new_batch(), 'queued': 0, 'no_file': 0}
+            delivery_worker.watch(result['batch'], AdminHandler._send_pending_reporter(edit_message, result))
+            result.update(await run_db(DeliveryQueue.enqueue_pending, False, result['batch']))
+            delivery_worker.wake()
+            await delivery_worker.expect(result['batch'], result['queued'])
+            
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка в send_pending: {e}")
+            await edit_message("❌ Ошибка при отправке файлов")
\ No newline at end of file
@@ -1,10 +1,17 @@
+import os
+import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from services.auth import AuthService
 from services.logger import bot_logger
 from services.subscription import SubscriptionService
-from database.session import Session
-from database.models import User, File, FileDelivery, SubscriptionLink, Admin
+from services.stats import StatsService
+from database.executor import run_db
+from database.repositories import UserRepository, AdminRepository, DeliveryRepository, EventRepository
+from database.models import DEFAULT_EVENT_ID
+from services.ticket_archive import TicketArchiveService
+from utils.excel_generator import ExcelGenerator
+from config import Config
 
 class CallbackHandler:
     """Обработчик callback кнопок"""
@@ -24,9 +31,8 @@ class CallbackHandler:
             return
         
         elif query.data == "delivery_stats":
-            session = Session()
             try:
-                deliveries = session.query(FileDelivery).filter_by(user_id=user.id).all()
+                deliveries, total = await run_db(DeliveryRepository.recent_for_user, user.id, 10)
                 
                 if not deliveries:
                     await query.edit_message_text("📊 У вас еще нет истории доставок.")
@@ -34,10 +40,7 @@ class CallbackHandler:
                 
                 stats_text = "📊 Детальная статистика доставок:\n\n"
                 
-                for i, delivery in enumerate(deliveries[-10:], 1):
-                    file = session.query(File).filter_by(id=delivery.file_id).first()
-                    file_name = file.original_name if file else "Неизвестно"
-                    
+                for i, (delivery, file_name) in enumerate(deliveries, 1):
                     status_emoji = "✅" if delivery.delivery_status == 'sent' else "🔁" if delivery.delivery_status == 'recovered' else "❌"
                     
                     stats_text += (
@@ -51,26 +54,27 @@ class CallbackHandler:
                     
                     stats_text += "\n"
                 
-                if len(deliveries) > 10:
-                    stats_text += f"... и еще {len(deliveries) - 10} доставок\n"
+                if total > len(deliveries):
+                    stats_text += f"... и еще {total - len(deliveries)} доставок\n"
                 
                 await query.edit_message_text(stats_text)
                 
             except Exception as e:
                 bot_logger.logger.error(f"Ошибка при получении статистики доставок: {e}")
                 await query.edit_message_text("❌ Ошибка при получении статистики.")
-            finally:
-                session.close()
             return
         
         # Проверяем права доступа для админ-функций
-        if not AuthService.is_admin(user.id):
+        if not await AuthService.is_admin(user.id):
             await query.edit_message_text("❌ Доступ запрещен")
             return
         
         # Обработка админ-кнопок
         if query.data == "create_link":
-            await CallbackHandler._handle_create_link(query, user)
+            await CallbackHandler._handle_create_link(query, user, context)
+        
+        elif query.data.startswith("link:"):
+            await CallbackHandler._handle_create_link(query, user, context, int(query.data.split(":", 1)[1]))
         
         elif query.data == "stats":
             await CallbackHandler._handle_stats(query, user)
@@ -81,15 +85,30 @@ class CallbackHandler:
         elif query.data == "upload_zip":
             await CallbackHandler._handle_upload_zip(query, user)
         
+        elif query.data.startswith("zip_new:") or query.data.startswith("zip_cancel:"):
+            action, upload_id = query.data.split(":", 1)
+            await CallbackHandler._handle_zip_new_event(query, user, context, upload_id, action == "zip_new")
+        
         elif query.data == "distribute_files":
             await CallbackHandler._handle_distribute_files(query, user, context)
         
         elif query.data == "free_tickets_archive":
-            await CallbackHandler._handle_free_tickets_archive(query, user)
+            await CallbackHandler._handle_free_tickets_archive(query, user, context)
         
         elif query.data == "subscribers_list":
             await CallbackHandler._handle_subscribers_list(query, user)
         
+        elif query.data.startswith("subs:"):
+            # subs:n:<id> — страница после id, subs:p:<id> — страница перед id
+            _, direction, cursor = query.data.split(":")
+            await CallbackHandler._handle_subscribers_list(query, user, int(cursor), direction == "p")
+        
+        elif query.data == "reports":
+            await CallbackHandler._handle_reports(query, user)
+        
+        elif query.data.startswith("report:"):
+            await CallbackHandler._handle_report_export(query, user, context, query.data.split(":", 1)[1])
+        
         elif query.data == "manage_admins":
             await CallbackHandler._handle_manage_admins(query, user)
         
@@ -97,11 +116,28 @@ class CallbackHandler:
             await CallbackHandler._handle_back_to_admin(update, context)
     
     @staticmethod
-    async def _handle_create_link(query, user):
+    async def _handle_create_link(query, user, context, event_id: int = None):
         """Обработка создания ссылки"""
-        await bot_logger.log_admin_action(user, "Создание ссылки подписки")
+        if event_id is None:
+            events = await run_db(EventRepository.list_all)
+            if len(events) > 1:
+                # Ссылка привязывается к мероприятию — сначала выбираем его
+                keyboard = [
+                    [InlineKeyboardButton(f"🎟 {event.name}", callback_data=f"link:{event.id}")]
+                    for event in events
+                ]
+                keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_admin")])
+                await query.edit_message_text(
+                    "🎟 Выберите мероприятие для ссылки:",
+                    reply_markup=InlineKeyboardMarkup(keyboard)
+                )
+                return
+            event_id = events[0].id if events else DEFAULT_EVENT_ID
+        
+        await bot_logger.admin_action(user, "Создание ссылки подписки", f"Мероприятие: {event_id}")
         
-        link = SubscriptionService.create_subscription_link(user.id)
+        # username бота PTB получает через get_me при запуске и хранит в context.bot
+        link = await run_db(SubscriptionService.create_subscription_link, user.id, context.bot.username, event_id)
         if link:
             await query.edit_message_text(
                 f"✅ Ссылка для подписки создана!\n\n"
@@ -116,121 +152,88 @@ class CallbackHandler:
     @staticmethod
     async def _handle_stats(query, user):
         """Обработка показа статистики"""
-        await bot_logger.log_admin_action(user, "Просмотр статистики")
+        await bot_logger.admin_action(user, "Просмотр статистики")
         
-        session = Session()
         try:
-            users_count = session.query(User).count()
-            active_users = session.query(User).filter_by(has_access=True).count()
-            files_count = session.query(File).count()
-            distributed_files = session.query(File).filter_by(distributed=True).count()
-            free_files = session.query(File).filter_by(distributed=False).count()
-            links_count = session.query(SubscriptionLink).count()
-            used_links = session.query(SubscriptionLink).filter_by(is_used=True).count()
+            stats = await run_db(StatsService.get_stats)
             
             stats_text = (
                 f"📊 Статистика бота:\n\n"
-                f"👥 Всего пользователей: {users_count}\n"
-                f"✅ Активных подписок: {active_users}\n"
-                f"📁 Всего файлов: {files_count}\n"
-                f"📨 Распределено файлов: {distributed_files}\n"
-                f"📋 Свободных файлов: {free_files}\n"
-                f"🔗 Создано ссылок: {links_count}\n"
-                f"🎫 Использовано ссылок: {used_links}"
+                f"👥 Всего пользователей: {stats['users_count']}\n"
+                f"✅ Активных подписок: {stats['active_users']}\n"
+                f"📁 Всего файлов: {stats['files_count']}\n"
+                f"📨 Распределено файлов: {stats['distributed_files']}\n"
+                f"📋 Свободных файлов: {stats['free_files']}\n"
+                f"🔗 Создано ссылок: {stats['links_count']}\n"
+                f"🎫 Использовано ссылок: {stats['used_links']}"
             )
             
+            event_stats = await run_db(StatsService.get_event_stats)
+            if len(event_stats) > 1:
+                stats_text += "\n\n🎟 По мероприятиям:"
+                for event, event_counts in event_stats:
+                    stats_text += (
+                        f"\n\n{event.name}\n"
+                        f"   📁 Файлов: {event_counts['files_count']}, "
+                        f"распределено: {event_counts['distributed_files']}, "
+                        f"свободно: {event_counts['free_files']}\n"
+                        f"   ✅ Подписок: {event_counts['active_users']}, "
+                        f"ожидают файл: {event_counts['users_without_files']}\n"
+                        f"   🔗 Ссылок: {event_counts['links_count']}, использовано: {event_counts['used_links']}"
+                    )
+            
             await query.edit_message_text(stats_text)
         except Exception as e:
             bot_logger.logger.error(f"Ошибка при получении статистики: {e}")
             await query.edit_message_text("❌ Ошибка при получении статистики")
-        finally:
-            session.close()
     
     @staticmethod
     async def _handle_send_pending(query, user, context):
         """Обработка отправки файлов ожидающим"""
-        await bot_logger.log_admin_action(user, "Автоматическая отправка файлов ожидающим")
+        await bot_logger.admin_action(user, "Автоматическая отправка файлов ожидающим")
         
         await query.edit_message_text("🔍 Ищу пользователей без файлов...")
         
-        session = Session()
-        try:
-            users_without_files = session.query(User).filter(
-                User.has_access == True,
-                User.files_received == 0
-            ).all()
-            
-            if not users_without_files:
-                await query.edit_message_text("✅ Все пользователи уже получили свои файлы!")
-                return
-            
-            free_files = session.query(File).filter_by(distributed=False).all()
-            
-            if not free_files:
-                await query.edit_message_text("❌ Нет свободных файлов для отправки!")
-                return
-            
-            if len(free_files) < len(users_without_files):
-                await query.edit_message_text(
-                    f"⚠️ Недостаточно свободных файлов!\n"
-                    f"Пользователей без файлов: {len(users_without_files)}\n"
-                    f"Свободных файлов: {len(free_files)}"
-                )
-                return
-            
-            await query.edit_message_text(
-                f"🔄 Начинаю отправку файлов {len(users_without_files)} пользователям..."
-            )
-            
-            # Импортируем FileManager локально, чтобы избежать циклического импорта
-            from services.file_manager import FileManager
-            
-            sent_count = 0
-            failed_users = []
-            
-            for user_obj, file in zip(users_without_files, free_files):
-                try:
-                    success = await FileManager.send_file_to_user(user_obj, file, context.application)
-                    if success:
-                        sent_count += 1
-                    else:
-                        failed_users.append(f"{user_obj.first_name} (@{user_obj.username})")
-                        
-                except Exception as e:
-                    bot_logger.logger.error(f"Ошибка отправки пользователю {user_obj.user_id}: {e}")
-                    failed_users.append(f"{user_obj.first_name} (@{user_obj.username})")
-                    continue
-            
-            result_message = (
-                f"✅ Автоматическая отправка завершена!\n\n"
-                f"📨 Успешно отправлено: {sent_count}/{len(users_without_files)}\n"
-                f"👥 Обработано пользователей: {len(users_without_files)}"
-            )
-            
-            if failed_users:
-                result_message += f"\n\n❌ Не удалось отправить {len(failed_users)} пользователям:\n"
-                result_message += "\n".join(failed_users[:5])
-                if len(failed_users) > 5:
-                    result_message += f"\n... и еще {len(failed_users) - 5}"
-            
-            await query.edit_message_text(result_message)
-            
-        except Exception as e:
-            bot_logger.logger.error(f"Ошибка в send_pending: {e}")
-            await query.edit_message_text("❌ Ошибка при отправке файлов")
-        finally:
-            session.close()
+        from handlers.admin import AdminHandler
+        await AdminHandler.run_send_pending(query.edit_message_text)
     
     @staticmethod
     async def _handle_upload_zip(query, user):
         """Обработка загрузки ZIP архива"""
-        await bot_logger.log_admin_action(user, "Запрос загрузки ZIP архива")
+        await bot_logger.admin_action(user, "Запрос загрузки ZIP архива")
         
         await query.edit_message_text(
             "📦 Загрузите ZIP архив с файлами (PDF, TXT, DOC, DOCX)\n\n"
-            "Каждый файл будет автоматически переименован в уникальный хэш."
+            "Каждый файл будет автоматически переименован в уникальный хэш.\n"
+            "🎟 Укажите название мероприятия в подписи к архиву — "
+            "без подписи файлы попадут в основное мероприятие. "
+            "Новое мероприятие создается только после подтверждения."
         )
     
+    @staticmethod
+    async def _handle_zip_new_event(query, user, context, upload_id: str, confirmed: bool):
+        """Создание мероприятия из подписи к архиву после подтверждения владельцем"""
+        pending = context.user_data.get('pending_zips', {}).pop(upload_id, None)
+        if not pending:
+            await query.edit_message_text("❌ Архив не найден, отправьте его еще раз")
+            return
+        
+        if not confirmed:
+            await query.edit_message_text(f"❌ Загрузка архива {pending['file_name']} отменена")
+            return
+        
+        from handlers.files import FileHandler
+        try:
+            event = await run_db(EventRepository.get_or_create, pending['event_name'])
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка создания мероприятия: {e}")
+            await query.edit_message_text("❌ Ошибка при создании мероприятия")
+            return
+        
+        await bot_logger.admin_action(user, "Создание мероприятия", f"Мероприятие: {event.name}")
+        await query.edit_message_text(f"🎟 Мероприятие «{event.name}» создано")
+        await FileHandler.ingest_zip(query.message, user, context.bot, pending['file_id'], pending['file_name'], event)
+    
     @staticmethod
     async def _handle_distribute_files(query, user, context):
         """Обработка распределения файлов"""
@@ -238,20 +241,56 @@ class CallbackHandler:
         await FileHandler.distribute_files(query=query)
     
     @staticmethod
-    async def _handle_free_tickets_archive(query, user):
+    async def _handle_free_tickets_archive(query, user, context):
         """Обработка создания архива свободных билетов"""
+        await bot_logger.admin_action(user, "Архив свободных билетов")
         await query.edit_message_text("📦 Создаю архив со свободными билетами...")
-        # TODO: Реализовать создание архива
-        await query.edit_message_text("❌ Функция создания архива временно недоступна")
+        
+        try:
+            parts, added, missing = await asyncio.to_thread(TicketArchiveService.build_free_archive)
+            
+            if not parts:
+                await query.edit_message_text("📭 Нет свободных билетов для архива")
+                return
+            
+            for number, path in enumerate(parts, 1):
+                # Повторная отправка того же архива идет по file_id, без загрузки
+                document = TicketArchiveService.uploaded_file_id(path)
+                report_file = None
+                if document is None:
+                    report_file = document = open(path, 'rb')
+                try:
+                    message = await context.bot.send_document(
+                        chat_id=query.message.chat_id,
+                        document=document,
+                        filename=os.path.basename(path),
+                        caption=f"📦 Свободные билеты, часть {number}/{len(parts)}"
+                    )
+                finally:
+                    if report_file:
+                        report_file.close()
+                TicketArchiveService.remember_upload(path, message.document.file_id)
+            
+            result_text = f"✅ Архив готов: {added} файлов, частей: {len(parts)}"
+            if missing:
+                result_text += f"\n⚠️ Не найдено на диске: {missing}"
+            await query.edit_message_text(result_text)
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка при создании архива свободных билетов: {e}")
+            await query.edit_message_text("❌ Ошибка при создании архива")
     
     @staticmethod
-    async def _handle_subscribers_list(query, user):
-        """Обработка показа списка подписчиков"""
-        await bot_logger.log_admin_action(user, "Просмотр списка подписчиков")
+    async def _handle_subscribers_list(query, user, cursor: int = 0, backward: bool = False):
+        """Обработка показа списка подписчиков постранично"""
+        if not cursor:
+            await bot_logger.admin_action(user, "Просмотр списка подписчиков")
         
-        session = Session()
         try:
-            subscribers = session.query(User).filter_by(has_access=True).all()
+            from handlers.admin import AdminHandler
+            
+            subscribers, has_prev, has_next = await run_db(
+                UserRepository.subscribers_page, cursor, backward, Config.SUBSCRIBERS_PAGE_SIZE
+            )
             
             if not subscribers:
                 await query.edit_message_text("👥 Нет активных подписчиков")
@@ -259,35 +298,70 @@ class CallbackHandler:
             
             subscribers_text = "👥 Активные подписчики:\n\n"
             for i, sub in enumerate(subscribers, 1):
-                sub_date = sub.subscription_date.strftime('%d.%m.%Y') if sub.subscription_date else "неизвестно"
-                subscribers_text += f"{i}. {sub.first_name} (@{sub.username})\n"
-                subscribers_text += f"   🆔 ID: {sub.file_hash}\n"
-                subscribers_text += f"   📅 Подписка с: {sub_date}\n\n"
+                subscribers_text += AdminHandler.format_subscriber(i, sub)
+            subscribers_text += "🔍 Поиск: /findsub <username или ID>"
             
-            if len(subscribers_text) > 4000:
-                subscribers_text = subscribers_text[:4000] + "\n..."
+            navigation = []
+            if has_prev:
+                navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"subs:p:{subscribers[0].id}"))
+            if has_next:
+                navigation.append(InlineKeyboardButton("Вперед ➡️", callback_data=f"subs:n:{subscribers[-1].id}"))
+            reply_markup = InlineKeyboardMarkup([navigation]) if navigation else None
             
-            await query.edit_message_text(subscribers_text)
+            await query.edit_message_text(subscribers_text, reply_markup=reply_markup)
         except Exception as e:
             bot_logger.logger.error(f"Ошибка при получении списка подписчиков: {e}")
             await query.edit_message_text("❌ Ошибка при получении списка")
+    
+    @staticmethod
+    async def _handle_reports(query, user):
+        """Выбор отчета для выгрузки"""
+        keyboard = [
+            [InlineKeyboardButton(f"📄 {title}", callback_data=f"report:{report_type}")]
+            for report_type, title in ExcelGenerator.REPORTS.items()
+        ]
+        await query.edit_message_text("📑 Выберите отчет:", reply_markup=InlineKeyboardMarkup(keyboard))
+    
+    @staticmethod
+    async def _handle_report_export(query, user, context, report_type: str):
+        """Формирует отчет в рабочем потоке и отправляет его документом"""
+        if report_type not in ExcelGenerator.REPORTS:
+            await query.edit_message_text("❌ Неизвестный отчет")
+            return
+        
+        await bot_logger.admin_action(user, "Выгрузка отчета", ExcelGenerator.REPORTS[report_type])
+        await query.edit_message_text("⏳ Формирую отчет...")
+        
+        path = None
+        try:
+            # Выгрузка большой таблицы не должна блокировать обработку других обновлений
+            path, count = await asyncio.to_thread(ExcelGenerator.generate_report, report_type)
+            
+            with open(path, 'rb') as report_file:
+                await context.bot.send_document(
+                    chat_id=query.message.chat_id,
+                    document=report_file,
+                    filename=os.path.basename(path),
+                    caption=f"📑 {ExcelGenerator.REPORTS[report_type]}: {count} строк"
+                )
+            await query.edit_message_text("✅ Отчет сформирован")
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка при формировании отчета {report_type}: {e}")
+            await query.edit_message_text("❌ Ошибка при формировании отчета")
         finally:
-            session.close()
+            if path and os.path.exists(path):
+                os.remove(path)
     
     @staticmethod
     async def _handle_manage_admins(query, user):
         """Обработка управления администраторами"""
-        await bot_logger.log_admin_action(user, "Открытие управления администраторами")
+        await bot_logger.admin_action(user, "Открытие управления администраторами")
         
-        session = Session()
         try:
-            admins = session.query(Admin).all()
+            admins = await run_db(AdminRepository.list_with_inviters)
             
             admins_text = "👑 Список администраторов:\n\n"
-            for i, admin in enumerate(admins, 1):
-                added_by_admin = session.query(Admin).filter_by(user_id=admin.added_by).first()
-                added_by_name = added_by_admin.first_name if added_by_admin else "Система"
-                
+            for i, (admin, added_by_name) in enumerate(admins, 1):
                 admins_text += (
                     f"{i}. {admin.first_name} (@{admin.username})\n"
                     f"   🆔 ID: {admin.user_id}\n"
@@ -307,8 +381,6 @@ class CallbackHandler:
         except Exception as e:
             bot_logger.logger.error(f"Ошибка при получении списка админов: {e}")
             await query.edit_message_text("❌ Ошибка при получении списка администраторов")
-        finally:
-            session.close()
     
     @staticmethod
     async def _handle_back_to_admin(update, context):
@@ -1,13 +1,14 @@
 import os
-import zipfile
-import uuid
-import hashlib
-from telegram import Update
+import asyncio
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from services.auth import AuthService
 from services.logger import bot_logger
-from database.session import Session
-from database.models import File
+from services.zip_ingest import ZipIngestService, ZipIngestError
+from database.executor import run_db
+from database.repositories import EventRepository
+from services.claims import file_pool
+from database.models import DEFAULT_EVENT_ID
 from config import Config
 
 class FileHandler:
@@ -18,7 +19,7 @@ class FileHandler:
         """Обработчик документов (ZIP архивов)"""
         user = update.effective_user
         
-        if not AuthService.is_admin(user.id):
+        if not await AuthService.is_admin(user.id):
             await update.message.reply_text("❌ Только владелец может загружать файлы")
             return
         
@@ -29,71 +30,91 @@ class FileHandler:
             await update.message.reply_text("❌ Пожалуйста, загрузите ZIP архив")
             return
         
-        await update.message.reply_text("📦 Начинаю обработку ZIP архива...")
+        # Подпись к архиву — название мероприятия, без подписи файлы идут в основное
+        event_name = (update.message.caption or "").strip()
+        try:
+            event = await run_db(
+                EventRepository.get_by_name if event_name else EventRepository.get_or_create,
+                event_name
+            )
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка при поиске мероприятия для ZIP архива: {e}")
+            await update.message.reply_text("❌ Ошибка при обработке ZIP архива")
+            return
+        
+        if not event:
+            # Опечатка в подписи не должна молча заводить новое мероприятие — спрашиваем владельца
+            context.user_data.setdefault('pending_zips', {})[document.file_unique_id] = {
+                'file_id': document.file_id,
+                'file_name': file_name,
+                'event_name': event_name
+            }
+            keyboard = [
+                [InlineKeyboardButton("✅ Создать и загрузить", callback_data=f"zip_new:{document.file_unique_id}")],
+                [InlineKeyboardButton("❌ Отмена", callback_data=f"zip_cancel:{document.file_unique_id}")]
+            ]
+            await update.message.reply_text(
+                f"❓ Мероприятия «{event_name}» нет.\n\n"
+                f"Создать его и загрузить в него архив {file_name}?",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+            return
+        
+        await FileHandler.ingest_zip(update.message, user, context.bot, document.file_id, file_name, event)
+    
+    @staticmethod
+    async def ingest_zip(message, user, bot, file_id: str, file_name: str, event):
+        """Скачивает архив из Telegram и загружает файлы в мероприятие, отвечая на message"""
+        status_message = await message.reply_text("📦 Начинаю обработку ZIP архива...")
         
         try:
-            bot_logger.log_admin_action(
+            await bot_logger.admin_action(
                 user, 
                 "Загрузка ZIP архива", 
-                f"Файл: {file_name}"
+                f"Файл: {file_name}, мероприятие: {event.name}"
             )
             
-            file = await document.get_file()
-            zip_path = os.path.join(Config.ZIP_FOLDER, f"temp_{document.file_id}.zip")
+            file = await bot.get_file(file_id)
+            zip_path = os.path.join(Config.ZIP_FOLDER, f"temp_{file_id}.zip")
             await file.download_to_drive(zip_path)
             
-            processed_count = await FileHandler.process_zip_archive(zip_path)
+            async def report_progress(done: int, total: int):
+                await status_message.edit_text(f"📦 Обработка ZIP архива: {done}/{total}...")
             
-            os.remove(zip_path)
+            try:
+                result = await FileHandler.process_zip_archive(zip_path, report_progress, event.id)
+            finally:
+                os.remove(zip_path)
             
-            await update.message.reply_text(
+            # Новые файлы сразу попадают в пул выдачи мероприятия
+            file_pool.refill_if_low(event.id)
+            
+            result_text = (
                 f"✅ ZIP архив обработан успешно!\n"
-                f"📄 Обработано файлов: {processed_count}\n"
+                f"🎟 Мероприятие: {event.name}\n"
+                f"📄 Обработано файлов: {result['processed']}\n"
                 f"🎯 Все файлы переименованы в уникальные хэши"
             )
+            if result['duplicates']:
+                result_text += f"\n♻️ Пропущено дубликатов: {result['duplicates']}"
+            
+            await message.reply_text(result_text)
             
+        except ZipIngestError as e:
+            bot_logger.logger.warning(f"ZIP архив {file_name} отклонен: {e}")
+            await message.reply_text(f"❌ Архив отклонен: {e}")
         except Exception as e:
             bot_logger.logger.error(f"Ошибка при обработке ZIP архива: {e}")
-            await update.message.reply_text("❌ Ошибка при обработке ZIP архива")
+            await message.reply_text("❌ Ошибка при обработке ZIP архива")
     
     @staticmethod
-    async def process_zip_archive(zip_path: str) -> int:
-        """Обрабатывает ZIP архив и сохраняет файлы с хэшированными именами"""
-        processed_count = 0
-        session = Session()
+    async def process_zip_archive(zip_path: str, progress_callback=None, event_id: int = DEFAULT_EVENT_ID) -> dict:
+        """Обрабатывает ZIP архив в рабочем потоке и сохраняет файлы с хэшированными именами"""
+        loop = asyncio.get_running_loop()
         
-        try:
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                for file_info in zip_ref.infolist():
-                    try:
-                        if file_info.filename.lower().endswith(('.pdf', '.txt', '.doc', '.docx')) and not file_info.is_dir():
-                            extracted_path = zip_ref.extract(file_info, Config.UPLOAD_FOLDER)
-                            
-                            file_hash = hashlib.sha256(f"{uuid.uuid4()}".encode()).hexdigest()[:16]
-                            original_ext = os.path.splitext(file_info.filename)[1]
-                            new_filename = f"{file_hash}{original_ext}"
-                            new_file_path = os.path.join(Config.UPLOAD_FOLDER, new_filename)
-                            
-                            os.rename(extracted_path, new_file_path)
-                            
-                            file_record = File(
-                                original_name=os.path.basename(file_info.filename),
-                                hash_name=file_hash,
-                                file_path=new_file_path
-                            )
-                            session.add(file_record)
-                            processed_count += 1
-                            
-                    except Exception as e:
-                        bot_logger.logger.error(f"Ошибка при обработке файла {file_info.filename}: {e}")
-                        continue
-            
-            session.commit()
-            
-        except Exception as e:
-            bot_logger.logger.error(f"Ошибка при обработке архива: {e}")
-            session.rollback()
-        finally:
-            session.close()
+        def report_progress(done: int, total: int):
+            # Вызывается из рабочего потока — передаем обновление в цикл событий
+            if progress_callback:
+                asyncio.run_coroutine_threadsafe(progress_callback(done, total), loop)
         
-        return processed_count
\ No newline at end of file
+        return await asyncio.to_thread(ZipIngestService.ingest, zip_path, report_progress, event_id)
\ No newline at end of file
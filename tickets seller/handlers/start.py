@@ -3,8 +3,8 @@ from telegram.ext import ContextTypes
 from services.auth import AuthService
 from services.subscription import SubscriptionService
 from services.logger import bot_logger
-from database.session import Session
-from database.models import User
+from database.executor import run_db
+from database.repositories import UserRepository
 
 class StartHandler:
     """Обработчик команды start"""
@@ -17,19 +17,18 @@ class StartHandler:
             # Проверяем параметры запуска для активации подписки
             if context.args and len(context.args) > 0:
                 token = context.args[0]
-                if SubscriptionService.activate_subscription(user.id, token):
+                if await run_db(SubscriptionService.activate_subscription, user.id, token):
                     # Обновляем данные пользователя
-                    session = Session()
                     try:
-                        existing_user = session.query(User).filter_by(user_id=user.id).first()
-                        if existing_user:
-                            existing_user.username = user.username or ""
-                            existing_user.first_name = user.first_name or ""
-                            existing_user.pending_file = True
-                            session.commit()
+                        await run_db(
+                            UserRepository.update_profile,
+                            user.id,
+                            user.username or "",
+                            user.first_name or ""
+                        )
                         
                         # Пытаемся автоматически отправить файл
-                        await SubscriptionService.auto_send_to_new_users(context.application)
+                        await SubscriptionService.auto_send_to_new_users(user.id)
                         
                         await update.message.reply_text(
                             "🎉 Подписка успешно активирована!\n\n"
@@ -46,8 +45,6 @@ class StartHandler:
                         bot_logger.logger.error(f"Ошибка обновления пользователя {user.id}: {e}")
                         await update.message.reply_text("❌ Ошибка при обновлении данных пользователя.")
                         return
-                    finally:
-                        session.close()
                 else:
                     await update.message.reply_text(
                         "❌ Недействительная или использованная ссылка подписки.\n"
@@ -56,7 +53,7 @@ class StartHandler:
                     return
             
             # Обычный старт
-            if not AuthService.check_user_access(user.id) and not AuthService.is_admin(user.id):
+            if not await AuthService.check_user_access(user.id) and not await AuthService.is_admin(user.id):
                 await update.message.reply_text(
                     "🔒 Этот бот доступен только по подписке.\n\n"
                     "Для получения доступа:\n"
@@ -68,40 +65,36 @@ class StartHandler:
                 return
             
             # Пользователь с доступом или админ
-            if AuthService.is_admin(user.id):
+            if await AuthService.is_admin(user.id):
                 await update.message.reply_text(
                     f"👑 Добро пожаловать, администратор {user.first_name}!\n\n"
                     f"Используйте команду /admin для доступа к панели управления."
                 )
             else:
-                session = Session()
-                try:
-                    user_data = session.query(User).filter_by(user_id=user.id).first()
-                    
-                    if user_data and user_data.files_received == 0:
-                        status_text = (
-                            f"👋 Добро пожаловать, {user.first_name}!\n\n"
-                            f"🎫 Ваш статус: Активная подписка\n"
-                            f"🆔 Ваш уникальный ID: `{user_data.file_hash}`\n"
-                            f"📭 Статус файлов: Ожидаем распределения\n\n"
-                            f"Файл будет отправлен вам автоматически в ближайшее время.\n"
-                            f"Если файл не пришел, администратор будет уведомлен."
-                        )
-                    else:
-                        status_text = (
-                            f"👋 Добро пожаловать, {user.first_name}!\n\n"
-                            f"🎫 Ваш статус: Активная подписка\n"
-                            f"🆔 Ваш уникальный ID: `{user_data.file_hash}`\n"
-                            f"📨 Получено файлов: {user_data.files_received}\n\n"
-                            "Доступные команды:\n"
-                            "/mysub - информация о подписке\n"
-                            "/myticket - статус билетов\n"
-                            "/recover - восстановить билет"
-                        )
-                    
-                    await update.message.reply_text(status_text)
-                finally:
-                    session.close()
+                user_data = await run_db(UserRepository.get_by_user_id, user.id)
+                
+                if user_data and user_data.files_received == 0:
+                    status_text = (
+                        f"👋 Добро пожаловать, {user.first_name}!\n\n"
+                        f"🎫 Ваш статус: Активная подписка\n"
+                        f"🆔 Ваш уникальный ID: `{user_data.file_hash}`\n"
+                        f"📭 Статус файлов: Ожидаем распределения\n\n"
+                        f"Файл будет отправлен вам автоматически в ближайшее время.\n"
+                        f"Если файл не пришел, администратор будет уведомлен."
+                    )
+                else:
+                    status_text = (
+                        f"👋 Добро пожаловать, {user.first_name}!\n\n"
+                        f"🎫 Ваш статус: Активная подписка\n"
+                        f"🆔 Ваш уникальный ID: `{user_data.file_hash}`\n"
+                        f"📨 Получено файлов: {user_data.files_received}\n\n"
+                        "Доступные команды:\n"
+                        "/mysub - информация о подписке\n"
+                        "/myticket - статус билетов\n"
+                        "/recover - восстановить билет"
+                    )
+                
+                await update.message.reply_text(status_text)
         
         except Exception as e:
             bot_logger.logger.error(f"Ошибка в команде /start: {e}")
@@ -112,7 +105,7 @@ class StartHandler:
         """Обработчик текстовых сообщений"""
         user = update.effective_user
         
-        if not AuthService.check_user_access(user.id) and not AuthService.is_admin(user.id):
+        if not await AuthService.check_user_access(user.id) and not await AuthService.is_admin(user.id):
             await update.message.reply_text(
                 "🔒 Бот доступен только по подписке.\n\n"
                 "Для получения доступа обратитесь к продавцу."
@@ -2,8 +2,8 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from services.auth import AuthService
 from services.logger import bot_logger
-from database.session import Session
-from database.models import User, FileDelivery, File
+from database.executor import run_db
+from database.repositories import UserRepository, FileRepository
 from datetime import datetime, timedelta
 import os
 
@@ -15,13 +15,12 @@ class UserHandler:
         """Информация о подписке пользователя"""
         user = update.effective_user
         
-        if not AuthService.check_user_access(user.id):
+        if not await AuthService.check_user_access(user.id):
             await update.message.reply_text("❌ У вас нет активной подписки.")
             return
         
-        session = Session()
         try:
-            user_data = session.query(User).filter_by(user_id=user.id).first()
+            user_data = await run_db(UserRepository.get_by_user_id, user.id)
             if user_data:
                 sub_date = user_data.subscription_date.strftime('%d.%m.%Y %H:%M') if user_data.subscription_date else "неизвестно"
                 
@@ -36,21 +35,18 @@ class UserHandler:
         except Exception as e:
             bot_logger.logger.error(f"Ошибка в команде /mysub: {e}")
             await update.message.reply_text("❌ Ошибка при проверке подписки")
-        finally:
-            session.close()
     
     @staticmethod
     async def my_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Проверка статуса билета пользователя"""
         user = update.effective_user
         
-        if not AuthService.check_user_access(user.id):
+        if not await AuthService.check_user_access(user.id):
             await update.message.reply_text("❌ У вас нет активной подписки.")
             return
         
-        session = Session()
         try:
-            user_data = session.query(User).filter_by(user_id=user.id).first()
+            user_data = await run_db(UserRepository.get_by_user_id, user.id)
             if not user_data:
                 await update.message.reply_text("❌ Пользователь не найден.")
                 return
@@ -59,16 +55,41 @@ class UserHandler:
         except Exception as e:
             bot_logger.logger.error(f"Ошибка в my_ticket: {e}")
             await update.message.reply_text("❌ Ошибка при проверке статуса.")
-        finally:
-            session.close()
     
     @staticmethod
     async def recover_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Восстановление билета"""
         user = update.effective_user
         
-        if not AuthService.check_user_access(user.id):
-            await update.message.reply_text("❌ У вас нет активной подписки.")
+        message = update.effective_message
+        
+        if not await AuthService.check_user_access(user.id):
+            await message.reply_text("❌ У вас нет активной подписки.")
+            return
+        
+        user_data = await run_db(UserRepository.get_by_user_id, user.id)
+        file = await run_db(FileRepository.get_last_distributed, user.id)
+        
+        if not user_data or not file:
+            await message.reply_text("📭 У вас еще нет выданных билетов для восстановления.")
+            return
+        
+        # Импортируем очередь локально, чтобы избежать циклического импорта
+        from services.delivery_queue import DeliveryQueue, delivery_worker
+        
+        # Файл отправит фоновая очередь; об окончательной неудаче она сообщит сама
+        try:
+            queued = await run_db(DeliveryQueue.enqueue_recover, user.id, file.id)
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка постановки восстановления билета {user.id} в очередь: {e}")
+            await message.reply_text(
+                "❌ Не удалось восстановить билет.\n"
+                "Попробуйте позже или обратитесь к продавцу."
+            )
             return
         
-        # ... логика восстановления билета
\ No newline at end of file
+        if queued:
+            delivery_worker.wake()
+            bot_logger.logger.info(f"Восстановление билета поставлено в очередь для {user.id}")
+        else:
+            await message.reply_text("⏳ Ваш билет уже отправляется, подождите немного.")
\ No newline at end of file
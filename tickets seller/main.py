@@ -1,6 +1,10 @@
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters
 from config import Config
 from database.session import init_db
+from database.executor import shutdown_db_executor
+from services.stats import StatsService
+from services.claims import file_pool
 
 def setup_handlers(application):
     """Настройка обработчиков"""
@@ -11,6 +15,11 @@ def setup_handlers(application):
     from handlers.user import UserHandler
     from handlers.files import FileHandler
     from handlers.callbacks import CallbackHandler
+    from services.logger import bot_logger
+    from services.metrics import metrics
+    
+    # Id корреляции присваивается до всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, bot_logger.track_update), group=-1)
     
     # Команды
     application.add_handler(CommandHandler("start", StartHandler.start))
@@ -21,6 +30,9 @@ def setup_handlers(application):
     application.add_handler(CommandHandler("addadmin", AdminHandler.add_admin))
     application.add_handler(CommandHandler("removeadmin", AdminHandler.remove_admin))
     application.add_handler(CommandHandler("send_pending", AdminHandler.send_pending_files))
+    application.add_handler(CommandHandler("findsub", AdminHandler.find_subscriber))
+    application.add_handler(CommandHandler("perf", AdminHandler.perf))
+    application.add_handler(CommandHandler("links", AdminHandler.bulk_links))
     
     # Обработчики сообщений
     application.add_handler(MessageHandler(filters.Document.ALL, FileHandler.handle_document))
@@ -28,23 +40,78 @@ def setup_handlers(application):
     
     # Обработчики callback
     application.add_handler(CallbackQueryHandler(CallbackHandler.button_handler))
+    
+    # Время выполнения и число запросов к БД каждого обработчика
+    for group, handlers in application.handlers.items():
+        if group < 0:
+            continue
+        for handler in handlers:
+            handler.callback = metrics.instrument(handler.callback)
+
+async def on_startup(application):
+    """Запуск фоновых служб после инициализации бота"""
+    from services.metrics import metrics_server
+    from services.delivery_queue import delivery_worker
+    from services.reconciler import inventory_reconciler
+    if Config.METRICS_PORT:
+        await metrics_server.start()
+    # Очередь продолжает отправки, прерванные прошлой остановкой
+    await delivery_worker.start(application)
+    await inventory_reconciler.start()
+
+async def on_stop(application):
+    """Остановка фоновых служб, пока бот еще может отправлять сообщения"""
+    from services.delivery_queue import delivery_worker
+    from services.reconciler import inventory_reconciler
+    await inventory_reconciler.stop()
+    await delivery_worker.stop()
+
+async def on_shutdown(application):
+    """Освобождение ресурсов при остановке бота"""
+    from services.metrics import metrics_server
+    await metrics_server.stop()
+    # Пул больше не пополняется; после остановки потоков БД файлы пула снова свободны
+    file_pool.close()
+    shutdown_db_executor()
+    file_pool.release_all()
 
 def main():
     """Главная функция запуска бота"""
     # Инициализация
     Config.create_folders()
     init_db()
+    # Счетчики статистики пересчитываются при каждом запуске, чтобы не накапливать расхождения
+    StatsService.rebuild_counters()
+    # Файлы пула, оставшиеся после аварийной остановки, возвращаются в свободные
+    file_pool.release_all()
+    file_pool.warm()
     
     # Создание приложения
-    application = Application.builder().token(Config.BOT_TOKEN).build()
+    # Обновления обрабатываются параллельно: запросы к БД идут в отдельном пуле потоков
+    builder = (
+        Application.builder()
+        .token(Config.BOT_TOKEN)
+        .concurrent_updates(Config.CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if Config.BOT_MODE == "webhook":
+        # Обновления приходят через свой HTTP-сервер прямо в очередь приложения
+        builder = builder.updater(None)
+    application = builder.build()
     
     # Настройка обработчиков
     setup_handlers(application)
     
     # Запуск бота
     from services.logger import bot_logger
-    bot_logger.logger.info("Бот запускается...")
-    application.run_polling()
+    bot_logger.logger.info(f"Бот запускается в режиме {Config.BOT_MODE}...")
+    if Config.BOT_MODE == "webhook":
+        from services.webhook import WebhookServer
+        WebhookServer(application).run()
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
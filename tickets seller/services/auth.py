@@ -1,32 +1,107 @@
-from database.session import Session
-from database.models import User, Admin
+import threading
+import time
+from collections import OrderedDict
+from database.executor import run_db
+from database.session import skip_locked_supported
+from database.repositories import UserRepository, AdminRepository
+from services.logger import bot_logger
 from config import Config
 
 class AuthService:
     """Сервис авторизации и проверки прав"""
     
+    # Кэш прав: список админов целиком и ограниченный LRU флагов доступа пользователей.
+    # Флаги сбрасываются при активации подписки, список админов — при его изменении.
+    _lock = threading.Lock()
+    _admin_ids = None
+    _admin_ids_loaded_at = 0.0
+    _access_cache = OrderedDict()
+    
+    @staticmethod
+    def invalidate_admins():
+        """Сбрасывает кэш списка администраторов"""
+        with AuthService._lock:
+            AuthService._admin_ids = None
+    
+    @staticmethod
+    def invalidate_user(user_id: int):
+        """Сбрасывает закэшированный флаг доступа пользователя"""
+        with AuthService._lock:
+            AuthService._access_cache.pop(user_id, None)
+    
     @staticmethod
-    def is_admin(user_id: int) -> bool:
+    async def _get_admin_ids() -> set:
+        """Список администраторов из кэша или из базы по истечении TTL"""
+        with AuthService._lock:
+            admin_ids = AuthService._admin_ids
+            fresh = time.monotonic() - AuthService._admin_ids_loaded_at < Config.AUTH_CACHE_TTL
+        
+        if admin_ids is not None and fresh:
+            return admin_ids
+        
+        admin_ids = frozenset(await run_db(AdminRepository.admin_ids))
+        with AuthService._lock:
+            AuthService._admin_ids = admin_ids
+            AuthService._admin_ids_loaded_at = time.monotonic()
+        return admin_ids
+    
+    @staticmethod
+    async def is_admin(user_id: int) -> bool:
         """Проверяет, является ли пользователь администратором"""
-        session = Session()
+        if user_id in Config.ADMIN_IDS:
+            return True
         try:
-            admins = session.query(Admin).all()
-            admin_ids = [admin.user_id for admin in admins]
-            admin_ids.extend(Config.ADMIN_IDS)
-            return user_id in list(set(admin_ids))
+            return user_id in await AuthService._get_admin_ids()
         except Exception as e:
+            bot_logger.logger.error(f"Ошибка проверки прав администратора: {e}")
             return False
-        finally:
-            session.close()
     
     @staticmethod
-    def check_user_access(user_id: int) -> bool:
+    async def check_user_access(user_id: int) -> bool:
         """Проверяет есть ли у пользователя доступ к боту"""
-        session = Session()
+        now = time.monotonic()
+        with AuthService._lock:
+            cached = AuthService._access_cache.get(user_id)
+            if cached is not None and now - cached[1] < Config.AUTH_CACHE_TTL:
+                AuthService._access_cache.move_to_end(user_id)
+                return cached[0]
+        
+        try:
+            has_access = await run_db(UserRepository.has_access, user_id)
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка проверки доступа: {e}")
+            return False
+        
+        if not has_access and skip_locked_supported():
+            # С общей базой доступ мог выдать другой процесс — отказ не кэшируем,
+            # иначе активация по ссылке подействовала бы здесь только через AUTH_CACHE_TTL
+            return has_access
+        
+        with AuthService._lock:
+            AuthService._access_cache[user_id] = (has_access, now)
+            AuthService._access_cache.move_to_end(user_id)
+            while len(AuthService._access_cache) > Config.AUTH_ACCESS_CACHE_SIZE:
+                AuthService._access_cache.popitem(last=False)
+        return has_access
+    
+    @staticmethod
+    async def add_admin(user_id: int, username: str, first_name: str, added_by: int) -> bool:
+        """Добавляет администратора и обновляет кэш"""
+        try:
+            return await run_db(AdminRepository.add, user_id, username, first_name, added_by)
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка добавления администратора {user_id}: {e}")
+            return False
+        finally:
+            AuthService.invalidate_admins()
+    
+    @staticmethod
+    async def remove_admin(user_id: int) -> bool:
+        """Удаляет администратора и обновляет кэш"""
         try:
-            user = session.query(User).filter_by(user_id=user_id).first()
-            return user and user.has_access
+            return await run_db(AdminRepository.remove, user_id)
         except Exception as e:
+            bot_logger.logger.error(f"Ошибка удаления администратора {user_id}: {e}")
             return False
         finally:
-            session.close()
\ No newline at end of file
+            AuthService.invalidate_admins()
\ No newline at end of file
@@ -0,0 +1,436 @@
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import select, update, exists
+from sqlalchemy.orm import aliased
+from database.session import Session, lock_rows, skip_locked_supported
+from database.executor import submit_db
+from database.models import User, File, DeliveryJob, Event
+from services.logger import bot_logger
+from services.stats import StatsService
+from config import Config
+
+class ClaimService:
+    """Атомарное резервирование свободных файлов за пользователями"""
+    
+    STATE_FREE = 'free'
+    STATE_POOLED = 'pooled'  # зарезервирован пулом в памяти, еще не закреплен за пользователем
+    STATE_CLAIMED = 'claimed'
+    STATE_SENT = 'sent'
+    STATE_MISSING = 'missing'  # файла нет на диске, выдавать нельзя; сверка вернет его, если он найдется
+    
+    @staticmethod
+    def free_files_filter(event_id: int = None):
+        """Условие выборки файлов, которые можно зарезервировать (всех или одного мероприятия)"""
+        condition = (File.distributed == False) & (File.claim_state == ClaimService.STATE_FREE)
+        if event_id is not None:
+            condition = (File.event_id == event_id) & condition
+        return condition
+    
+    @staticmethod
+    def available_files_filter(event_id: int = None):
+        """Файлы, которые еще можно выдать: свободные и лежащие в пуле"""
+        condition = (File.distributed == False) & File.claim_state.in_((ClaimService.STATE_FREE, ClaimService.STATE_POOLED))
+        if event_id is not None:
+            condition = (File.event_id == event_id) & condition
+        return condition
+    
+    @staticmethod
+    def event_file_exists(user_id, event_id, sent_only: bool = False):
+        """У пользователя уже есть файл мероприятия: зарезервированный или выданный (только выданный при sent_only).
+        Принимает значения или колонки User — права и выдача считаются по паре (пользователь, мероприятие)"""
+        owned = aliased(File)
+        condition = (owned.claimed_by == user_id) & (owned.event_id == event_id)
+        if sent_only:
+            condition = condition & (owned.claim_state == ClaimService.STATE_SENT)
+        return exists().where(condition)
+    
+    @staticmethod
+    def pending_users_filter(only_flagged: bool = False, event_id: int = None):
+        """Условие выборки пользователей, ожидающих файл своего текущего мероприятия"""
+        failed_since = datetime.utcnow() - timedelta(hours=Config.DELIVERY_FAILED_COOLDOWN_HOURS)
+        condition = (
+            (User.has_access == True) &
+            # Файлы прошлых мероприятий не мешают получить файл нового
+            ~ClaimService.event_file_exists(User.user_id, User.event_id) &
+            # Недавно не удалось выдать файл — не ждет, пока не пройдет DELIVERY_FAILED_COOLDOWN_HOURS
+            ~exists().where(
+                DeliveryJob.user_id == User.user_id,
+                DeliveryJob.state == 'failed',
+                DeliveryJob.kind == 'deliver',
+                DeliveryJob.updated_at > failed_since
+            )
+        )
+        if only_flagged:
+            condition = condition & (User.pending_file == True)
+        if event_id is not None:
+            condition = (User.event_id == event_id) & condition
+        return condition
+    
+    @staticmethod
+    def fetch_pending_users(last_id: int = 0, only_flagged: bool = False, batch_size: int = None) -> List[User]:
+        """Следующая порция ожидающих пользователей по возрастанию id"""
+        session = Session()
+        try:
+            return session.query(User).filter(
+                ClaimService.pending_users_filter(only_flagged),
+                User.id > last_id
+            ).order_by(User.id).limit(batch_size or Config.CLAIM_BATCH_SIZE).all()
+        finally:
+            session.close()
+    
+    @staticmethod
+    def _lock_users(session, user_ids: List[int]) -> List[int]:
+        """Блокирует пользователей до конца транзакции (PostgreSQL); тех, кого обслуживает другой процесс, пропускает"""
+        if not user_ids or not skip_locked_supported():
+            return list(user_ids)
+        locked = set(session.scalars(
+            lock_rows(select(User.user_id).where(User.user_id.in_(user_ids)))
+        ))
+        return [user_id for user_id in user_ids if user_id in locked]
+    
+    @staticmethod
+    def _claim_pooled(session, pending: List[int], event_id: int, claimed: Dict[int, int]):
+        """Закрепляет за ожидающими файлы из пула: обновление по первичному ключу, без поиска свободных"""
+        now = datetime.utcnow()
+        taken = 0
+        while pending:
+            file_id = file_pool.take(event_id)
+            if file_id is None:
+                break
+            
+            user_id = pending[0]
+            result = session.execute(
+                update(File)
+                .where(
+                    File.id == file_id,
+                    File.claim_state == ClaimService.STATE_POOLED,
+                    File.pooled_by == Config.INSTANCE_ID,
+                    ~ClaimService.event_file_exists(user_id, event_id)
+                )
+                .values(claim_state=ClaimService.STATE_CLAIMED, claimed_by=user_id, claimed_at=now, pooled_by=None)
+                .execution_options(synchronize_session=False)
+            )
+            
+            if result.rowcount == 1:
+                claimed[user_id] = file_id
+                pending.pop(0)
+                taken += 1
+            elif session.scalar(select(ClaimService.event_file_exists(user_id, event_id))):
+                # Пользователя уже обслужил параллельный процесс, файл остается в пуле
+                pending.pop(0)
+                file_pool.put_back(event_id, file_id)
+        
+        if taken:
+            StatsService.bump(session, free_files=-taken)
+            session.commit()
+    
+    @staticmethod
+    def claim_files(user_ids: List[int], event_id: int) -> Dict[int, File]:
+        """Резервирует за каждым пользователем по свободному файлу его мероприятия, возвращает {user_id: File}"""
+        # Каждый файл захватывается одним условным UPDATE, поэтому параллельные
+        # активации не могут получить один и тот же файл. В PostgreSQL строки
+        # пользователей и кандидатов еще и блокируются с SKIP LOCKED: несколько
+        # процессов бота разбирают разные файлы, не ожидая друг друга
+        session = Session()
+        claimed = {}
+        try:
+            last_id = 0
+            pending = ClaimService._lock_users(session, user_ids)
+            
+            # Сначала файлы из пула, затем поиск свободных
+            ClaimService._claim_pooled(session, pending, event_id, claimed)
+            
+            while pending:
+                # commit снимает блокировки — берем их заново на каждую порцию
+                pending = ClaimService._lock_users(session, pending)
+                candidate_ids = session.scalars(lock_rows(
+                    select(File.id)
+                    .where(ClaimService.free_files_filter(event_id), File.id > last_id)
+                    .order_by(File.id)
+                    .limit(len(pending))
+                )).all() if pending else []
+                
+                if not candidate_ids:
+                    break
+                
+                last_id = candidate_ids[-1]
+                now = datetime.utcnow()
+                
+                taken = 0
+                for file_id in candidate_ids:
+                    if not pending:
+                        break
+                    
+                    user_id = pending[0]
+                    result = session.execute(
+                        update(File)
+                        .where(
+                            File.id == file_id,
+                            ClaimService.free_files_filter(event_id),
+                            ~ClaimService.event_file_exists(user_id, event_id)
+                        )
+                        .values(
+                            claim_state=ClaimService.STATE_CLAIMED,
+                            claimed_by=user_id,
+                            claimed_at=now
+                        )
+                        .execution_options(synchronize_session=False)
+                    )
+                    
+                    if result.rowcount == 1:
+                        claimed[user_id] = file_id
+                        pending.pop(0)
+                        taken += 1
+                    elif session.scalar(select(ClaimService.event_file_exists(user_id, event_id))):
+                        # Пользователя уже обслужил параллельный процесс
+                        pending.pop(0)
+                
+                StatsService.bump(session, free_files=-taken)
+                session.commit()
+            
+            if pending:
+                # Свободные файлы могло перенести в пул параллельное пополнение
+                pending = ClaimService._lock_users(session, pending)
+                ClaimService._claim_pooled(session, pending, event_id, claimed)
+            # Пополняем пул после поиска, чтобы не забрать у него последние свободные файлы
+            file_pool.refill_if_low(event_id)
+            
+            if not claimed:
+                return {}
+            
+            files = session.query(File).filter(File.id.in_(claimed.values())).all()
+            session.expunge_all()
+            files_by_id = {file.id: file for file in files}
+            return {user_id: files_by_id[file_id] for user_id, file_id in claimed.items()}
+        
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка при резервировании файлов: {e}")
+            session.rollback()
+            for user_id, file_id in claimed.items():
+                ClaimService.release_claim(file_id, user_id)
+            return {}
+        finally:
+            session.close()
+    
+    @staticmethod
+    def delivered_by_job():
+        """Файл уже доставлен заданием очереди, хотя отметка в files еще не записана"""
+        return exists().where(DeliveryJob.file_id == File.id, DeliveryJob.sent_at.isnot(None))
+    
+    @staticmethod
+    def release_claim(file_id: int, user_id: int) -> bool:
+        """Снимает резервацию, если файл так и не был отправлен"""
+        session = Session()
+        try:
+            result = session.execute(
+                update(File)
+                .where(
+                    File.id == file_id,
+                    File.claimed_by == user_id,
+                    File.claim_state == ClaimService.STATE_CLAIMED,
+                    ~ClaimService.delivered_by_job()
+                )
+                .values(claim_state=ClaimService.STATE_FREE, claimed_by=None, claimed_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            StatsService.bump(session, free_files=result.rowcount)
+            session.commit()
+            return result.rowcount == 1
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка при снятии резервации файла {file_id}: {e}")
+            session.rollback()
+            return False
+        finally:
+            session.close()
+    
+    @staticmethod
+    def release_stale_claims() -> int:
+        """Освобождает резервации, оставшиеся после сбоя отправки"""
+        session = Session()
+        try:
+            deadline = datetime.utcnow() - timedelta(minutes=Config.CLAIM_TIMEOUT_MINUTES)
+            result = session.execute(
+                update(File)
+                .where(
+                    File.claim_state == ClaimService.STATE_CLAIMED,
+                    File.distributed == False,
+                    File.claimed_at < deadline,
+                    # Файл ждет своей очереди на отправку — резервация не зависла
+                    ~exists().where(
+                        DeliveryJob.file_id == File.id,
+                        DeliveryJob.state.in_(('queued', 'running'))
+                    ),
+                    ~ClaimService.delivered_by_job()
+                )
+                .values(claim_state=ClaimService.STATE_FREE, claimed_by=None, claimed_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            StatsService.bump(session, free_files=result.rowcount)
+            session.commit()
+            if result.rowcount:
+                bot_logger.logger.info("Снято зависших резерваций: %s", result.rowcount)
+            return result.rowcount
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка при снятии зависших резерваций: {e}")
+            session.rollback()
+            return 0
+        finally:
+            session.close()
+    
+    @staticmethod
+    def count_pending(only_flagged: bool = False, event_id: int = None) -> int:
+        """Количество пользователей, ожидающих файл"""
+        session = Session()
+        try:
+            return session.query(User).filter(ClaimService.pending_users_filter(only_flagged, event_id)).count()
+        finally:
+            session.close()
+    
+    @staticmethod
+    def count_free(event_id: int = None) -> int:
+        """Количество файлов, доступных для резервирования"""
+        session = Session()
+        try:
+            return session.query(File).filter(ClaimService.available_files_filter(event_id)).count()
+        finally:
+            session.close()
+
+class FilePool:
+    """Заранее зарезервированные свободные файлы по мероприятиям для выдачи за O(1)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}  # event_id -> deque id файлов в состоянии pooled
+        self._refilling = set()
+        self._closed = False
+    
+    def take(self, event_id: int) -> Optional[int]:
+        """Следующий файл из пула мероприятия или None"""
+        with self._lock:
+            pool = self._pools.get(event_id)
+            return pool.popleft() if pool else None
+    
+    def put_back(self, event_id: int, file_id: int):
+        """Возвращает неиспользованный файл в начало пула"""
+        with self._lock:
+            self._pools.setdefault(event_id, deque()).appendleft(file_id)
+    
+    def size(self, event_id: int) -> int:
+        with self._lock:
+            return len(self._pools.get(event_id, ()))
+    
+    def refill_if_low(self, event_id: int):
+        """Запускает фоновое пополнение, если в пуле осталось мало файлов"""
+        with self._lock:
+            if (
+                self._closed or not Config.FILE_POOL_SIZE or event_id in self._refilling
+                or len(self._pools.get(event_id, ())) >= Config.FILE_POOL_LOW_WATER
+            ):
+                return
+            self._refilling.add(event_id)
+        submit_db(self._refill_in_background, event_id)
+    
+    def _refill_in_background(self, event_id: int):
+        try:
+            self.refill(event_id)
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка пополнения пула файлов мероприятия {event_id}: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(event_id)
+    
+    def refill(self, event_id: int) -> int:
+        """Резервирует свободные файлы до FILE_POOL_SIZE (синхронно, для потока БД), возвращает сколько добавлено"""
+        with self._lock:
+            needed = Config.FILE_POOL_SIZE - len(self._pools.get(event_id, ()))
+            if self._closed or needed <= 0:
+                return 0
+        
+        session = Session()
+        try:
+            candidate_ids = session.scalars(lock_rows(
+                select(File.id)
+                .where(ClaimService.free_files_filter(event_id))
+                .order_by(File.id)
+                .limit(needed)
+            )).all()
+            if not candidate_ids:
+                return 0
+            
+            # Файлы могли успеть зарезервировать напрямую — берем только оставшиеся свободными
+            session.execute(
+                update(File)
+                .where(File.id.in_(candidate_ids), File.claim_state == ClaimService.STATE_FREE)
+                .values(claim_state=ClaimService.STATE_POOLED, claimed_at=datetime.utcnow(), pooled_by=Config.INSTANCE_ID)
+                .execution_options(synchronize_session=False)
+            )
+            pooled_ids = session.scalars(
+                select(File.id)
+                .where(
+                    File.id.in_(candidate_ids),
+                    File.claim_state == ClaimService.STATE_POOLED,
+                    File.pooled_by == Config.INSTANCE_ID
+                )
+                .order_by(File.id)
+            ).all()
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        
+        with self._lock:
+            self._pools.setdefault(event_id, deque()).extend(pooled_ids)
+        return len(pooled_ids)
+    
+    def warm(self) -> int:
+        """Заполняет пулы всех мероприятий при запуске"""
+        if not Config.FILE_POOL_SIZE:
+            return 0
+        session = Session()
+        try:
+            event_ids = session.scalars(select(Event.id).order_by(Event.id)).all()
+        finally:
+            session.close()
+        
+        pooled = sum(self.refill(event_id) for event_id in event_ids)
+        if pooled:
+            bot_logger.logger.info("В пул выдачи зарезервировано файлов: %s", pooled)
+        return pooled
+    
+    def close(self):
+        """Запрещает новые пополнения перед остановкой"""
+        with self._lock:
+            self._closed = True
+    
+    def release_all(self) -> int:
+        """Возвращает файлы пула этого процесса в свободные (при остановке и после сбоя)"""
+        with self._lock:
+            self._pools.clear()
+        
+        session = Session()
+        try:
+            # Пулы других процессов с общей базой не трогаем; без владельца — файлы пула до миграции 8
+            result = session.execute(
+                update(File)
+                .where(
+                    File.claim_state == ClaimService.STATE_POOLED,
+                    (File.pooled_by == Config.INSTANCE_ID) | File.pooled_by.is_(None)
+                )
+                .values(claim_state=ClaimService.STATE_FREE, claimed_at=None, pooled_by=None)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            return result.rowcount
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка при освобождении пула файлов: {e}")
+            session.rollback()
+            return 0
+        finally:
+            session.close()
+
+# Общий пул процесса бота
+file_pool = FilePool()
\ No newline at end of file
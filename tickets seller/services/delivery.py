@@ -0,0 +1,165 @@
+import asyncio
+import time
+from typing import AsyncIterable, Awaitable, Callable, Optional, Tuple
+from telegram.error import RetryAfter
+from database.models import User, File
+from services.logger import bot_logger
+from config import Config
+
+class TokenBucket:
+    """Ограничитель частоты запросов по алгоритму token bucket"""
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def pause(self, seconds: float):
+        """Приостанавливает выдачу токенов (flood wait от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+    
+    async def acquire(self):
+        """Ждет, пока не освободится токен"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class ChatRateLimiter:
+    """Минимальный интервал между сообщениями в один чат"""
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_allowed = {}
+    
+    async def acquire(self, chat_id: int):
+        """Ждет, пока в чат снова можно писать"""
+        now = time.monotonic()
+        allowed_at = self._next_allowed.get(chat_id, 0.0)
+        self._next_allowed[chat_id] = max(now, allowed_at) + self.interval
+        
+        if allowed_at > now:
+            await asyncio.sleep(allowed_at - now)
+        
+        # Не даем словарю расти бесконечно при массовой рассылке
+        if len(self._next_allowed) > 10000:
+            self._next_allowed = {
+                key: value for key, value in self._next_allowed.items() if value > now
+            }
+
+class DeliveryPipeline:
+    """Параллельная отправка файлов с учетом лимитов Telegram Bot API"""
+    
+    def __init__(
+        self,
+        application,
+        workers: int = None,
+        progress_callback: Optional[Callable[[int, int], Awaitable]] = None,
+        progress_every: int = None,
+        on_failure: Optional[Callable[[User, File], Awaitable]] = None
+    ):
+        self.application = application
+        self.workers = workers or Config.DELIVERY_WORKERS
+        self.progress_callback = progress_callback
+        self.progress_every = progress_every or Config.DELIVERY_PROGRESS_EVERY
+        self.on_failure = on_failure
+        self.bucket = TokenBucket(Config.DELIVERY_GLOBAL_RATE)
+        self.chat_limiter = ChatRateLimiter(Config.DELIVERY_CHAT_INTERVAL)
+        self.sent = 0
+        self.failed = []
+        self._processed = 0
+    
+    async def _send(self, user_obj: User, file: File, send=None) -> bool:
+        """Отправляет один файл (по умолчанию FileManager.send_file_to_user), повторяя попытку после flood wait"""
+        # Импортируем FileManager здесь, чтобы избежать циклического импорта
+        from services.file_manager import FileManager, TicketSentError, RecipientUnreachableError
+        
+        send = send or FileManager.send_file_to_user
+        for attempt in range(Config.DELIVERY_MAX_RETRIES + 1):
+            await self.chat_limiter.acquire(user_obj.user_id)
+            await self.bucket.acquire()
+            try:
+                return await send(user_obj, file, self.application)
+            except RetryAfter as e:
+                bot_logger.logger.warning(
+                    "Flood wait %s с при отправке пользователю %s (попытка %s)",
+                    e.retry_after, user_obj.user_id, attempt + 1
+                )
+                self.bucket.pause(e.retry_after)
+            except (TicketSentError, RecipientUnreachableError):
+                # Повторная отправка выдала бы билет второй раз или заведомо не дошла бы — решает вызывающий код
+                raise
+            except Exception as e:
+                bot_logger.logger.error(f"Ошибка отправки пользователю {user_obj.user_id}: {e}")
+                return False
+        
+        return False
+    
+    async def _process(self, job) -> bool:
+        """Обрабатывает одно задание (пользователь, файл), возвращает успех"""
+        # Импортируем FileManager здесь, чтобы избежать циклического импорта
+        from services.file_manager import RecipientUnreachableError
+        
+        user_obj, file = job
+        try:
+            if await self._send(user_obj, file):
+                return True
+        except RecipientUnreachableError:
+            pass
+        
+        self.failed.append(user_obj)
+        if self.on_failure:
+            await self.on_failure(user_obj, file)
+        return False
+    
+    async def _worker(self, queue: asyncio.Queue, total: int):
+        """Забирает задания из очереди, пока не встретит маркер завершения"""
+        while True:
+            job = await queue.get()
+            try:
+                if job is None:
+                    return
+                
+                if await self._process(job):
+                    self.sent += 1
+                
+                self._processed += 1
+                if self.progress_callback and self._processed % self.progress_every == 0:
+                    try:
+                        await self.progress_callback(self._processed, total)
+                    except Exception as e:
+                        bot_logger.logger.warning("Не удалось обновить прогресс отправки: %s", e)
+            finally:
+                queue.task_done()
+    
+    async def run(self, jobs: AsyncIterable[Tuple[User, File]], total: int = 0) -> dict:
+        """Отправляет все задания и возвращает итоговую статистику"""
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [
+            asyncio.create_task(self._worker(queue, total)) for _ in range(self.workers)
+        ]
+        
+        try:
+            async for job in jobs:
+                await queue.put(job)
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        
+        return {'sent': self.sent, 'failed': self.failed}
\ No newline at end of file
@@ -0,0 +1,551 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Tuple
+from sqlalchemy import select, update, delete, insert, func
+from database.session import Session, lock_rows, skip_locked_supported
+from database.executor import run_db
+from database.models import DeliveryJob, User, File
+from services.claims import ClaimService
+from services.delivery import DeliveryPipeline
+from services.logger import bot_logger
+from config import Config
+
+class DeliveryQueue:
+    """Постоянная очередь заданий на отправку файлов в таблице delivery_jobs"""
+    
+    KIND_DELIVER = 'deliver'
+    KIND_RECOVER = 'recover'
+    
+    STATE_QUEUED = 'queued'
+    STATE_RUNNING = 'running'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+    
+    ACTIVE_STATES = (STATE_QUEUED, STATE_RUNNING)
+    
+    @staticmethod
+    def new_batch() -> str:
+        """Идентификатор новой рассылки"""
+        return uuid.uuid4().hex[:12]
+    
+    @staticmethod
+    def enqueue_pending(only_flagged: bool = False, batch: str = None) -> dict:
+        """Резервирует файлы ожидающим пользователям и ставит отправку в очередь"""
+        ClaimService.release_stale_claims()
+        
+        result = {'batch': batch or DeliveryQueue.new_batch(), 'queued': 0, 'no_file': 0}
+        exhausted = set()  # мероприятия, у которых закончились свободные файлы
+        last_id = 0
+        while True:
+            users = ClaimService.fetch_pending_users(last_id, only_flagged)
+            if not users:
+                break
+            
+            last_id = users[-1].id
+            # Файлы выдаются только из пула мероприятия пользователя
+            by_event = {}
+            for user_obj in users:
+                by_event.setdefault(user_obj.event_id, []).append(user_obj.user_id)
+            
+            for event_id, user_ids in by_event.items():
+                if event_id in exhausted:
+                    result['no_file'] += len(user_ids)
+                elif not DeliveryQueue._enqueue_claims(result, user_ids, event_id):
+                    exhausted.add(event_id)
+        
+        return result
+    
+    @staticmethod
+    def enqueue_user(user_id: int) -> dict:
+        """Резервирует файл одному ожидающему пользователю (после активации) и ставит отправку в очередь"""
+        result = {'batch': DeliveryQueue.new_batch(), 'queued': 0, 'no_file': 0}
+        session = Session()
+        try:
+            event_id = session.scalar(
+                select(User.event_id).where(User.user_id == user_id, ClaimService.pending_users_filter(True))
+            )
+        finally:
+            session.close()
+        
+        if event_id is not None:
+            DeliveryQueue._enqueue_claims(result, [user_id], event_id)
+        return result
+    
+    @staticmethod
+    def _enqueue_claims(result: dict, user_ids: List[int], event_id: int) -> bool:
+        """Резервирует файлы мероприятия за пользователями и добавляет задания; False, если файлов нет"""
+        claims = ClaimService.claim_files(user_ids, event_id)
+        result['no_file'] += len(user_ids) - len(claims)
+        if not claims:
+            return False
+        
+        DeliveryQueue._insert_jobs(result['batch'], DeliveryQueue.KIND_DELIVER, [
+            (user_id, file.id) for user_id, file in claims.items()
+        ])
+        result['queued'] += len(claims)
+        return True
+    
+    @staticmethod
+    def enqueue_recover(user_id: int, file_id: int) -> bool:
+        """Ставит повторную отправку билета в очередь; False, если она уже ожидает"""
+        session = Session()
+        try:
+            active = session.scalar(
+                select(DeliveryJob.id).where(
+                    DeliveryJob.user_id == user_id,
+                    DeliveryJob.state.in_(DeliveryQueue.ACTIVE_STATES),
+                    DeliveryJob.kind == DeliveryQueue.KIND_RECOVER
+                ).limit(1)
+            )
+            if active:
+                return False
+            
+            session.add(DeliveryJob(user_id=user_id, file_id=file_id, kind=DeliveryQueue.KIND_RECOVER))
+            session.commit()
+            return True
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def _insert_jobs(batch: str, kind: str, pairs: List[Tuple[int, int]]):
+        """Добавляет задания одним многострочным INSERT"""
+        session = Session()
+        try:
+            now = datetime.utcnow()
+            session.execute(insert(DeliveryJob), [{
+                'user_id': user_id,
+                'file_id': file_id,
+                'kind': kind,
+                'state': DeliveryQueue.STATE_QUEUED,
+                'attempts': 0,
+                'next_attempt_at': now,
+                'batch': batch,
+                'created_at': now,
+                'updated_at': now
+            } for user_id, file_id in pairs])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def take_due(limit: int) -> List[Tuple[DeliveryJob, User, File]]:
+        """Забирает задания, которым пришло время, и помечает их выполняемыми"""
+        session = Session()
+        try:
+            now = datetime.utcnow()
+            # Другие процессы бота пропускают задания, которые забирает этот
+            job_ids = session.scalars(lock_rows(
+                select(DeliveryJob.id)
+                .where(DeliveryJob.state == DeliveryQueue.STATE_QUEUED, DeliveryJob.next_attempt_at <= now)
+                .order_by(DeliveryJob.next_attempt_at, DeliveryJob.id)
+                .limit(limit)
+            )).all()
+            if not job_ids:
+                return []
+            
+            # В SQLite выборка не блокирует строки: задание достается тому,
+            # чей условный UPDATE его изменил, остальные его пропускают
+            job_ids = [job_id for job_id in job_ids if session.execute(
+                update(DeliveryJob)
+                .where(DeliveryJob.id == job_id, DeliveryJob.state == DeliveryQueue.STATE_QUEUED)
+                .values(state=DeliveryQueue.STATE_RUNNING, updated_at=now)
+            ).rowcount == 1]
+            if not job_ids:
+                session.commit()
+                return []
+            
+            rows = session.execute(
+                select(DeliveryJob, User, File)
+                .join(User, User.user_id == DeliveryJob.user_id)
+                .join(File, File.id == DeliveryJob.file_id)
+                .where(DeliveryJob.id.in_(job_ids))
+                .order_by(DeliveryJob.next_attempt_at, DeliveryJob.id)
+            ).all()
+            
+            # Пользователь или файл удалены — отправлять нечего
+            orphaned = set(job_ids) - {job.id for job, _, _ in rows}
+            if orphaned:
+                session.execute(
+                    update(DeliveryJob)
+                    .where(DeliveryJob.id.in_(orphaned))
+                    .values(state=DeliveryQueue.STATE_FAILED, updated_at=now)
+                )
+            
+            session.commit()
+            session.expunge_all()
+            return [tuple(row) for row in rows]
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def complete(job_id: int):
+        """Отмечает задание выполненным"""
+        session = Session()
+        try:
+            session.execute(
+                update(DeliveryJob)
+                .where(DeliveryJob.id == job_id)
+                .values(state=DeliveryQueue.STATE_DONE, updated_at=datetime.utcnow())
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def give_up(job_id: int, user_id: int):
+        """Отмечает задание неудавшимся и убирает пользователя из автоматической выдачи"""
+        session = Session()
+        try:
+            now = datetime.utcnow()
+            session.execute(
+                update(DeliveryJob)
+                .where(DeliveryJob.id == job_id)
+                .values(state=DeliveryQueue.STATE_FAILED, updated_at=now)
+            )
+            session.execute(
+                update(User)
+                .where(User.user_id == user_id)
+                .values(pending_file=False)
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def mark_delivered(job_id: int, telegram_file_id: str):
+        """Запоминает в задании, что файл уже доставлен и осталась только отметка в files"""
+        session = Session()
+        try:
+            session.execute(
+                update(DeliveryJob)
+                .where(DeliveryJob.id == job_id)
+                .values(sent_at=datetime.utcnow(), telegram_file_id=telegram_file_id)
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def retry_later(job: DeliveryJob, exhaustible: bool = True) -> bool:
+        """Откладывает задание с экспоненциальной задержкой; True, если попытки исчерпаны"""
+        attempts = job.attempts + 1
+        exhausted = exhaustible and attempts >= Config.DELIVERY_JOB_MAX_ATTEMPTS
+        # Степень ограничена: у неисчерпаемых заданий счетчик попыток растет без предела
+        delay = min(
+            Config.DELIVERY_JOB_BACKOFF * 2 ** min(attempts - 1, 20),
+            Config.DELIVERY_JOB_MAX_BACKOFF
+        )
+        now = datetime.utcnow()
+        
+        session = Session()
+        try:
+            session.execute(
+                update(DeliveryJob)
+                .where(DeliveryJob.id == job.id)
+                .values(
+                    state=DeliveryQueue.STATE_FAILED if exhausted else DeliveryQueue.STATE_QUEUED,
+                    attempts=attempts,
+                    next_attempt_at=now + timedelta(seconds=delay),
+                    updated_at=now
+                )
+            )
+            session.commit()
+            return exhausted
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def resume_interrupted() -> int:
+        """Возвращает в очередь задания, прерванные остановкой бота, и чистит старые выполненные"""
+        session = Session()
+        try:
+            now = datetime.utcnow()
+            interrupted = DeliveryJob.state == DeliveryQueue.STATE_RUNNING
+            if skip_locked_supported():
+                # Общую базу используют и другие процессы: их текущие отправки не трогаем, только давно зависшие
+                interrupted = interrupted & (
+                    DeliveryJob.updated_at < now - timedelta(minutes=Config.CLAIM_TIMEOUT_MINUTES)
+                )
+            result = session.execute(
+                update(DeliveryJob)
+                .where(interrupted)
+                .values(state=DeliveryQueue.STATE_QUEUED, next_attempt_at=now, updated_at=now)
+            )
+            session.execute(
+                delete(DeliveryJob).where(
+                    DeliveryJob.state == DeliveryQueue.STATE_DONE,
+                    DeliveryJob.updated_at < now - timedelta(days=Config.DELIVERY_JOB_RETENTION_DAYS)
+                )
+            )
+            session.commit()
+            if result.rowcount:
+                bot_logger.logger.info("Возвращено в очередь прерванных отправок: %s", result.rowcount)
+            return result.rowcount
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def batch_progress(batch: str) -> dict:
+        """Число заданий рассылки по состояниям: {'done', 'failed', 'active'}"""
+        session = Session()
+        try:
+            counts = dict(session.execute(
+                select(DeliveryJob.state, func.count(DeliveryJob.id))
+                .where(DeliveryJob.batch == batch)
+                .group_by(DeliveryJob.state)
+            ).all())
+        finally:
+            session.close()
+        return {
+            'done': counts.get(DeliveryQueue.STATE_DONE, 0),
+            'failed': counts.get(DeliveryQueue.STATE_FAILED, 0),
+            'active': sum(counts.get(state, 0) for state in DeliveryQueue.ACTIVE_STATES)
+        }
+    
+    @staticmethod
+    def failed_users(batch: str, limit: int) -> List[User]:
+        """Пользователи, которым рассылка так и не доставила файл"""
+        session = Session()
+        try:
+            return session.scalars(
+                select(User)
+                .join(DeliveryJob, DeliveryJob.user_id == User.user_id)
+                .where(DeliveryJob.batch == batch, DeliveryJob.state == DeliveryQueue.STATE_FAILED)
+                .order_by(DeliveryJob.id)
+                .limit(limit)
+            ).all()
+        finally:
+            session.close()
+    
+    @staticmethod
+    def count_active() -> int:
+        """Заданий в очереди и в работе"""
+        session = Session()
+        try:
+            return session.scalar(
+                select(func.count(DeliveryJob.id)).where(DeliveryJob.state.in_(DeliveryQueue.ACTIVE_STATES))
+            )
+        finally:
+            session.close()
+
+class DeliveryWorker(DeliveryPipeline):
+    """Фоновая отправка заданий из очереди с лимитами конвейера и повторами с задержкой"""
+    
+    def __init__(self):
+        super().__init__(application=None)
+        self._delivered = {}  # id задания -> file_id Telegram, если отметку доставки не удалось записать даже в задание
+        self._watchers = {}  # рассылка -> {'callback', 'total', 'outcomes'}
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = None
+        self._sweep_task = None
+    
+    def wake(self):
+        """Сообщает, что в очереди появились задания"""
+        self._wake.set()
+    
+    def watch(self, batch: str, callback):
+        """Передает await callback(прогресс) ход рассылки по мере обработки ее заданий"""
+        self._watchers[batch] = {'callback': callback, 'total': None, 'outcomes': 0}
+    
+    async def expect(self, batch: str, total: int):
+        """Число заданий рассылки известно; если все уже обработаны, сразу сообщает итог"""
+        watcher = self._watchers.get(batch)
+        if watcher is None:
+            return
+        watcher['total'] = total
+        if watcher['outcomes'] >= total:
+            await self._notify(batch, watcher)
+    
+    async def _notify(self, batch: str, watcher: dict):
+        progress = await run_db(DeliveryQueue.batch_progress, batch)
+        # Итог сообщается один раз, даже если последние задания завершились одновременно
+        if not progress['active'] and self._watchers.pop(batch, None) is None:
+            return
+        try:
+            await watcher['callback'](progress)
+        except Exception as e:
+            bot_logger.logger.warning("Не удалось сообщить прогресс рассылки %s: %s", batch, e)
+    
+    async def _track(self, job: DeliveryJob):
+        """Учитывает обработку задания в прогрессе его рассылки"""
+        watcher = self._watchers.get(job.batch)
+        if watcher is None:
+            return
+        watcher['outcomes'] += 1
+        total = watcher['total']
+        if watcher['outcomes'] % Config.DELIVERY_PROGRESS_EVERY == 0 or (total is not None and watcher['outcomes'] >= total):
+            await self._notify(job.batch, watcher)
+    
+    async def start(self, application):
+        """Возвращает в очередь прерванные задания и запускает обработку"""
+        self.application = application
+        self._stopping = False
+        await run_db(DeliveryQueue.resume_interrupted)
+        self._task = asyncio.create_task(self.run(self._due_jobs()))
+        if Config.DELIVERY_SWEEP_INTERVAL:
+            self._sweep_task = asyncio.create_task(self._sweep())
+        bot_logger.logger.info("Очередь отправки файлов запущена")
+    
+    async def stop(self):
+        """Дожидается заданий в работе; остальные останутся в очереди до следующего запуска"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+        try:
+            await self._task
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка при остановке очереди отправки: {e}")
+        self._task = None
+    
+    async def _sweep(self):
+        """Периодически снимает зависшие резервации и ставит в очередь ожидающих активированных пользователей"""
+        while not self._stopping:
+            await asyncio.sleep(Config.DELIVERY_SWEEP_INTERVAL)
+            try:
+                result = await run_db(DeliveryQueue.enqueue_pending, True)
+            except Exception as e:
+                bot_logger.logger.error(f"Ошибка прохода по ожидающим пользователям: {e}")
+                continue
+            if result['queued']:
+                self.wake()
+                bot_logger.logger.info("Ожидавшим пользователям поставлено в очередь файлов: %s", result['queued'])
+    
+    async def _due_jobs(self):
+        """Задания, которым пришло время; при пустой очереди ждет wake() или интервал опроса"""
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                jobs = await run_db(DeliveryQueue.take_due, self.workers * 2)
+            except Exception as e:
+                bot_logger.logger.error(f"Ошибка чтения очереди отправки: {e}")
+                jobs = []
+            
+            if not jobs:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), Config.DELIVERY_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            for job in jobs:
+                yield job
+    
+    async def _process(self, job) -> bool:
+        job_row = job[0]
+        try:
+            return await self._process_job(*job)
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка обработки задания отправки {job_row.id}: {e}")
+            # Задание не остается в running: повторяется по обычному расписанию
+            delivered = job_row.sent_at is not None or job_row.id in self._delivered
+            try:
+                await run_db(DeliveryQueue.retry_later, job_row, not delivered)
+            except Exception as retry_error:
+                bot_logger.logger.error(f"Не удалось вернуть задание {job_row.id} в очередь: {retry_error}")
+            return False
+        finally:
+            await self._track(job_row)
+    
+    async def _process_job(self, job: DeliveryJob, user_obj: User, file: File) -> bool:
+        # Импортируем FileManager здесь, чтобы избежать циклического импорта
+        from services.file_manager import FileManager, TicketSentError, RecipientUnreachableError
+        
+        unreachable = False
+        delivered = job.sent_at is not None or job.id in self._delivered
+        if job.kind == DeliveryQueue.KIND_RECOVER:
+            sent = await self._send(user_obj, file, FileManager.resend_file_to_user)
+        elif file.distributed and file.distributed_to == user_obj.user_id:
+            # Файл ушел, но бот остановился до отметки задания — повторно не отправляем
+            sent = True
+        elif delivered:
+            # Файл уже у пользователя — повторяем только отметку в базе
+            try:
+                await FileManager.record_sent(
+                    user_obj, file, self._delivered.get(job.id, job.telegram_file_id)
+                )
+                sent = True
+            except TicketSentError:
+                sent = False
+        else:
+            try:
+                sent = await self._send(user_obj, file)
+            except TicketSentError as e:
+                delivered = True
+                self._delivered[job.id] = e.telegram_file_id
+                await run_db(DeliveryQueue.mark_delivered, job.id, e.telegram_file_id)
+                sent = False
+            except RecipientUnreachableError:
+                unreachable = True
+                sent = False
+        
+        if sent:
+            await run_db(DeliveryQueue.complete, job.id)
+            self._delivered.pop(job.id, None)
+            return True
+        
+        if delivered:
+            # Резервацию не снимаем и попытки не ограничиваем: билет уже выдан этому пользователю
+            await run_db(DeliveryQueue.retry_later, job, False)
+            return False
+        
+        if unreachable:
+            # Повторы не помогут: задание завершается сразу
+            bot_logger.logger.warning(
+                "Пользователь %s недоступен для бота, отправка файла %s прекращена", user_obj.user_id, file.id
+            )
+        elif not await run_db(DeliveryQueue.retry_later, job):
+            return False
+        else:
+            bot_logger.logger.error(
+                "Отправка файла %s пользователю %s не удалась после %s попыток",
+                file.id, user_obj.user_id, Config.DELIVERY_JOB_MAX_ATTEMPTS
+            )
+        
+        if job.kind == DeliveryQueue.KIND_RECOVER:
+            await self.application.bot.send_message(
+                chat_id=user_obj.user_id,
+                text="❌ Не удалось восстановить билет.\nПопробуйте позже или обратитесь к продавцу."
+            )
+        else:
+            # Файл возвращается в свободные; периодический проход пользователя больше не подбирает,
+            # повторить выдачу может администратор после DELIVERY_FAILED_COOLDOWN_HOURS
+            await run_db(DeliveryQueue.give_up, job.id, user_obj.user_id)
+            await run_db(ClaimService.release_claim, file.id, user_obj.user_id)
+        return False
+
+# Единственный обработчик очереди в процессе бота
+delivery_worker = DeliveryWorker()
\ No newline at end of file
@@ -1,56 +1,152 @@
 # services/file_manager.py
+import asyncio
 import os
+import sys
+import time
 import shutil
 import hashlib
 import uuid
 from datetime import datetime
+from telegram.error import RetryAfter, BadRequest, Forbidden
 from database.session import Session
+from database.executor import run_db
 from database.models import File, FileDelivery, User
 from services.logger import bot_logger
+from services.claims import ClaimService
+from services.stats import StatsService
+from services.metrics import metrics
 from config import Config
 
+try:
+    import fcntl
+except ImportError:
+    # Windows: reflink недоступен, остаются жесткая ссылка и копия
+    fcntl = None
+
+# ioctl клонирования файла в Linux (Btrfs, XFS): копия без записи данных
+FICLONE = 0x40049409
+
+class TicketSentError(Exception):
+    """Файл уже у пользователя, но отметить отправку в базе не удалось"""
+    
+    def __init__(self, telegram_file_id: str, error: Exception):
+        super().__init__(f"Файл доставлен, но не отмечен в базе: {error}")
+        self.telegram_file_id = telegram_file_id
+
+class RecipientUnreachableError(Exception):
+    """Telegram не доставит файл в этот чат: бот заблокирован или чат не найден, повторять бесполезно"""
+
 class FileManager:
     """Сервис управления файлами"""
     
     @staticmethod
-    def create_backup_copy(file_path: str, user_hash: str) -> str:
-        """Создает резервную копию файла"""
+    def _link_or_copy(source: str, target: str):
+        """Жесткая ссылка, reflink или полная копия — первое, что поддерживает файловая система"""
+        if Config.BACKUP_MODE == "link":
+            try:
+                os.link(source, target)
+                return
+            except OSError:
+                # Другой раздел или ФС без жестких ссылок
+                pass
+            
+            if fcntl is not None and sys.platform.startswith('linux'):
+                try:
+                    with open(source, 'rb') as source_file, open(target, 'wb') as target_file:
+                        fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+                    shutil.copystat(source, target)
+                    return
+                except OSError:
+                    if os.path.exists(target):
+                        os.remove(target)
+        
+        shutil.copy2(source, target)
+    
+    @staticmethod
+    def create_backup_copy(file: File) -> str:
+        """Создает резервную копию файла (синхронно, для рабочего потока), одну на содержимое"""
         try:
-            backup_filename = f"{user_hash}_backup{os.path.splitext(file_path)[1]}"
-            backup_path = os.path.join(Config.BACKUP_FOLDER, backup_filename)
-            shutil.copy2(file_path, backup_path)
+            if file.backup_path and os.path.exists(file.backup_path):
+                return file.backup_path
+            
+            # Имя по хэшу содержимого: одинаковые файлы делят одну копию
+            backup_key = file.content_hash or file.hash_name
+            backup_path = os.path.join(Config.BACKUP_FOLDER, f"{backup_key}{os.path.splitext(file.file_path)[1]}")
+            if os.path.exists(backup_path) and os.path.getsize(backup_path) == os.path.getsize(file.file_path):
+                return backup_path
+            
+            # Копия появляется под своим именем только целиком
+            temp_path = f"{backup_path}.{uuid.uuid4().hex[:8]}.tmp"
+            try:
+                FileManager._link_or_copy(file.file_path, temp_path)
+                os.replace(temp_path, backup_path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
             return backup_path
         except Exception as e:
             bot_logger.logger.error(f"Ошибка при создании резервной копии: {e}")
             return None
     
     @staticmethod
-    async def send_file_to_user(user_obj: User, file: File, application) -> bool:
-        """Отправляет файл пользователю и обновляет статусы"""
+    async def _send_document(application, chat_id: int, file: File, filename: str, caption: str):
+        """Отправляет документ по сохраненному file_id, а при отказе Telegram — с диска"""
+        if file.telegram_file_id:
+            try:
+                # Telegram покажет имя из первой загрузки файла; filename передается, чтобы
+                # оба пути отправки вызывались одинаково
+                return await application.bot.send_document(
+                    chat_id=chat_id,
+                    document=file.telegram_file_id,
+                    filename=filename,
+                    caption=caption
+                )
+            except BadRequest as e:
+                bot_logger.logger.warning("Telegram отклонил file_id файла %s, загружаем с диска: %s", file.id, e)
+        
+        paths = [path for path in (file.file_path, file.backup_path) if path and os.path.exists(path)]
+        if not paths:
+            raise FileNotFoundError(f"Файл {file.id} не найден ни на диске, ни в резервной копии")
+        
+        with open(paths[0], 'rb') as file_data:
+            return await application.bot.send_document(
+                chat_id=chat_id,
+                document=file_data,
+                filename=filename,
+                caption=caption
+            )
+    
+    @staticmethod
+    def _mark_sent(user_obj: User, file: File, backup_path: str, telegram_file_id: str):
+        """Сохраняет результат успешной отправки"""
         session = Session()
         try:
-            file_ext = os.path.splitext(file.file_path)[1]
-            
-            backup_path = FileManager.create_backup_copy(file.file_path, user_obj.file_hash)
-            
-            with open(file.file_path, 'rb') as file_data:
-                await application.bot.send_document(
-                    chat_id=user_obj.user_id,
-                    document=file_data,
-                    filename=f"{user_obj.file_hash}{file_ext}",
-                    caption=(
-                        f"🎫 Ваш уникальный файл!\n\n"
-                        f"🆔 Ваш ID: `{user_obj.file_hash}`\n"
-                        f"📁 Исходное название: {file.original_name}\n\n"
-                        f"💾 Сохраните файл в надежном месте!\n"
-                        f"🔧 Если файл будет утерян, используйте /recover для восстановления"
-                    )
-                )
+            # Объекты могли быть загружены в другой сессии — обновляем свои копии
+            db_file = session.get(File, file.id)
+            db_user = session.get(User, user_obj.id)
+            if db_file.distributed and db_file.distributed_to == user_obj.user_id:
+                # Отметка уже записана прошлой попыткой, хотя ее commit завершился ошибкой
+                return
+            StatsService.bump(
+                session,
+                distributed_files=0 if db_file.distributed else 1,
+                # Обычно файл уже зарезервирован и из свободных выбыл при резервации
+                free_files=-1 if not db_file.distributed and db_file.claim_state in (
+                    ClaimService.STATE_FREE, ClaimService.STATE_POOLED
+                ) else 0,
+                # Файл мероприятия выдается пользователю один раз — ожидающих становится меньше
+                users_without_files=-1 if db_user.has_access and db_file.event_id == db_user.event_id else 0
+            )
             
-            file.distributed = True
-            file.distributed_to = user_obj.user_id
-            file.distributed_at = datetime.utcnow()
-            file.backup_path = backup_path
+            db_file.distributed = True
+            db_file.distributed_to = user_obj.user_id
+            db_file.distributed_at = datetime.utcnow()
+            db_file.backup_path = backup_path
+            db_file.claim_state = ClaimService.STATE_SENT
+            db_file.claimed_by = user_obj.user_id
+            if telegram_file_id:
+                db_file.telegram_file_id = telegram_file_id
             
             delivery = FileDelivery(
                 user_id=user_obj.user_id,
@@ -59,28 +155,157 @@ class FileManager:
             )
             session.add(delivery)
             
-            user_obj.files_received += 1
-            user_obj.last_file_sent = datetime.utcnow()
-            user_obj.pending_file = False
+            db_user.files_received = (db_user.files_received or 0) + 1
+            db_user.last_file_sent = datetime.utcnow()
+            db_user.pending_file = False
             
             session.commit()
-            return True
-            
-        except Exception as e:
-            bot_logger.logger.error(f"Ошибка отправки файла пользователю {user_obj.user_id}: {e}")
-            
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    async def record_sent(user_obj: User, file: File, telegram_file_id: str, backup=None):
+        """Отмечает доставленный файл в базе с повторами; если не вышло — TicketSentError"""
+        backup_path = await (backup or asyncio.to_thread(FileManager.create_backup_copy, file))
+        
+        for attempt in range(1, Config.MARK_SENT_ATTEMPTS + 1):
+            try:
+                await run_db(FileManager._mark_sent, user_obj, file, backup_path, telegram_file_id)
+                return
+            except Exception as e:
+                bot_logger.logger.error(f"Не удалось отметить отправку файла {file.id} (попытка {attempt}): {e}")
+                if attempt == Config.MARK_SENT_ATTEMPTS:
+                    raise TicketSentError(telegram_file_id, e) from e
+                await asyncio.sleep(Config.MARK_SENT_RETRY_DELAY * attempt)
+    
+    @staticmethod
+    def _record_failure(user_id: int, file_id: int, error: str):
+        """Записывает неудачную попытку доставки"""
+        session = Session()
+        try:
             delivery = FileDelivery(
-                user_id=user_obj.user_id,
-                file_id=file.id,
+                user_id=user_id,
+                file_id=file_id,
                 delivery_status='failed',
-                error_message=str(e)
+                error_message=error
             )
             session.add(delivery)
             session.commit()
-            return False
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка записи неудачной доставки: {e}")
+            session.rollback()
         finally:
             session.close()
     
+    @staticmethod
+    def _mark_recovered(user_id: int, file: File, telegram_file_id: str):
+        """Сохраняет результат восстановления файла"""
+        session = Session()
+        try:
+            if telegram_file_id and telegram_file_id != file.telegram_file_id:
+                db_file = session.get(File, file.id)
+                db_file.telegram_file_id = telegram_file_id
+            
+            delivery = session.query(FileDelivery).filter_by(
+                user_id=user_id,
+                file_id=file.id
+            ).order_by(FileDelivery.id.desc()).first()
+            
+            if not delivery:
+                delivery = FileDelivery(user_id=user_id, file_id=file.id, recovery_attempts=0)
+                session.add(delivery)
+            
+            delivery.delivery_status = 'recovered'
+            delivery.recovery_attempts = (delivery.recovery_attempts or 0) + 1
+            delivery.last_recovery_attempt = datetime.utcnow()
+            
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    async def send_file_to_user(user_obj: User, file: File, application) -> bool:
+        """Отправляет файл пользователю и обновляет статусы"""
+        try:
+            file_ext = os.path.splitext(file.file_path)[1]
+            
+            # Резервная копия делается в потоке параллельно с загрузкой в Telegram
+            backup = asyncio.ensure_future(asyncio.to_thread(FileManager.create_backup_copy, file))
+            
+            started = time.perf_counter()
+            message = await FileManager._send_document(
+                application,
+                chat_id=user_obj.user_id,
+                file=file,
+                filename=f"{user_obj.file_hash}{file_ext}",
+                caption=(
+                    f"🎫 Ваш уникальный файл!\n\n"
+                    f"🆔 Ваш ID: `{user_obj.file_hash}`\n"
+                    f"📁 Исходное название: {file.original_name}\n\n"
+                    f"💾 Сохраните файл в надежном месте!\n"
+                    f"🔧 Если файл будет утерян, используйте /recover для восстановления"
+                )
+            )
+            metrics.observe_api('sendDocument', time.perf_counter() - started)
+            
+        except RetryAfter:
+            # Flood wait обрабатывается конвейером отправки, попытка будет повторена
+            metrics.inc('bot_api_flood_total', 'method', 'sendDocument')
+            raise
+            
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка отправки файла пользователю {user_obj.user_id}: {e}")
+            metrics.inc('bot_api_errors_total', 'method', 'sendDocument')
+            await run_db(FileManager._record_failure, user_obj.user_id, file.id, str(e))
+            if FileManager.is_unreachable(e):
+                raise RecipientUnreachableError(str(e)) from e
+            return False
+        
+        # Файл уже у пользователя: дальше ошибки только учетные, и повторять отправку
+        # или возвращать файл в свободные нельзя
+        telegram_file_id = message.document.file_id if message.document else None
+        await FileManager.record_sent(user_obj, file, telegram_file_id, backup)
+        return True
+    
+    @staticmethod
+    def is_unreachable(error: Exception) -> bool:
+        """Ошибка Telegram, после которой писать этому пользователю бесполезно"""
+        return isinstance(error, Forbidden) or (
+            isinstance(error, BadRequest) and 'chat not found' in str(error).lower()
+        )
+    
+    @staticmethod
+    async def resend_file_to_user(user_obj: User, file: File, application) -> bool:
+        """Повторно отправляет уже выданный файл (восстановление)"""
+        try:
+            file_ext = os.path.splitext(file.file_path)[1]
+            
+            message = await FileManager._send_document(
+                application,
+                chat_id=user_obj.user_id,
+                file=file,
+                filename=f"{user_obj.file_hash}{file_ext}",
+                caption=(
+                    f"🔁 Восстановленный файл\n\n"
+                    f"🆔 Ваш ID: `{user_obj.file_hash}`\n"
+                    f"📁 Исходное название: {file.original_name}"
+                )
+            )
+            
+            telegram_file_id = message.document.file_id if message.document else None
+            await run_db(FileManager._mark_recovered, user_obj.user_id, file, telegram_file_id)
+            return True
+            
+        except Exception as e:
+            bot_logger.logger.error(f"Ошибка восстановления файла пользователю {user_obj.user_id}: {e}")
+            return False
+    
     @staticmethod
     def generate_user_hash(user_id: int) -> str:
         """Генерирует уникальный хэш для пользователя"""
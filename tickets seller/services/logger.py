@@ -1,12 +1,50 @@
+import atexit
+import contextvars
+import json
 import logging
 import logging.handlers
 import os
+import queue
 from config import Config
 
+# Идентификатор корреляции текущего обновления Telegram; задается в track_update
+correlation_id = contextvars.ContextVar('correlation_id', default='-')
+
+class CorrelationFilter(logging.Filter):
+    """Добавляет в запись id корреляции, пока она еще в потоке, который ее создал"""
+    
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        return True
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не форматирует запись в вызывающем потоке"""
+    
+    def prepare(self, record):
+        # Очередь внутри процесса: запись передается как есть, а подстановка
+        # аргументов и форматирование выполняются в потоке QueueListener
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON"""
+    
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'correlation_id': getattr(record, 'correlation_id', '-'),
+            'message': record.getMessage()
+        }
+        payload.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
 class OptimizedLogger:
     """Оптимизированная система логирования"""
     
     def __init__(self):
+        self.listener = None
         self.setup_logging()
     
     def setup_logging(self):
@@ -18,11 +56,14 @@ class OptimizedLogger:
         self.logger = logging.getLogger('TelegramBot')
         self.logger.setLevel(logging.INFO)
         
-        # Форматтер с минимальной информацией
-        formatter = logging.Formatter(
-            '%(asctime)s | %(levelname)s | %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
+        # Текстовый формат с минимальной информацией или JSON для сборщиков логов
+        if Config.LOG_FORMAT == "json":
+            formatter = JsonFormatter(datefmt='%Y-%m-%dT%H:%M:%S')
+        else:
+            formatter = logging.Formatter(
+                '%(asctime)s | %(levelname)s | %(correlation_id)s | %(message)s',
+                datefmt='%Y-%m-%d %H:%M:%S'
+            )
         
         # Ротируемый файловый обработчик
         log_file = os.path.join(Config.LOG_FOLDER, 'bot_actions.log')
@@ -34,25 +75,48 @@ class OptimizedLogger:
         )
         file_handler.setFormatter(formatter)
         
-        # Добавляем обработчик
-        self.logger.addHandler(file_handler)
-        
         # Также добавляем вывод в консоль для отладки
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(formatter)
-        self.logger.addHandler(console_handler)
+        
+        # Запись в файл и консоль идет в фоновом потоке, обработчики только кладут запись в очередь
+        log_queue = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(CorrelationFilter())
+        self.logger.addHandler(queue_handler)
+        
+        self.listener = logging.handlers.QueueListener(
+            log_queue, file_handler, console_handler, respect_handler_level=True
+        )
+        self.listener.start()
+        atexit.register(self.shutdown)
+    
+    def shutdown(self):
+        """Дописывает оставшиеся записи и останавливает фоновый поток"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+    
+    async def track_update(self, update, context):
+        """Обработчик группы -1: присваивает обновлению id корреляции для всех его записей"""
+        correlation_id.set(f"upd-{update.update_id}")
     
     def log_admin_action(self, admin_user: object, action: str, details: str = ""):
         """Логирование действий администратора"""
         try:
-            log_message = f"ADMIN | {admin_user.id} | {admin_user.first_name} | {action}"
-            if details:
-                log_message += f" | {details}"
-            
-            self.logger.info(log_message)
+            self.logger.info(
+                "ADMIN | %s | %s | %s%s",
+                admin_user.id, admin_user.first_name, action, f" | {details}" if details else "",
+                extra={'fields': {'admin_id': admin_user.id, 'action': action, 'details': details}}
+            )
             
         except Exception as e:
             self.logger.error(f"LOG_ERROR: {e}")
+    
+    async def admin_action(self, admin_user: object, action: str, details: str = ""):
+        """Логирование действий администратора из асинхронных обработчиков"""
+        # Запись только ставится в очередь, поэтому цикл событий не блокируется
+        self.log_admin_action(admin_user, action, details)
 
 # Глобальный экземпляр логгера
 bot_logger = OptimizedLogger()
\ No newline at end of file
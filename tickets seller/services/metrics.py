@@ -0,0 +1,166 @@
+import bisect
+import contextvars
+import functools
+import math
+import threading
+import time
+from collections import deque
+from sqlalchemy import event
+from aiohttp import web
+from database.session import engine
+from services.logger import bot_logger
+from config import Config
+
+# Счетчик запросов к БД текущего обновления; run_db переносит контекст в поток БД
+_update_queries = contextvars.ContextVar('update_queries', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+def percentile(values, p: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+class Histogram:
+    """Гистограмма Prometheus и окно последних значений для перцентилей"""
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=Config.METRICS_WINDOW)
+    
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+class Metrics:
+    """Реестр метрик бота"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # (имя, метка, значение метки) -> Histogram
+        self.counters = {}  # (имя, метка, значение метки) -> число
+    
+    def observe(self, name: str, label: str, value_label: str, value: float, buckets=DURATION_BUCKETS):
+        with self._lock:
+            key = (name, label, value_label)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+    
+    def inc(self, name: str, label: str = None, value_label: str = None, amount: int = 1):
+        with self._lock:
+            key = (name, label, value_label)
+            self.counters[key] = self.counters.get(key, 0) + amount
+    
+    def on_query(self, *args):
+        """Событие движка: каждый выполненный SQL-запрос"""
+        self.inc('db_queries_total')
+        holder = _update_queries.get()
+        if holder is not None:
+            holder[0] += 1
+    
+    def instrument(self, callback):
+        """Оборачивает обработчик: время выполнения, ошибки и число запросов к БД"""
+        name = callback.__qualname__
+        
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            holder = [0]
+            token = _update_queries.set(holder)
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                self.inc('handler_errors_total', 'handler', name)
+                raise
+            finally:
+                self.observe('handler_duration_seconds', 'handler', name, time.perf_counter() - started)
+                self.observe('handler_db_queries', 'handler', name, holder[0], QUERY_BUCKETS)
+                _update_queries.reset(token)
+        
+        return wrapper
+    
+    def observe_api(self, method: str, seconds: float):
+        """Задержка вызова Bot API"""
+        self.observe('bot_api_duration_seconds', 'method', method, seconds)
+    
+    def render_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, label, value_label), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                labels = f'{label}="{value_label}"'
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+            
+            for (name, label, value_label), value in sorted(self.counters.items(), key=lambda item: str(item[0])):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                labels = f'{{{label}="{value_label}"}}' if label else ""
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+    
+    def summary(self, name: str) -> dict:
+        """Перцентили по последним значениям: {значение метки: (count, p50, p95, p99)}"""
+        with self._lock:
+            series = {
+                value_label: (histogram.count, list(histogram.recent))
+                for (metric, _, value_label), histogram in self.histograms.items()
+                if metric == name
+            }
+        return {
+            value_label: (count, percentile(recent, 50), percentile(recent, 95), percentile(recent, 99))
+            for value_label, (count, recent) in series.items()
+        }
+    
+    def counter(self, name: str, label: str = None, value_label: str = None) -> int:
+        with self._lock:
+            return self.counters.get((name, label, value_label), 0)
+
+class MetricsServer:
+    """HTTP-сервер с метриками для Prometheus"""
+    
+    def __init__(self, registry: Metrics):
+        self.registry = registry
+        self._runner = None
+    
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render_prometheus(), content_type='text/plain', charset='utf-8')
+    
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, Config.METRICS_LISTEN, Config.METRICS_PORT).start()
+        bot_logger.logger.info("Метрики доступны на %s:%s/metrics", Config.METRICS_LISTEN, Config.METRICS_PORT)
+    
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+# Глобальный реестр метрик
+metrics = Metrics()
+event.listen(engine, 'before_cursor_execute', metrics.on_query)
+metrics_server = MetricsServer(metrics)
\ No newline at end of file
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+from sqlalchemy import select, update
+from database.session import Session
+from database.models import File
+from services.claims import ClaimService
+from services.logger import bot_logger
+from services.stats import StatsService
+from config import Config
+
+class InventoryReconciler:
+    """Фоновая сверка файлов на диске с таблицей files порциями, без загрузки каталога целиком"""
+    
+    def __init__(self):
+        self._stopping = threading.Event()
+        self._task = None
+    
+    @staticmethod
+    def _entry_batches(folder: str):
+        """Файлы каталога порциями по RECONCILE_BATCH_SIZE"""
+        if not os.path.isdir(folder):
+            return
+        batch = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                batch.append(entry)
+                if len(batch) >= Config.RECONCILE_BATCH_SIZE:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+    
+    @staticmethod
+    def _is_recent(entry: os.DirEntry, now: float) -> bool:
+        """Файл мог только что появиться: его дописывает загрузка архива или отправка еще не отметила копию.
+        ctime учитывается, потому что жесткая ссылка на резервную копию сохраняет mtime исходного файла"""
+        stat = entry.stat(follow_symlinks=False)
+        return max(stat.st_mtime, stat.st_ctime) > now - Config.RECONCILE_GRACE
+    
+    @staticmethod
+    def _referenced(column, paths: list) -> set:
+        """Какие из путей записаны в колонке таблицы files"""
+        session = Session()
+        try:
+            return set(session.scalars(select(column).where(column.in_(paths))))
+        finally:
+            session.close()
+    
+    @staticmethod
+    def _quarantine(path: str, kind: str) -> bool:
+        """Переносит файл без записи в базе в карантин вместо удаления"""
+        target_dir = os.path.join(Config.QUARANTINE_FOLDER, kind)
+        try:
+            os.makedirs(target_dir, exist_ok=True)
+            shutil.move(path, os.path.join(target_dir, os.path.basename(path)))
+            return True
+        except FileNotFoundError:
+            # Файл уже убрал другой процесс или загрузка архива
+            return False
+        except OSError as e:
+            bot_logger.logger.error(f"Не удалось перенести в карантин {path}: {e}")
+            return False
+    
+    def _sweep_orphans(self, folder: str, column, kind: str) -> int:
+        """Файлы каталога, на которые не ссылается ни одна строка files, уходят в карантин"""
+        moved = 0
+        for batch in InventoryReconciler._entry_batches(folder):
+            if self._stopping.is_set():
+                break
+            now = time.time()
+            candidates = [entry.path for entry in batch if not InventoryReconciler._is_recent(entry, now)]
+            if candidates:
+                referenced = InventoryReconciler._referenced(column, candidates)
+                for path in candidates:
+                    if path not in referenced and InventoryReconciler._quarantine(path, kind):
+                        moved += 1
+            time.sleep(Config.RECONCILE_PAUSE)
+        return moved
+    
+    @staticmethod
+    def _mark_rows(missing_ids: list, restored_ids: list) -> tuple:
+        """Помечает непроданные файлы без данных на диске недоступными и возвращает найденные обратно"""
+        session = Session()
+        try:
+            missing = restored = 0
+            if missing_ids:
+                # Состояние проверяется заново: файл могли зарезервировать после чтения порции
+                missing = session.execute(
+                    update(File)
+                    .where(
+                        File.id.in_(missing_ids),
+                        File.distributed == False,
+                        File.claim_state.in_((ClaimService.STATE_FREE, ClaimService.STATE_POOLED))
+                    )
+                    .values(claim_state=ClaimService.STATE_MISSING, claimed_at=None, pooled_by=None)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+            if restored_ids:
+                restored = session.execute(
+                    update(File)
+                    .where(File.id.in_(restored_ids), File.claim_state == ClaimService.STATE_MISSING)
+                    .values(claim_state=ClaimService.STATE_FREE)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+            StatsService.bump(session, free_files=restored - missing)
+            session.commit()
+            return missing, restored
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    def _check_rows(self, report: dict):
+        """Проверяет наличие файлов для строк files порциями по возрастанию id"""
+        last_id = 0
+        while not self._stopping.is_set():
+            session = Session()
+            try:
+                rows = session.execute(
+                    select(File.id, File.file_path, File.backup_path, File.claim_state, File.distributed)
+                    .where(File.id > last_id)
+                    .order_by(File.id)
+                    .limit(Config.RECONCILE_BATCH_SIZE)
+                ).all()
+            finally:
+                session.close()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            
+            missing_ids = []
+            restored_ids = []
+            for row in rows:
+                on_disk = bool(row.file_path) and os.path.exists(row.file_path)
+                if row.claim_state == ClaimService.STATE_MISSING:
+                    if on_disk:
+                        restored_ids.append(row.id)
+                elif row.claim_state in (ClaimService.STATE_FREE, ClaimService.STATE_POOLED) and not row.distributed:
+                    if not on_disk:
+                        missing_ids.append(row.id)
+                elif not on_disk and not (row.backup_path and os.path.exists(row.backup_path)):
+                    # Выданный билет нечем отправить повторно — только сообщаем
+                    report['lost'] += 1
+            
+            if missing_ids or restored_ids:
+                missing, restored = InventoryReconciler._mark_rows(missing_ids, restored_ids)
+                report['missing'] += missing
+                report['restored'] += restored
+            time.sleep(Config.RECONCILE_PAUSE)
+    
+    def run_once(self) -> dict:
+        """Один проход сверки (синхронно, для рабочего потока)"""
+        started = time.perf_counter()
+        report = {'missing': 0, 'restored': 0, 'lost': 0}
+        # Сначала строки: недоступные файлы должны выпасть из выдачи как можно раньше
+        self._check_rows(report)
+        report['upload_orphans'] = self._sweep_orphans(Config.UPLOAD_FOLDER, File.file_path, 'uploads')
+        report['backup_orphans'] = self._sweep_orphans(Config.BACKUP_FOLDER, File.backup_path, 'backups')
+        
+        if any(report.values()):
+            bot_logger.logger.info(
+                "Сверка файлов за %.1f с: недоступно %s, найдено снова %s, утрачено выданных %s, "
+                "в карантин из загрузок %s, из резервных копий %s",
+                time.perf_counter() - started, report['missing'], report['restored'], report['lost'],
+                report['upload_orphans'], report['backup_orphans']
+            )
+        if report['lost']:
+            bot_logger.logger.warning("Выданных билетов без файла и резервной копии: %s", report['lost'])
+        return report
+    
+    async def start(self):
+        """Запускает периодическую сверку, если она включена"""
+        if not Config.RECONCILE_INTERVAL:
+            return
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+        bot_logger.logger.info("Сверка файлов с базой запущена")
+    
+    async def stop(self):
+        """Прерывает проход после текущей порции"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                bot_logger.logger.error(f"Ошибка сверки файлов с базой: {e}")
+            await asyncio.sleep(Config.RECONCILE_INTERVAL)
+
+# Общий сверщик процесса бота
+inventory_reconciler = InventoryReconciler()
\ No newline at end of file
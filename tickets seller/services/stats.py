@@ -0,0 +1,133 @@
+from sqlalchemy import select, func, case, update, insert, true
+from database.session import Session
+from database.models import User, File, SubscriptionLink, StatCounter, Event
+from services.logger import bot_logger
+from config import Config
+
+class StatsService:
+    """Счетчики для панели и экрана статистики администратора"""
+    
+    COUNTERS = (
+        'users_count',
+        'active_users',
+        'users_without_files',
+        'files_count',
+        'distributed_files',
+        'free_files',
+        'links_count',
+        'used_links'
+    )
+    
+    @staticmethod
+    def compute_stats(session=None, event_id: int = None) -> dict:
+        """Точные значения одним агрегирующим запросом по всем таблицам (или по одному мероприятию)"""
+        # Импортируем здесь, чтобы избежать циклического импорта
+        from services.claims import ClaimService
+        
+        def count_if(condition):
+            return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+        
+        users = select(
+            func.count(User.id).label('users_count'),
+            count_if(User.has_access == True).label('active_users'),
+            # Ожидают файл текущего мероприятия: выданные по прошлым мероприятиям не считаются
+            count_if(
+                (User.has_access == True) & ~ClaimService.event_file_exists(User.user_id, User.event_id, sent_only=True)
+            ).label('users_without_files')
+        )
+        files = select(
+            func.count(File.id).label('files_count'),
+            count_if(File.distributed == True).label('distributed_files'),
+            # Свободны файлы, которые еще можно выдать: зарезервированные и недоступные не считаются
+            count_if(ClaimService.available_files_filter()).label('free_files')
+        )
+        links = select(
+            func.count(SubscriptionLink.id).label('links_count'),
+            count_if(SubscriptionLink.is_used == True).label('used_links')
+        )
+        if event_id is not None:
+            # Индексы по event_id ограничивают подсчет строками одного мероприятия
+            users = users.where(User.event_id == event_id)
+            files = files.where(File.event_id == event_id)
+            links = links.where(SubscriptionLink.event_id == event_id)
+        users, files, links = users.subquery(), files.subquery(), links.subquery()
+        
+        own_session = session is None
+        session = session or Session()
+        try:
+            # Каждая подвыборка дает ровно одну строку, соединяем их без условий
+            query = select(users, files, links).select_from(users.join(files, true()).join(links, true()))
+            row = session.execute(query).mappings().one()
+            return {name: int(row[name]) for name in StatsService.COUNTERS}
+        finally:
+            if own_session:
+                session.close()
+    
+    @staticmethod
+    def get_event_stats() -> list:
+        """Статистика каждого мероприятия: [(мероприятие, счетчики)]"""
+        session = Session()
+        try:
+            events = session.scalars(select(Event).order_by(Event.id)).all()
+            return [(event, StatsService.compute_stats(session, event.id)) for event in events]
+        finally:
+            session.close()
+    
+    @staticmethod
+    def rebuild_counters() -> dict:
+        """Пересчитывает таблицу счетчиков по фактическим данным"""
+        session = Session()
+        try:
+            # Строки счетчиков блокируются до подсчета: bump другого процесса дождется commit
+            # и ляжет поверх точных значений, а не пропадет при перезаписи (в SQLite писатель и так один)
+            existing = set(session.scalars(select(StatCounter.name).with_for_update()))
+            stats = StatsService.compute_stats(session)
+            for name in StatsService.COUNTERS:
+                if name in existing:
+                    session.execute(
+                        update(StatCounter)
+                        .where(StatCounter.name == name)
+                        .values(value=stats[name])
+                    )
+            missing = [name for name in StatsService.COUNTERS if name not in existing]
+            if missing:
+                session.execute(insert(StatCounter), [
+                    {'name': name, 'value': stats[name]} for name in missing
+                ])
+            session.commit()
+            return stats
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def bump(session, **deltas):
+        """Изменяет счетчики в транзакции вызывающего кода, до его commit"""
+        for name, delta in deltas.items():
+            if delta:
+                session.execute(
+                    update(StatCounter)
+                    .where(StatCounter.name == name)
+                    .values(value=StatCounter.value + delta)
+                )
+    
+    @staticmethod
+    def get_stats() -> dict:
+        """Статистика из таблицы счетчиков (или точным подсчетом, если счетчики отключены)"""
+        if not Config.STATS_USE_COUNTERS:
+            return StatsService.compute_stats()
+        
+        session = Session()
+        try:
+            stats = dict(session.execute(select(StatCounter.name, StatCounter.value)).all())
+        finally:
+            session.close()
+        
+        if any(name not in stats for name in StatsService.COUNTERS):
+            # Счетчики еще не заполнены — считаем один раз и сохраняем
+            bot_logger.logger.info("Таблица счетчиков пуста, выполняется пересчет")
+            return StatsService.rebuild_counters()
+        
+        return stats
\ No newline at end of file
@@ -1,9 +1,15 @@
 import hashlib
 import uuid
 from datetime import datetime
+from typing import List
+from sqlalchemy import insert, select, update
 from database.session import Session
-from database.models import User, SubscriptionLink, File, FileDelivery
+from database.executor import run_db
+from database.models import User, SubscriptionLink, DEFAULT_EVENT_ID
 from services.logger import bot_logger
+from services.auth import AuthService
+from services.claims import ClaimService
+from services.stats import StatsService
 # УБЕРИТЕ этот импорт: from services.file_manager import FileManager
 
 class SubscriptionService:
@@ -21,27 +27,43 @@ class SubscriptionService:
         return hash_object.hexdigest()[:16]
     
     @staticmethod
-    def create_subscription_link(seller_id: int) -> str:
-        """Создает уникальную одноразовую ссылку для подписки"""
+    def link_url(bot_username: str, token: str) -> str:
+        """Ссылка, открывающая бота с токеном подписки"""
+        return f"https://t.me/{bot_username}?start={token}"
+    
+    @staticmethod
+    def create_subscription_link(seller_id: int, bot_username: str, event_id: int = DEFAULT_EVENT_ID) -> str:
+        """Создает уникальную одноразовую ссылку для подписки на мероприятие"""
+        links = SubscriptionService.create_subscription_links(seller_id, 1, bot_username, event_id)
+        return links[0] if links else None
+    
+    @staticmethod
+    def create_subscription_links(seller_id: int, count: int, bot_username: str, event_id: int = DEFAULT_EVENT_ID) -> List[str]:
+        """Создает пачку одноразовых ссылок одним многострочным INSERT и одним commit"""
         session = Session()
         try:
-            token = SubscriptionService.generate_subscription_token()
-            
-            link = SubscriptionLink(
-                token=token,
-                created_by=seller_id
-            )
-            session.add(link)
+            tokens = {SubscriptionService.generate_subscription_token() for _ in range(count)}
+            # Совпадение токенов внутри пачки маловероятно, но дубликат уронил бы весь INSERT
+            while len(tokens) < count:
+                tokens.add(SubscriptionService.generate_subscription_token())
+            
+            now = datetime.utcnow()
+            session.execute(insert(SubscriptionLink), [{
+                'token': token,
+                'created_by': seller_id,
+                'created_at': now,
+                'is_used': False,
+                'event_id': event_id
+            } for token in tokens])
+            StatsService.bump(session, links_count=count)
             session.commit()
             
-            # Получаем username бота (это будет исправлено позже)
-            subscription_link = f"https://t.me/your_bot?start={token}"
-            return subscription_link
+            return [SubscriptionService.link_url(bot_username, token) for token in tokens]
             
         except Exception as e:
-            bot_logger.logger.error(f"Ошибка при создании ссылки: {e}")
+            bot_logger.logger.error(f"Ошибка при создании ссылок: {e}")
             session.rollback()
-            return None
+            return []
         finally:
             session.close()
     
@@ -50,9 +72,9 @@ class SubscriptionService:
         """Активирует подписку по токену"""
         session = Session()
         try:
-            bot_logger.logger.info(f"Активация подписки для {user_id} с токеном: {token}")
+            bot_logger.logger.info("Активация подписки для %s с токеном: %s", user_id, token)
             
-            # Ищем ссылку по токену
+            # Ищем ссылку по токену (занята ли она, решает условный UPDATE ниже)
             link = session.query(SubscriptionLink).filter_by(token=token).first()
             
             if not link:
@@ -66,37 +88,66 @@ class SubscriptionService:
             # Проверяем существующего пользователя
             existing_user = session.query(User).filter_by(user_id=user_id).first()
             
-            if existing_user and existing_user.has_access:
-                bot_logger.logger.error(f"Пользователь уже имеет активную подписку")
+            # Доступ выдается на мероприятие: по ссылке другого мероприятия можно купить еще билет,
+            # если билета этого мероприятия у пользователя нет, а прошлый уже получен
+            if existing_user and session.scalar(select(ClaimService.event_file_exists(user_id, link.event_id))):
+                bot_logger.logger.error(f"Пользователь уже имеет билет мероприятия {link.event_id}")
                 return False
             
+            if existing_user and existing_user.has_access and not session.scalar(
+                select(ClaimService.event_file_exists(user_id, existing_user.event_id, sent_only=True))
+            ):
+                bot_logger.logger.error(f"Пользователь еще ожидает билет мероприятия {existing_user.event_id}")
+                return False
+            
+            user_hash = None if existing_user else SubscriptionService.generate_user_hash(user_id)
+            
+            # Ссылка захватывается одним условным UPDATE: из параллельных активаций
+            # одного токена его строку изменит только одна, остальные получат отказ
+            now = datetime.utcnow()
+            claimed = session.execute(
+                update(SubscriptionLink)
+                .where(SubscriptionLink.id == link.id, SubscriptionLink.is_used == False)
+                .values(is_used=True, used_by=user_id, used_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if claimed != 1:
+                session.rollback()
+                bot_logger.logger.error(f"Ссылка уже использована")
+                return False
+            StatsService.bump(session, used_links=1)
+            
             # Создаем или обновляем пользователя
             if not existing_user:
-                user_hash = SubscriptionService.generate_user_hash(user_id)
                 user = User(
                     user_id=user_id,
                     username="",
                     first_name="",
                     file_hash=user_hash,
                     has_access=True,
-                    subscription_date=datetime.utcnow(),
-                    pending_file=True
+                    subscription_date=now,
+                    pending_file=True,
+                    event_id=link.event_id
                 )
                 session.add(user)
-                bot_logger.logger.info(f"Создан новый пользователь: {user_id}")
+                StatsService.bump(session, users_count=1, active_users=1, users_without_files=1)
+                bot_logger.logger.info("Создан новый пользователь: %s", user_id)
             else:
+                StatsService.bump(
+                    session,
+                    active_users=0 if existing_user.has_access else 1,
+                    # Билета этого мероприятия у пользователя нет — он снова ожидает файл
+                    users_without_files=1
+                )
                 existing_user.has_access = True
-                existing_user.subscription_date = datetime.utcnow()
+                existing_user.subscription_date = now
                 existing_user.pending_file = True
-                bot_logger.logger.info(f"Обновлен существующий пользователь: {user_id}")
-            
-            # Обновляем статус ссылки
-            link.is_used = True
-            link.used_by = user_id
-            link.used_at = datetime.utcnow()
+                existing_user.event_id = link.event_id
+                bot_logger.logger.info("Обновлен существующий пользователь: %s", user_id)
             
             session.commit()
-            bot_logger.logger.info(f"Подписка активирована для пользователя {user_id}")
+            AuthService.invalidate_user(user_id)
+            bot_logger.logger.info("Подписка активирована для пользователя %s", user_id)
             return True
             
         except Exception as e:
@@ -107,46 +158,21 @@ class SubscriptionService:
             session.close()
     
     @staticmethod
-    async def auto_send_to_new_users(application):
-        """Автоматически отправляет файлы новым пользователям"""
-        session = Session()
+    async def auto_send_to_new_users(user_id: int):
+        """Ставит в очередь отправку файла только что активированному пользователю"""
         try:
-            new_users = session.query(User).filter(
-                User.has_access == True,
-                User.files_received == 0,
-                User.pending_file == True
-            ).all()
-            
-            if not new_users:
-                return
-            
-            free_files = session.query(File).filter_by(distributed=False).all()
-            
-            if not free_files:
-                bot_logger.logger.info("Нет свободных файлов для автоматической отправки")
-                return
-            
-            # Импортируем FileManager здесь, чтобы избежать циклического импорта
-            from services.file_manager import FileManager
-            
-            sent_count = 0
-            for user_obj, file in zip(new_users, free_files):
-                if len(free_files) <= sent_count:
-                    break
-                    
-                try:
-                    success = await FileManager.send_file_to_user(user_obj, file, application)
-                    if success:
-                        sent_count += 1
-                        bot_logger.logger.info(f"Автоматически отправлен файл пользователю {user_obj.user_id}")
-                except Exception as e:
-                    bot_logger.logger.error(f"Ошибка автоматической отправки: {e}")
-                    continue
-            
-            if sent_count > 0:
-                bot_logger.logger.info(f"Автоматически отправлено {sent_count} файлов")
+            # Импортируем очередь здесь, чтобы избежать циклического импорта
+            from services.delivery_queue import DeliveryQueue, delivery_worker
+            
+            # Остальных ожидающих подбирает периодический проход очереди, не каждая активация
+            result = await run_db(DeliveryQueue.enqueue_user, user_id)
+            
+            if result['no_file']:
+                bot_logger.logger.info("Нет свободных файлов для автоматической отправки пользователю %s", user_id)
+            
+            if result['queued'] > 0:
+                delivery_worker.wake()
+                bot_logger.logger.info("Поставлена в очередь отправка файла пользователю %s", user_id)
                 
         except Exception as e:
-            bot_logger.logger.error(f"Ошибка в auto_send_to_new_users: {e}")
-        finally:
-            session.close()
\ No newline at end of file
+            bot_logger.logger.error(f"Ошибка в auto_send_to_new_users: {e}")
\ No newline at end of file
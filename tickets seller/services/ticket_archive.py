@@ -0,0 +1,161 @@
+import hashlib
+import os
+import shutil
+import threading
+import zipfile
+from typing import List, Tuple
+from sqlalchemy import select
+from database.session import Session
+from database.models import File
+from services.claims import ClaimService
+from services.logger import bot_logger
+from config import Config
+
+# Запас на локальный и центральный заголовки записи ZIP, кроме длины имени
+ZIP_ENTRY_OVERHEAD = 128
+ZIP_END_OVERHEAD = 1024
+
+class TicketArchiveService:
+    """Архив свободных билетов частями, с кэшем по версии остатка"""
+    
+    _lock = threading.Lock()
+    _uploaded = {}  # путь части -> file_id в Telegram
+    COMPLETE_MARKER = '.complete'
+    
+    @staticmethod
+    def inventory_signature() -> str:
+        """Версия набора свободных файлов: число файлов и хеш их упорядоченных id.
+        Разные наборы дают разные версии, поэтому архив с уже выданными билетами не попадет из кэша"""
+        session = Session()
+        try:
+            digest = hashlib.sha1()
+            count = 0
+            for file_id in session.scalars(
+                select(File.id)
+                .where(ClaimService.available_files_filter())
+                .order_by(File.id)
+                .execution_options(yield_per=Config.REPORT_BATCH_SIZE)
+            ):
+                digest.update(f"{file_id},".encode())
+                count += 1
+            return f"{count}-{digest.hexdigest()}"
+        finally:
+            session.close()
+    
+    @staticmethod
+    def _cache_dir(signature: str) -> str:
+        return os.path.join(
+            Config.ARCHIVE_FOLDER,
+            f"free_{hashlib.sha1(signature.encode()).hexdigest()[:12]}"
+        )
+    
+    @staticmethod
+    def _cached_archive(cache_dir: str):
+        """Части и счетчики готового архива, если он был собран полностью"""
+        marker = os.path.join(cache_dir, TicketArchiveService.COMPLETE_MARKER)
+        if not os.path.exists(marker):
+            return None
+        with open(marker) as marker_file:
+            added, missing = (int(value) for value in marker_file.read().split())
+        parts = sorted(
+            (os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.zip')),
+            key=lambda path: int(path.rsplit('part', 1)[1].split('.')[0])
+        )
+        return parts, added, missing
+    
+    @staticmethod
+    def uploaded_file_id(path: str):
+        """file_id Telegram для уже отправленной части архива"""
+        return TicketArchiveService._uploaded.get(path)
+    
+    @staticmethod
+    def remember_upload(path: str, file_id: str):
+        """Запоминает file_id отправленной части, чтобы не загружать ее повторно"""
+        TicketArchiveService._uploaded[path] = file_id
+    
+    @staticmethod
+    def _drop_stale(keep_dir: str):
+        """Удаляет архивы прежних версий остатка"""
+        for name in os.listdir(Config.ARCHIVE_FOLDER):
+            path = os.path.join(Config.ARCHIVE_FOLDER, name)
+            if name.startswith('free_') and path != keep_dir and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+    
+    @staticmethod
+    def _iter_free_files():
+        """Свободные файлы порциями, без загрузки всей таблицы"""
+        session = Session()
+        try:
+            result = session.execute(
+                select(File.id, File.original_name, File.file_path)
+                .where(ClaimService.available_files_filter())
+                .order_by(File.id)
+                .execution_options(yield_per=Config.REPORT_BATCH_SIZE)
+            )
+            for row in result:
+                yield row
+        finally:
+            session.close()
+    
+    @staticmethod
+    def build_free_archive() -> Tuple[List[str], int, int]:
+        """Собирает архив (синхронно, для рабочего потока), возвращает (части, файлов, не найдено на диске)"""
+        with TicketArchiveService._lock:
+            signature = TicketArchiveService.inventory_signature()
+            if signature.startswith('0-'):
+                return [], 0, 0
+            
+            cache_dir = TicketArchiveService._cache_dir(signature)
+            
+            cached = TicketArchiveService._cached_archive(cache_dir)
+            if cached:
+                return cached
+            
+            TicketArchiveService._drop_stale(cache_dir)
+            TicketArchiveService._uploaded.clear()
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            os.makedirs(cache_dir)
+            
+            parts = []
+            zip_ref = None
+            part_size = 0
+            added = 0
+            missing = 0
+            try:
+                for file_id, original_name, file_path in TicketArchiveService._iter_free_files():
+                    if not file_path or not os.path.exists(file_path):
+                        missing += 1
+                        continue
+                    
+                    arcname = f"{file_id}_{original_name}"
+                    entry_size = os.path.getsize(file_path) + ZIP_ENTRY_OVERHEAD + 2 * len(arcname.encode())
+                    
+                    # Новая часть, если текущая с этим файлом превысит лимит Telegram
+                    if zip_ref is None or (part_size and part_size + entry_size + ZIP_END_OVERHEAD > Config.ARCHIVE_PART_SIZE):
+                        if zip_ref is not None:
+                            zip_ref.close()
+                        parts.append(os.path.join(cache_dir, f"free_tickets_part{len(parts) + 1}.zip"))
+                        # PDF почти не сжимаются — храним без сжатия, это быстрее
+                        zip_ref = zipfile.ZipFile(parts[-1], 'w', zipfile.ZIP_STORED)
+                        part_size = 0
+                    
+                    zip_ref.write(file_path, arcname)
+                    part_size += entry_size
+                    added += 1
+                
+                if zip_ref is not None:
+                    zip_ref.close()
+            except Exception:
+                if zip_ref is not None:
+                    zip_ref.close()
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                raise
+            
+            if not added:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                return [], 0, missing
+            
+            with open(os.path.join(cache_dir, TicketArchiveService.COMPLETE_MARKER), 'w') as marker_file:
+                marker_file.write(f"{added} {missing}")
+            bot_logger.logger.info(f"Собран архив свободных билетов: {added} файлов, частей: {len(parts)}")
+            return parts, added, missing
\ No newline at end of file
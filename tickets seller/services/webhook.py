@@ -0,0 +1,113 @@
+import asyncio
+import hmac
+import json
+import secrets
+import signal
+from aiohttp import web
+from telegram import Update
+from services.logger import bot_logger
+from config import Config
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+class WebhookServer:
+    """Прием обновлений Telegram через встроенный HTTP-сервер вместо run_polling"""
+    
+    def __init__(self, application, secret_token: str = None, path: str = None):
+        self.application = application
+        # Без заданного токена генерируем случайный: он все равно передается в setWebhook
+        self.secret_token = secret_token or Config.WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+        self.path = path or Config.WEBHOOK_PATH
+    
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Проверяет секретный токен и ставит обновление в очередь приложения"""
+        received_token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(received_token.encode(), self.secret_token.encode()):
+            bot_logger.logger.warning("Webhook: отклонен запрос с неверным токеном от %s", request.remote)
+            return web.Response(status=403)
+        
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except (json.JSONDecodeError, TypeError, KeyError, ValueError) as e:
+            bot_logger.logger.error(f"Webhook: некорректное обновление: {e}")
+            return web.Response(status=400)
+        
+        if update is None:
+            return web.Response(status=400)
+        
+        # Ответ Telegram уходит сразу, обработка идет параллельно (concurrent_updates)
+        await self.application.update_queue.put(update)
+        return web.Response(status=200)
+    
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """Состояние бота для балансировщика и мониторинга"""
+        running = self.application.running
+        return web.json_response(
+            {
+                'status': 'ok' if running else 'stopped',
+                'update_queue': self.application.update_queue.qsize()
+            },
+            status=200 if running else 503
+        )
+    
+    def build_app(self) -> web.Application:
+        """Создает aiohttp-приложение с маршрутами webhook и проверки здоровья"""
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get(Config.WEBHOOK_HEALTH_PATH, self.handle_health)
+        return app
+    
+    async def serve(self, stop_event: asyncio.Event = None):
+        """Запускает приложение и HTTP-сервер, работает до stop_event или сигнала остановки"""
+        stop_event = stop_event or asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                # Windows: остановка по KeyboardInterrupt
+                pass
+        
+        application = self.application
+        runner = web.AppRunner(self.build_app())
+        try:
+            # Ошибка в post_init тоже должна закрыть бота и пул соединений через finally
+            await application.initialize()
+            if application.post_init:
+                await application.post_init(application)
+            await application.start()
+            await runner.setup()
+            await web.TCPSite(runner, Config.WEBHOOK_LISTEN, Config.WEBHOOK_PORT).start()
+            
+            if Config.WEBHOOK_URL:
+                await application.bot.set_webhook(
+                    url=Config.WEBHOOK_URL.rstrip('/') + self.path,
+                    secret_token=self.secret_token,
+                    allowed_updates=Update.ALL_TYPES,
+                    max_connections=Config.WEBHOOK_MAX_CONNECTIONS
+                )
+            else:
+                # Локальный режим: обновления можно отправлять POST-запросами вручную
+                bot_logger.logger.warning("WEBHOOK_URL не задан, webhook в Telegram не регистрируется")
+            
+            bot_logger.logger.info(
+                f"Webhook слушает {Config.WEBHOOK_LISTEN}:{Config.WEBHOOK_PORT}{self.path}"
+            )
+            await stop_event.wait()
+        finally:
+            await runner.cleanup()
+            if application.running:
+                await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+    
+    def run(self):
+        """Блокирующий запуск, аналог application.run_polling()"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
\ No newline at end of file
@@ -0,0 +1,184 @@
+import os
+import uuid
+import hashlib
+import zipfile
+import threading
+from typing import Callable, Optional
+from sqlalchemy import insert, select, update
+from database.session import Session
+from database.models import File, DEFAULT_EVENT_ID
+from services.claims import ClaimService
+from services.logger import bot_logger
+from services.stats import StatsService
+from config import Config
+
+class ZipIngestError(Exception):
+    """Архив отклонен целиком (лимиты, подозрение на zip-бомбу)"""
+
+class ZipIngestService:
+    """Потоковая загрузка файлов из ZIP архива в хранилище"""
+    
+    ALLOWED_EXTENSIONS = ('.pdf', '.txt', '.doc', '.docx')
+    READ_CHUNK_SIZE = 64 * 1024
+    
+    # Архивы разбираются по одному, чтобы параллельные загрузки не мешали друг другу
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def _select_members(zip_ref: zipfile.ZipFile) -> list:
+        """Отбирает подходящие файлы и проверяет заявленные размеры"""
+        members = [
+            info for info in zip_ref.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(ZipIngestService.ALLOWED_EXTENSIONS)
+        ]
+        
+        if len(members) > Config.MAX_FILES:
+            raise ZipIngestError(f"В архиве {len(members)} файлов, допустимо не более {Config.MAX_FILES}")
+        
+        total_size = 0
+        for info in members:
+            if info.file_size > Config.ZIP_MAX_MEMBER_SIZE:
+                raise ZipIngestError(f"Файл {info.filename} слишком большой")
+            if info.compress_size and info.file_size / info.compress_size > Config.ZIP_MAX_RATIO:
+                raise ZipIngestError(f"Подозрительная степень сжатия у файла {info.filename}")
+            total_size += info.file_size
+        
+        if total_size > Config.ZIP_MAX_TOTAL_SIZE:
+            raise ZipIngestError("Суммарный размер распакованных файлов превышает лимит")
+        
+        return members
+    
+    @staticmethod
+    def _stream_member(zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, target_path: str) -> str:
+        """Распаковывает файл сразу под итоговым именем и возвращает SHA-256 содержимого"""
+        written = 0
+        digest = hashlib.sha256()
+        try:
+            with zip_ref.open(info) as source, open(target_path, 'xb') as target:
+                while True:
+                    chunk = source.read(ZipIngestService.READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    # Заявленный в заголовке размер мог быть подделан
+                    if written > info.file_size or written > Config.ZIP_MAX_MEMBER_SIZE:
+                        raise ZipIngestError(f"Файл {info.filename} больше заявленного размера")
+                    digest.update(chunk)
+                    target.write(chunk)
+        except BaseException:
+            if os.path.exists(target_path):
+                os.remove(target_path)
+            raise
+        return digest.hexdigest()
+    
+    @staticmethod
+    def _remove_files(paths: list):
+        """Удаляет уже распакованные файлы"""
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    
+    @staticmethod
+    def _save_rows(rows: list) -> int:
+        """Отсеивает уже загруженные файлы одним запросом и вставляет остальные, возвращает число дубликатов"""
+        session = Session()
+        try:
+            existing = dict(session.execute(
+                select(File.content_hash, File.claim_state).where(File.content_hash.in_([row['content_hash'] for row in rows]))
+            ).all())
+            
+            # Повторно загруженный билет, которого сверка не нашла на диске, возвращается в продажу
+            restored = [row for row in rows if existing.get(row['content_hash']) == ClaimService.STATE_MISSING]
+            duplicates = [
+                row for row in rows
+                if row['content_hash'] in existing and existing[row['content_hash']] != ClaimService.STATE_MISSING
+            ]
+            new_rows = [row for row in rows if row['content_hash'] not in existing]
+            
+            returned = 0
+            for row in restored:
+                returned += session.execute(
+                    update(File)
+                    .where(File.content_hash == row['content_hash'], File.claim_state == ClaimService.STATE_MISSING)
+                    .values(file_path=row['file_path'], claim_state=ClaimService.STATE_FREE)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+            StatsService.bump(session, free_files=returned)
+            if new_rows:
+                session.execute(insert(File), new_rows)
+                StatsService.bump(session, files_count=len(new_rows), free_files=len(new_rows))
+            if restored or new_rows:
+                session.commit()
+            
+            ZipIngestService._remove_files([row['file_path'] for row in duplicates])
+            return len(duplicates)
+        except Exception:
+            session.rollback()
+            ZipIngestService._remove_files([row['file_path'] for row in rows])
+            raise
+        finally:
+            session.close()
+    
+    @staticmethod
+    def ingest(
+        zip_path: str,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        event_id: int = DEFAULT_EVENT_ID
+    ) -> dict:
+        """Разбирает архив в пул мероприятия (синхронно, для рабочего потока), возвращает {'processed', 'duplicates'}"""
+        with ZipIngestService._lock, zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            members = ZipIngestService._select_members(zip_ref)
+            total = len(members)
+            processed_count = 0
+            duplicate_count = 0
+            seen_hashes = set()
+            rows = []
+            
+            def flush():
+                nonlocal processed_count, duplicate_count, rows
+                if not rows:
+                    return
+                duplicates = ZipIngestService._save_rows(rows)
+                processed_count += len(rows) - duplicates
+                duplicate_count += duplicates
+                rows = []
+                if progress_callback:
+                    progress_callback(processed_count + duplicate_count, total)
+            
+            for info in members:
+                file_hash = hashlib.sha256(f"{uuid.uuid4()}".encode()).hexdigest()[:16]
+                original_ext = os.path.splitext(info.filename)[1]
+                new_file_path = os.path.join(Config.UPLOAD_FOLDER, f"{file_hash}{original_ext}")
+                
+                try:
+                    content_hash = ZipIngestService._stream_member(zip_ref, info, new_file_path)
+                except ZipIngestError as e:
+                    # Уже сохраненные порции остаются, текущая откатывается
+                    ZipIngestService._remove_files([row['file_path'] for row in rows])
+                    if processed_count:
+                        raise ZipIngestError(f"{e}. Сохранено файлов до остановки: {processed_count}") from e
+                    raise
+                except Exception as e:
+                    bot_logger.logger.error(f"Ошибка при обработке файла {info.filename}: {e}")
+                    continue
+                
+                # Повтор внутри того же архива отсеиваем сразу
+                if content_hash in seen_hashes:
+                    ZipIngestService._remove_files([new_file_path])
+                    duplicate_count += 1
+                    continue
+                seen_hashes.add(content_hash)
+                
+                rows.append({
+                    'original_name': os.path.basename(info.filename),
+                    'hash_name': file_hash,
+                    'file_path': new_file_path,
+                    'content_hash': content_hash,
+                    'event_id': event_id
+                })
+                
+                if len(rows) >= Config.INGEST_CHUNK_SIZE:
+                    flush()
+            
+            flush()
+            return {'processed': processed_count, 'duplicates': duplicate_count}
\ No newline at end of file
@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+from database.session import skip_locked_supported
+from services.auth import AuthService
+from services.subscription import SubscriptionService
+
+@pytest.fixture(autouse=True)
+def empty_auth_cache():
+    """Кэш прав живет на уровне класса — каждый тест начинает с пустого"""
+    AuthService._access_cache.clear()
+    AuthService.invalidate_admins()
+    yield
+    AuthService._access_cache.clear()
+    AuthService.invalidate_admins()
+
+def message_gate(user_id: int) -> bool:
+    """Проверка прав на каждое сообщение, как в обработчиках start"""
+    async def check():
+        return await AuthService.check_user_access(user_id) or await AuthService.is_admin(user_id)
+    return asyncio.run(check())
+
+@pytest.mark.skipif(
+    skip_locked_supported(),
+    reason="с общей базой PostgreSQL отказ не кэшируется: доступ мог выдать другой процесс"
+)
+def test_unsubscribed_messages_cost_no_queries(count_queries):
+    assert count_queries(message_gate, 5001) > 0
+    
+    for _ in range(3):
+        assert count_queries(message_gate, 5001) == 0
+    assert message_gate(5001) is False
+
+def test_subscribed_messages_cost_no_queries(count_queries, add_users):
+    [user_id] = add_users(1)
+    count_queries(message_gate, user_id)
+    
+    assert count_queries(message_gate, user_id) == 0
+    assert message_gate(user_id) is True
+
+def test_activation_drops_cached_denial():
+    assert message_gate(5001) is False
+    url = SubscriptionService.create_subscription_link(1, "test_bot")
+    
+    assert SubscriptionService.activate_subscription(5001, url.split('start=', 1)[1])
+    assert message_gate(5001) is True
+
+def test_admin_changes_drop_cached_list():
+    assert message_gate(5002) is False
+    
+    assert asyncio.run(AuthService.add_admin(5002, 'admin', 'Admin', 1))
+    assert message_gate(5002) is True
+    assert asyncio.run(AuthService.remove_admin(5002))
+    assert asyncio.run(AuthService.is_admin(5002)) is False
\ No newline at end of file
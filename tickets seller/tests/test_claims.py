@@ -0,0 +1,158 @@
+import threading
+from sqlalchemy import func, select, update
+from config import Config
+from database.session import Session
+from database.models import DEFAULT_EVENT_ID, File, SubscriptionLink, User
+from services.claims import ClaimService, file_pool
+from services.stats import StatsService
+from services.subscription import SubscriptionService
+
+def claimed_rows() -> dict:
+    """{id файла: за кем закреплен} по таблице files"""
+    session = Session()
+    try:
+        return dict(session.execute(
+            select(File.id, File.claimed_by).where(File.claim_state == ClaimService.STATE_CLAIMED)
+        ).all())
+    finally:
+        session.close()
+
+def test_claim_files_gives_each_user_own_file(add_files, add_users):
+    add_files(5)
+    users = add_users(3)
+    
+    claims = ClaimService.claim_files(users, DEFAULT_EVENT_ID)
+    
+    assert set(claims) == set(users)
+    assert len({file.id for file in claims.values()}) == 3
+    assert claimed_rows() == {file.id: user_id for user_id, file in claims.items()}
+
+def test_claim_files_is_idempotent(add_files, add_users):
+    add_files(5)
+    users = add_users(2)
+    first = ClaimService.claim_files(users, DEFAULT_EVENT_ID)
+    
+    # У пользователей уже есть файлы — второй вызов ничего не резервирует
+    assert ClaimService.claim_files(users, DEFAULT_EVENT_ID) == {}
+    assert claimed_rows() == {file.id: user_id for user_id, file in first.items()}
+
+def test_claim_files_stops_when_files_run_out(add_files, add_users):
+    add_files(2)
+    users = add_users(5)
+    
+    claims = ClaimService.claim_files(users, DEFAULT_EVENT_ID)
+    
+    assert len(claims) == 2
+    assert ClaimService.count_free(DEFAULT_EVENT_ID) == 0
+
+def test_claim_files_keeps_events_apart(add_event, add_files, add_users):
+    other_event = add_event("Другое мероприятие")
+    add_files(3, other_event)
+    users = add_users(2)
+    
+    assert ClaimService.claim_files(users, DEFAULT_EVENT_ID) == {}
+    
+    add_files(2)
+    claims = ClaimService.claim_files(users, other_event)
+    assert len(claims) == 2
+    assert {file.event_id for file in claims.values()} == {other_event}
+
+def test_concurrent_claims_never_share_a_file(add_files, add_users):
+    add_files(20)
+    users = add_users(30)
+    results = []
+    
+    def claim():
+        # Все потоки обслуживают одних и тех же пользователей
+        results.append(ClaimService.claim_files(list(users), DEFAULT_EVENT_ID))
+    
+    threads = [threading.Thread(target=claim) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    rows = claimed_rows()
+    # Ни один файл не выдан дважды и у каждого пользователя не больше одного файла
+    assert len(set(rows.values())) == len(rows)
+    for claims in results:
+        for user_id, file in claims.items():
+            assert rows[file.id] == user_id
+    assert sum(len(claims) for claims in results) == len(rows)
+
+def test_concurrent_activations_never_share_a_link(monkeypatch):
+    StatsService.rebuild_counters()
+    url = SubscriptionService.create_subscription_link(1, "test_bot")
+    token = url.split('start=', 1)[1]
+    buyers = [2001, 2002, 2003, 2004]
+    barrier = threading.Barrier(len(buyers), timeout=10)
+    generate_user_hash = SubscriptionService.generate_user_hash
+    
+    def meet_then_hash(user_id):
+        # Все активации уже прочитали свободную ссылку и одновременно пытаются ее занять
+        barrier.wait()
+        return generate_user_hash(user_id)
+    
+    monkeypatch.setattr(SubscriptionService, 'generate_user_hash', staticmethod(meet_then_hash))
+    results = {}
+    
+    def activate(user_id):
+        results[user_id] = SubscriptionService.activate_subscription(user_id, token)
+    
+    threads = [threading.Thread(target=activate, args=(user_id,)) for user_id in buyers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    winners = [user_id for user_id, activated in results.items() if activated]
+    assert len(winners) == 1
+    session = Session()
+    try:
+        assert session.scalars(select(User.user_id).where(User.has_access == True)).all() == winners
+        assert session.scalar(select(SubscriptionLink.used_by)) == winners[0]
+    finally:
+        session.close()
+    stats = StatsService.get_stats()
+    assert (stats['used_links'], stats['active_users']) == (1, 1)
+
+def test_claim_files_takes_pooled_files_first(monkeypatch, add_files, add_users):
+    monkeypatch.setattr(Config, 'FILE_POOL_SIZE', 3)
+    monkeypatch.setattr(Config, 'FILE_POOL_LOW_WATER', 0)
+    file_ids = add_files(6)
+    users = add_users(2)
+    
+    assert file_pool.refill(DEFAULT_EVENT_ID) == 3
+    claims = ClaimService.claim_files(users, DEFAULT_EVENT_ID)
+    
+    assert {file.id for file in claims.values()} == set(file_ids[:2])
+    assert file_pool.size(DEFAULT_EVENT_ID) == 1
+
+def test_release_all_keeps_other_processes_pools(monkeypatch, add_files):
+    monkeypatch.setattr(Config, 'FILE_POOL_SIZE', 2)
+    file_ids = add_files(4)
+    assert file_pool.refill(DEFAULT_EVENT_ID) == 2
+    
+    # Два файла лежат в пуле другого процесса с той же базой
+    session = Session()
+    try:
+        session.execute(
+            update(File)
+            .where(File.id.in_(file_ids[2:]))
+            .values(claim_state=ClaimService.STATE_POOLED, pooled_by='other-host')
+        )
+        session.commit()
+    finally:
+        session.close()
+    
+    assert file_pool.release_all() == 2
+    
+    session = Session()
+    try:
+        pooled = session.scalar(
+            select(func.count(File.id)).where(File.claim_state == ClaimService.STATE_POOLED)
+        )
+    finally:
+        session.close()
+    assert pooled == 2
+    assert file_pool.size(DEFAULT_EVENT_ID) == 0
\ No newline at end of file
@@ -0,0 +1,129 @@
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from database.session import Session
+from database.models import DeliveryJob, User
+from services.delivery_queue import DeliveryQueue
+
+def enqueue(add_files, add_users, count: int) -> list:
+    """Ставит в очередь задания выдачи и возвращает их id"""
+    pairs = list(zip(add_users(count), add_files(count)))
+    DeliveryQueue._insert_jobs(DeliveryQueue.new_batch(), 'deliver', pairs)
+    session = Session()
+    try:
+        return session.scalars(select(DeliveryJob.id).order_by(DeliveryJob.id)).all()
+    finally:
+        session.close()
+
+def job_states() -> dict:
+    session = Session()
+    try:
+        return dict(session.execute(select(DeliveryJob.id, DeliveryJob.state)).all())
+    finally:
+        session.close()
+
+def test_take_due_hands_out_each_job_once(add_files, add_users):
+    job_ids = enqueue(add_files, add_users, 5)
+    
+    first = DeliveryQueue.take_due(2)
+    second = DeliveryQueue.take_due(10)
+    
+    first_ids = [job.id for job, _, _ in first]
+    second_ids = [job.id for job, _, _ in second]
+    assert first_ids == job_ids[:2]
+    assert second_ids == job_ids[2:]
+    assert DeliveryQueue.take_due(10) == []
+    assert set(job_states().values()) == {DeliveryQueue.STATE_RUNNING}
+
+def test_take_due_returns_user_and_file(add_files, add_users):
+    enqueue(add_files, add_users, 1)
+    
+    [(job, user, file)] = DeliveryQueue.take_due(1)
+    
+    assert user.user_id == job.user_id
+    assert file.id == job.file_id
+
+def test_take_due_skips_jobs_that_are_not_due(add_files, add_users):
+    job_ids = enqueue(add_files, add_users, 3)
+    session = Session()
+    try:
+        session.execute(
+            update(DeliveryJob)
+            .where(DeliveryJob.id == job_ids[0])
+            .values(next_attempt_at=datetime.utcnow() + timedelta(minutes=5))
+        )
+        session.commit()
+    finally:
+        session.close()
+    
+    taken = [job.id for job, _, _ in DeliveryQueue.take_due(10)]
+    
+    assert taken == job_ids[1:]
+    assert job_states()[job_ids[0]] == DeliveryQueue.STATE_QUEUED
+
+def test_take_due_fails_jobs_without_user(add_files, add_users):
+    job_ids = enqueue(add_files, add_users, 2)
+    session = Session()
+    try:
+        session.execute(update(DeliveryJob).where(DeliveryJob.id == job_ids[0]).values(user_id=-1))
+        session.commit()
+    finally:
+        session.close()
+    
+    taken = [job.id for job, _, _ in DeliveryQueue.take_due(10)]
+    
+    assert taken == job_ids[1:]
+    assert job_states()[job_ids[0]] == DeliveryQueue.STATE_FAILED
+
+def test_concurrent_take_due_never_shares_a_job(add_files, add_users):
+    job_ids = enqueue(add_files, add_users, 40)
+    taken = []
+    lock = threading.Lock()
+    
+    def worker():
+        while True:
+            jobs = DeliveryQueue.take_due(3)
+            if not jobs:
+                return
+            with lock:
+                taken.extend(job.id for job, _, _ in jobs)
+    
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert sorted(taken) == job_ids
+
+def test_enqueue_user_serves_only_the_activated_user(add_files, add_users):
+    add_files(5)
+    waiting = add_users(2)
+    activated = add_users(1)[0]
+    session = Session()
+    try:
+        session.execute(update(User).values(pending_file=True))
+        session.commit()
+    finally:
+        session.close()
+    
+    result = DeliveryQueue.enqueue_user(activated)
+    
+    assert result['queued'] == 1
+    assert [job.user_id for job, _, _ in DeliveryQueue.take_due(10)] == [activated]
+    # Остальных ожидающих ставит в очередь периодический проход
+    assert DeliveryQueue.enqueue_pending(True)['queued'] == len(waiting)
+
+def test_enqueue_user_without_free_files(add_users):
+    user_id = add_users(1)[0]
+    session = Session()
+    try:
+        session.execute(update(User).values(pending_file=True))
+        session.commit()
+    finally:
+        session.close()
+    
+    result = DeliveryQueue.enqueue_user(user_id)
+    
+    assert (result['queued'], result['no_file']) == (0, 1)
+    assert DeliveryQueue.take_due(10) == []
\ No newline at end of file
@@ -0,0 +1,71 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy import select, update
+from telegram.error import BadRequest, Forbidden
+from config import Config
+from database.session import Session
+from database.models import DeliveryJob, File, User
+from services.claims import ClaimService
+from services.delivery_queue import DeliveryQueue, DeliveryWorker
+
+def waiting_user(add_files, add_users) -> int:
+    """Ожидающий пользователь и свободный файл, уже загруженный в Telegram"""
+    file_id = add_files(1)[0]
+    user_id = add_users(1)[0]
+    session = Session()
+    try:
+        session.execute(update(File).where(File.id == file_id).values(telegram_file_id="BQACAgIAAxkB"))
+        session.execute(update(User).where(User.user_id == user_id).values(pending_file=True))
+        session.commit()
+    finally:
+        session.close()
+    assert DeliveryQueue.enqueue_user(user_id)['queued'] == 1
+    return user_id
+
+def process_due(error: Exception, attempts: int = 0) -> AsyncMock:
+    """Обрабатывает задание очереди, отправка в Telegram завершается ошибкой"""
+    session = Session()
+    try:
+        session.execute(update(DeliveryJob).values(attempts=attempts))
+        session.commit()
+    finally:
+        session.close()
+    [job] = DeliveryQueue.take_due(1)
+    worker = DeliveryWorker()
+    worker.application = MagicMock()
+    worker.application.bot.send_document = AsyncMock(side_effect=error)
+    asyncio.run(worker._process(job))
+    return worker.application.bot.send_document
+
+def state(user_id: int) -> tuple:
+    session = Session()
+    try:
+        job = session.scalars(select(DeliveryJob)).one()
+        pending_file = session.scalar(select(User.pending_file).where(User.user_id == user_id))
+        return job.state, job.attempts, pending_file
+    finally:
+        session.close()
+
+def test_blocked_user_is_not_retried(add_files, add_users):
+    user_id = waiting_user(add_files, add_users)
+    
+    send_document = process_due(Forbidden("Forbidden: bot was blocked by the user"))
+    
+    assert send_document.await_count == 1
+    assert state(user_id) == (DeliveryQueue.STATE_FAILED, 0, False)
+    # Файл вернулся в продажу, а пользователь не ждет — проход очереди его не подберет
+    assert ClaimService.count_free() == 1
+    assert DeliveryQueue.enqueue_pending(True)['queued'] == 0
+
+def test_exhausted_user_leaves_pending_until_cooldown(monkeypatch, add_files, add_users):
+    user_id = waiting_user(add_files, add_users)
+    
+    process_due(BadRequest("Wrong file identifier"), attempts=Config.DELIVERY_JOB_MAX_ATTEMPTS - 1)
+    
+    assert state(user_id) == (DeliveryQueue.STATE_FAILED, Config.DELIVERY_JOB_MAX_ATTEMPTS, False)
+    assert ClaimService.count_free() == 1
+    # Даже рассылка администратора не забирает под него файл, пока не пройдет пауза
+    assert ClaimService.count_pending() == 0
+    assert DeliveryQueue.enqueue_pending()['queued'] == 0
+    monkeypatch.setattr(Config, 'DELIVERY_FAILED_COOLDOWN_HOURS', 0)
+    assert ClaimService.count_pending() == 1
\ No newline at end of file
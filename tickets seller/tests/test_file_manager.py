@@ -0,0 +1,24 @@
+import asyncio
+import os
+from unittest.mock import AsyncMock, MagicMock
+from config import Config
+from database.models import File
+from services.file_manager import FileManager
+
+def send(file: File) -> AsyncMock:
+    application = MagicMock()
+    application.bot.send_document = AsyncMock()
+    asyncio.run(FileManager._send_document(application, 100, file, "abc123.pdf", "caption"))
+    return application.bot.send_document
+
+def test_send_document_names_file_on_both_paths():
+    path = os.path.join(Config.UPLOAD_FOLDER, "ticket.pdf")
+    with open(path, 'wb') as ticket:
+        ticket.write(b"%PDF-1.4")
+    
+    by_file_id = send(File(id=1, file_path=path, telegram_file_id="BQACAgIAAxkB"))
+    from_disk = send(File(id=2, file_path=path))
+    
+    assert by_file_id.await_args.kwargs['document'] == "BQACAgIAAxkB"
+    assert by_file_id.await_args.kwargs['filename'] == "abc123.pdf"
+    assert from_disk.await_args.kwargs['filename'] == "abc123.pdf"
\ No newline at end of file
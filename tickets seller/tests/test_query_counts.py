@@ -0,0 +1,57 @@
+"""Экраны статистики и списков должны стоить постоянное число SQL-запросов, сколько бы ни было данных"""
+import uuid
+import pytest
+from sqlalchemy import insert, select
+from database.session import Session
+from database.models import Admin, File, FileDelivery
+from database.repositories import AdminRepository, DeliveryRepository
+from services.stats import StatsService
+
+USER_ID = 40_000_000
+
+# Сценарий -> максимально допустимое число запросов
+EXPECTED_QUERIES = {
+    'delivery_stats': 2,
+    'manage_admins': 1,
+    'bot_stats': 1
+}
+
+SCENARIOS = {
+    'delivery_stats': lambda: DeliveryRepository.recent_for_user(USER_ID, 10),
+    'manage_admins': AdminRepository.list_with_inviters,
+    'bot_stats': StatsService.get_stats
+}
+
+def seed(deliveries: int, admins: int, first_admin: int = 0):
+    """Доставки пользователю и цепочка администраторов, пригласивших друг друга"""
+    session = Session()
+    try:
+        session.execute(insert(File), [{
+            'original_name': f"ticket_{index}.pdf",
+            'hash_name': uuid.uuid4().hex[:16],
+            'file_path': f"missing_{index}.pdf"
+        } for index in range(deliveries)])
+        file_ids = session.scalars(select(File.id).order_by(File.id)).all()
+        session.execute(insert(FileDelivery), [
+            {'user_id': USER_ID, 'file_id': file_id, 'delivery_status': 'sent'} for file_id in file_ids
+        ])
+        session.execute(insert(Admin), [{
+            'user_id': 30_000_000 + index,
+            'username': f"admin{index}",
+            'first_name': f"Admin{index}",
+            'added_by': 30_000_000 + index - 1 if index else None
+        } for index in range(first_admin, first_admin + admins)])
+        session.commit()
+    finally:
+        session.close()
+    StatsService.rebuild_counters()
+
+@pytest.mark.parametrize('scenario', sorted(EXPECTED_QUERIES))
+def test_query_count_does_not_grow_with_data(scenario, count_queries):
+    seed(deliveries=5, admins=3)
+    small = count_queries(SCENARIOS[scenario])
+    seed(deliveries=500, admins=50, first_admin=3)
+    large = count_queries(SCENARIOS[scenario])
+    
+    assert large == small
+    assert large <= EXPECTED_QUERIES[scenario]
\ No newline at end of file
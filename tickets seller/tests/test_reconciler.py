@@ -0,0 +1,140 @@
+import os
+import pytest
+from sqlalchemy import select, update
+from config import Config
+from database.session import Session
+from database.models import DEFAULT_EVENT_ID, File
+from services.claims import ClaimService
+from services.reconciler import InventoryReconciler
+
+@pytest.fixture
+def folders(monkeypatch, tmp_path):
+    """Отдельные каталоги хранилища, без файлов других тестов; сверка без пауз и без льготного срока"""
+    for name in ('UPLOAD_FOLDER', 'BACKUP_FOLDER', 'QUARANTINE_FOLDER'):
+        path = os.path.join(tmp_path, name.lower())
+        os.makedirs(path)
+        monkeypatch.setattr(Config, name, path)
+    monkeypatch.setattr(Config, 'RECONCILE_PAUSE', 0)
+    monkeypatch.setattr(Config, 'RECONCILE_BATCH_SIZE', 2)
+    # Только что созданные файлы иначе считались бы недописанными
+    monkeypatch.setattr(Config, 'RECONCILE_GRACE', -1)
+    return tmp_path
+
+def touch(path: str):
+    with open(path, 'wb') as ticket:
+        ticket.write(b'%PDF-1.4 test')
+
+def file_paths(file_ids: list) -> list:
+    session = Session()
+    try:
+        paths = dict(session.execute(select(File.id, File.file_path).where(File.id.in_(file_ids))).all())
+        return [paths[file_id] for file_id in file_ids]
+    finally:
+        session.close()
+
+def claim_states() -> dict:
+    session = Session()
+    try:
+        return dict(session.execute(select(File.id, File.claim_state)).all())
+    finally:
+        session.close()
+
+def test_sweep_orphans_quarantines_unreferenced_files(folders, add_files):
+    file_ids = add_files(3)
+    for path in file_paths(file_ids):
+        touch(path)
+    orphans = [os.path.join(Config.UPLOAD_FOLDER, f"orphan_{n}.pdf") for n in range(3)]
+    for path in orphans:
+        touch(path)
+    
+    moved = InventoryReconciler()._sweep_orphans(Config.UPLOAD_FOLDER, File.file_path, 'uploads')
+    
+    assert moved == 3
+    assert sorted(os.listdir(os.path.join(Config.QUARANTINE_FOLDER, 'uploads'))) == \
+        sorted(os.path.basename(path) for path in orphans)
+    assert all(os.path.exists(path) for path in file_paths(file_ids))
+
+def test_sweep_orphans_keeps_recent_files(folders, monkeypatch):
+    monkeypatch.setattr(Config, 'RECONCILE_GRACE', 60 * 60)
+    fresh = os.path.join(Config.UPLOAD_FOLDER, 'being_written.pdf')
+    touch(fresh)
+    
+    assert InventoryReconciler()._sweep_orphans(Config.UPLOAD_FOLDER, File.file_path, 'uploads') == 0
+    assert os.path.exists(fresh)
+
+def test_sweep_orphans_checks_backup_paths(folders, add_files):
+    [file_id] = add_files(1)
+    backup = os.path.join(Config.BACKUP_FOLDER, 'sent_copy.pdf')
+    orphan = os.path.join(Config.BACKUP_FOLDER, 'unknown_copy.pdf')
+    touch(backup)
+    touch(orphan)
+    session = Session()
+    try:
+        session.execute(update(File).where(File.id == file_id).values(backup_path=backup))
+        session.commit()
+    finally:
+        session.close()
+    
+    assert InventoryReconciler()._sweep_orphans(Config.BACKUP_FOLDER, File.backup_path, 'backups') == 1
+    assert os.path.exists(backup)
+    assert os.listdir(os.path.join(Config.QUARANTINE_FOLDER, 'backups')) == ['unknown_copy.pdf']
+
+def test_mark_rows_flags_only_unsold_files(folders, add_files, add_users):
+    file_ids = add_files(4)
+    [user_id] = add_users(1)
+    claims = ClaimService.claim_files([user_id], DEFAULT_EVENT_ID)
+    claimed_id = claims[user_id].id
+    
+    missing, restored = InventoryReconciler._mark_rows(file_ids, [])
+    
+    # Зарезервированный файл уже в выдаче — его не трогаем
+    assert (missing, restored) == (3, 0)
+    states = claim_states()
+    assert states[claimed_id] == ClaimService.STATE_CLAIMED
+    assert {states[file_id] for file_id in file_ids if file_id != claimed_id} == {ClaimService.STATE_MISSING}
+    
+    restored_id = next(file_id for file_id in file_ids if file_id != claimed_id)
+    assert InventoryReconciler._mark_rows([], [restored_id, claimed_id]) == (0, 1)
+    assert claim_states()[restored_id] == ClaimService.STATE_FREE
+
+def test_run_once_flags_missing_and_restores_found_files(folders, add_files):
+    file_ids = add_files(3)
+    paths = file_paths(file_ids)
+    touch(paths[0])
+    reconciler = InventoryReconciler()
+    
+    report = reconciler.run_once()
+    
+    assert (report['missing'], report['restored']) == (2, 0)
+    assert [claim_states()[file_id] for file_id in file_ids] == \
+        [ClaimService.STATE_FREE, ClaimService.STATE_MISSING, ClaimService.STATE_MISSING]
+    assert ClaimService.count_free(DEFAULT_EVENT_ID) == 1
+    
+    # Файл вернули на диск — следующий проход возвращает его в продажу
+    touch(paths[1])
+    report = reconciler.run_once()
+    
+    assert (report['missing'], report['restored']) == (0, 1)
+    assert ClaimService.count_free(DEFAULT_EVENT_ID) == 2
+
+def test_run_once_reports_sold_files_without_copy(folders, add_files):
+    sold_id, kept_id = add_files(2)
+    backup = os.path.join(Config.BACKUP_FOLDER, 'kept_copy.pdf')
+    touch(backup)
+    session = Session()
+    try:
+        session.execute(
+            update(File)
+            .where(File.id.in_([sold_id, kept_id]))
+            .values(claim_state=ClaimService.STATE_SENT, distributed=True)
+        )
+        session.execute(update(File).where(File.id == kept_id).values(backup_path=backup))
+        session.commit()
+    finally:
+        session.close()
+    
+    report = InventoryReconciler().run_once()
+    
+    # Выданные билеты не помечаются недоступными, без копии о них только сообщается
+    assert (report['missing'], report['lost']) == (0, 1)
+    assert set(claim_states().values()) == {ClaimService.STATE_SENT}
\ No newline at end of file
@@ -0,0 +1,16 @@
+from sqlalchemy import update
+from database.session import Session
+from database.models import User
+from database.repositories import UserRepository
+
+def test_find_subscribers_skips_users_without_access(add_users):
+    active, revoked = add_users(2)
+    session = Session()
+    try:
+        session.execute(update(User).where(User.user_id == revoked).values(has_access=False))
+        session.commit()
+    finally:
+        session.close()
+    
+    assert [user.user_id for user in UserRepository.find_subscribers(f"@user{active}")] == [active]
+    assert UserRepository.find_subscribers(f"user{revoked}") == []
\ No newline at end of file
@@ -0,0 +1,45 @@
+import pytest
+from sqlalchemy import select
+from database.session import Session, engine, lock_rows, skip_locked_supported
+from database.models import File
+
+postgres_only = pytest.mark.skipif(
+    not skip_locked_supported(),
+    reason="нужен PostgreSQL: задайте TEST_DATABASE_URL"
+)
+
+def test_lock_rows_adds_skip_locked_only_where_supported():
+    sql = str(lock_rows(select(File.id)).compile(engine)).upper()
+    
+    assert ('SKIP LOCKED' in sql) == skip_locked_supported()
+    if engine.dialect.name == 'sqlite':
+        # SQLite не знает FOR UPDATE, запрос должен остаться прежним
+        assert 'FOR UPDATE' not in sql
+
+@pytest.mark.skipif(engine.dialect.name != 'sqlite', reason="проверка для SQLite")
+def test_lock_rows_does_not_hide_rows_on_sqlite(add_files):
+    file_ids = add_files(3)
+    first, second = Session(), Session()
+    try:
+        query = lock_rows(select(File.id).order_by(File.id))
+        assert first.scalars(query).all() == file_ids
+        assert second.scalars(query).all() == file_ids
+    finally:
+        first.close()
+        second.close()
+
+@postgres_only
+def test_lock_rows_hands_out_disjoint_rows(add_files):
+    file_ids = add_files(4)
+    first, second = Session(), Session()
+    try:
+        taken = first.scalars(lock_rows(select(File.id).order_by(File.id).limit(2))).all()
+        rest = second.scalars(lock_rows(select(File.id).order_by(File.id))).all()
+        
+        assert taken == file_ids[:2]
+        assert rest == file_ids[2:]
+    finally:
+        first.rollback()
+        second.rollback()
+        first.close()
+        second.close()
\ No newline at end of file
@@ -0,0 +1,61 @@
+from sqlalchemy import delete, select
+from database.session import Session
+from database.models import DEFAULT_EVENT_ID, StatCounter
+from services.claims import ClaimService
+from services.reconciler import InventoryReconciler
+from services.stats import StatsService
+
+def stored_counters() -> dict:
+    session = Session()
+    try:
+        return dict(session.execute(select(StatCounter.name, StatCounter.value)).all())
+    finally:
+        session.close()
+
+def test_rebuild_counters_overwrites_drifted_values(add_files, add_users):
+    add_files(4)
+    add_users(3)
+    StatsService.rebuild_counters()
+    session = Session()
+    try:
+        StatsService.bump(session, files_count=100)
+        session.commit()
+    finally:
+        session.close()
+    
+    stats = StatsService.rebuild_counters()
+    
+    assert stats['files_count'] == 4
+    assert stats['users_count'] == 3
+    assert stored_counters() == {name: stats[name] for name in StatsService.COUNTERS}
+
+def test_rebuild_counters_adds_missing_rows(add_files):
+    add_files(2)
+    StatsService.rebuild_counters()
+    session = Session()
+    try:
+        session.execute(delete(StatCounter).where(StatCounter.name == 'files_count'))
+        session.commit()
+    finally:
+        session.close()
+    
+    assert StatsService.get_stats()['files_count'] == 2
+    assert stored_counters()['files_count'] == 2
+
+def test_free_files_counter_follows_claims(add_files, add_users):
+    file_ids = add_files(5)
+    users = add_users(2)
+    StatsService.rebuild_counters()
+    
+    claims = ClaimService.claim_files(users, DEFAULT_EVENT_ID)
+    assert StatsService.get_stats()['free_files'] == 3
+    
+    user_id, file = next(iter(claims.items()))
+    assert ClaimService.release_claim(file.id, user_id)
+    assert StatsService.get_stats()['free_files'] == 4
+    
+    free_ids = [file_id for file_id in file_ids if file_id not in {f.id for f in claims.values()}]
+    InventoryReconciler._mark_rows(free_ids[:2], [])
+    assert StatsService.get_stats()['free_files'] == 2
+    
+    assert StatsService.get_stats() == StatsService.compute_stats()
\ No newline at end of file
@@ -0,0 +1,50 @@
+from database.models import DEFAULT_EVENT_ID
+from database.repositories import UserRepository
+from services.delivery_queue import DeliveryQueue
+from services.file_manager import FileManager
+from services.stats import StatsService
+from services.subscription import SubscriptionService
+
+def new_token(event_id: int = DEFAULT_EVENT_ID) -> str:
+    url = SubscriptionService.create_subscription_link(1, "test_bot", event_id)
+    return url.split('start=', 1)[1]
+
+def deliver(user_id: int):
+    """Резервирует файл ожидающему пользователю и отмечает его выданным"""
+    result = DeliveryQueue.enqueue_user(user_id)
+    assert result['queued'] == 1
+    [(job, user_obj, file)] = DeliveryQueue.take_due(1)
+    FileManager._mark_sent(user_obj, file, None, None)
+    return file
+
+def test_returning_customer_buys_another_event(add_event, add_files):
+    second_event = add_event("Второе мероприятие")
+    add_files(2)
+    add_files(2, second_event)
+    StatsService.rebuild_counters()
+    
+    assert SubscriptionService.activate_subscription(3001, new_token())
+    assert deliver(3001).event_id == DEFAULT_EVENT_ID
+    
+    assert SubscriptionService.activate_subscription(3001, new_token(second_event))
+    assert UserRepository.get_by_user_id(3001).event_id == second_event
+    assert StatsService.get_stats()['users_without_files'] == 1
+    assert deliver(3001).event_id == second_event
+    
+    assert StatsService.get_stats() == StatsService.compute_stats()
+    assert StatsService.get_stats()['users_without_files'] == 0
+
+def test_one_ticket_per_event(add_files):
+    add_files(2)
+    assert SubscriptionService.activate_subscription(3002, new_token())
+    deliver(3002)
+    
+    assert not SubscriptionService.activate_subscription(3002, new_token())
+
+def test_waiting_customer_cannot_switch_event(add_event):
+    second_event = add_event("Второе мероприятие")
+    assert SubscriptionService.activate_subscription(3003, new_token())
+    
+    # Билет первого мероприятия еще не выдан — его покупка не должна потеряться
+    assert not SubscriptionService.activate_subscription(3003, new_token(second_event))
+    assert UserRepository.get_by_user_id(3003).event_id == DEFAULT_EVENT_ID
\ No newline at end of file
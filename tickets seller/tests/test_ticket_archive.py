@@ -0,0 +1,66 @@
+import zipfile
+from sqlalchemy import select, update
+from database.session import Session
+from database.models import File
+from services.claims import ClaimService
+from services.ticket_archive import TicketArchiveService
+
+def keep_free(file_ids: list, free_ids: list):
+    """Оставляет свободными только free_ids, остальные файлы считает зарезервированными"""
+    session = Session()
+    try:
+        session.execute(update(File).values(claim_state=ClaimService.STATE_FREE, claimed_by=None))
+        session.execute(
+            update(File)
+            .where(File.id.in_(set(file_ids) - set(free_ids)))
+            .values(claim_state=ClaimService.STATE_CLAIMED, claimed_by=1)
+        )
+        session.commit()
+    finally:
+        session.close()
+
+def write_files(file_ids: list):
+    """Создает на диске файлы, которые add_files только записал в базу"""
+    session = Session()
+    try:
+        for path in session.scalars(select(File.file_path).where(File.id.in_(file_ids))):
+            with open(path, 'wb') as ticket:
+                ticket.write(b'%PDF-1.4 test')
+    finally:
+        session.close()
+
+def archived_ids(parts: list) -> set:
+    ids = set()
+    for part in parts:
+        with zipfile.ZipFile(part) as archive:
+            ids.update(int(name.split('_', 1)[0]) for name in archive.namelist())
+    return ids
+
+def test_signature_differs_for_sets_with_same_count_sum_and_max(add_files):
+    file_ids = add_files(6)
+    first = [file_ids[0], file_ids[4], file_ids[5]]
+    second = [file_ids[1], file_ids[3], file_ids[5]]
+    # Одинаковые число, сумма и максимум id
+    assert (len(first), sum(first), max(first)) == (len(second), sum(second), max(second))
+    
+    keep_free(file_ids, first)
+    first_signature = TicketArchiveService.inventory_signature()
+    keep_free(file_ids, second)
+    
+    assert TicketArchiveService.inventory_signature() != first_signature
+
+def test_archive_is_rebuilt_when_free_set_changes(add_files):
+    file_ids = add_files(6)
+    write_files(file_ids)
+    first = [file_ids[0], file_ids[4], file_ids[5]]
+    second = [file_ids[1], file_ids[3], file_ids[5]]
+    
+    keep_free(file_ids, first)
+    parts, added, missing = TicketArchiveService.build_free_archive()
+    assert (added, missing) == (3, 0)
+    assert archived_ids(parts) == set(first)
+    
+    # Первые свободные билеты проданы — в архив они больше не попадают
+    keep_free(file_ids, second)
+    parts, added, missing = TicketArchiveService.build_free_archive()
+    assert archived_ids(parts) == set(second)
\ No newline at end of file
@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from telegram import Bot
+from config import Config
+from services.webhook import SECRET_HEADER, WebhookServer
+
+SECRET = 'test-secret'
+
+# Обновление в том виде, в каком его присылает Telegram
+RECORDED_UPDATE = {
+    'update_id': 10001,
+    'message': {
+        'message_id': 7,
+        'date': 1700000000,
+        'chat': {'id': 1001, 'type': 'private', 'username': 'user1001'},
+        'from': {'id': 1001, 'is_bot': False, 'first_name': 'Test', 'username': 'user1001'},
+        'text': '/start'
+    }
+}
+
+def make_application(running: bool = True):
+    """Минимальная замена Application: HTTP-обработчикам нужны только bot, очередь и running"""
+    return SimpleNamespace(bot=Bot('123456:TEST'), update_queue=asyncio.Queue(), running=running)
+
+def request(application, method: str, path: str, **kwargs):
+    """Выполняет запрос к aiohttp-приложению webhook и возвращает (статус, тело)"""
+    server = WebhookServer(application, secret_token=SECRET)
+    
+    async def call():
+        async with TestClient(TestServer(server.build_app())) as client:
+            response = await client.request(method, path, **kwargs)
+            return response.status, await response.text()
+    
+    return asyncio.run(call())
+
+def test_update_with_wrong_secret_is_rejected():
+    application = make_application()
+    
+    status, _ = request(
+        application, 'POST', Config.WEBHOOK_PATH,
+        json=RECORDED_UPDATE, headers={SECRET_HEADER: 'wrong'}
+    )
+    
+    assert status == 403
+    assert application.update_queue.empty()
+
+def test_update_with_secret_lands_in_update_queue():
+    application = make_application()
+    
+    status, _ = request(
+        application, 'POST', Config.WEBHOOK_PATH,
+        json=RECORDED_UPDATE, headers={SECRET_HEADER: SECRET}
+    )
+    
+    assert status == 200
+    update = application.update_queue.get_nowait()
+    assert update.update_id == RECORDED_UPDATE['update_id']
+    assert update.effective_user.id == 1001
+    assert update.message.text == '/start'
+
+def test_healthz_reports_running_application():
+    status, body = request(make_application(), 'GET', Config.WEBHOOK_HEALTH_PATH)
+    
+    assert status == 200
+    assert '"ok"' in body
+    assert request(make_application(running=False), 'GET', Config.WEBHOOK_HEALTH_PATH)[0] == 503
+
+def test_serve_shuts_down_when_post_init_fails():
+    calls = []
+    
+    async def record(name):
+        calls.append(name)
+    
+    async def failing_post_init(application):
+        raise RuntimeError("post_init")
+    
+    application = SimpleNamespace(
+        running=False,
+        initialize=lambda: record('initialize'),
+        post_init=failing_post_init,
+        post_stop=None,
+        shutdown=lambda: record('shutdown'),
+        post_shutdown=lambda application: record('post_shutdown')
+    )
+    
+    with pytest.raises(RuntimeError):
+        asyncio.run(WebhookServer(application, secret_token=SECRET).serve())
+    
+    assert calls == ['initialize', 'shutdown', 'post_shutdown']
\ No newline at end of file
@@ -0,0 +1,128 @@
+import os
+import zipfile
+import pytest
+from sqlalchemy import select, update
+from config import Config
+from database.session import Session
+from database.models import File
+from services.claims import ClaimService
+from services.zip_ingest import ZipIngestError, ZipIngestService
+
+def make_zip(tmp_path, members: dict, compression=zipfile.ZIP_STORED) -> str:
+    """Собирает архив {имя внутри архива: содержимое} и возвращает путь к нему"""
+    path = os.path.join(tmp_path, 'tickets.zip')
+    with zipfile.ZipFile(path, 'w', compression) as zip_ref:
+        for name, content in members.items():
+            zip_ref.writestr(name, content)
+    return path
+
+def stored_files() -> list:
+    session = Session()
+    try:
+        return session.execute(
+            select(File.original_name, File.file_path, File.claim_state).order_by(File.id)
+        ).all()
+    finally:
+        session.close()
+
+def upload_folder_names() -> set:
+    return set(os.listdir(Config.UPLOAD_FOLDER))
+
+def test_member_paths_never_leave_upload_folder(tmp_path):
+    zip_path = make_zip(tmp_path, {'../../escape.pdf': b'escape', '/abs/ticket.pdf': b'absolute'})
+    before = upload_folder_names()
+    
+    assert ZipIngestService.ingest(zip_path) == {'processed': 2, 'duplicates': 0}
+    
+    rows = stored_files()
+    assert [row.original_name for row in rows] == ['escape.pdf', 'ticket.pdf']
+    upload_folder = os.path.abspath(Config.UPLOAD_FOLDER)
+    for row in rows:
+        assert os.path.dirname(os.path.abspath(row.file_path)) == upload_folder
+    assert len(upload_folder_names() - before) == 2
+    assert not os.path.exists(os.path.join(os.path.dirname(tmp_path), 'escape.pdf'))
+
+def test_select_members_skips_other_extensions_and_dirs(tmp_path):
+    zip_path = make_zip(tmp_path, {'a.pdf': b'a', 'notes.exe': b'x', 'dir/': b'', 'dir/b.PDF': b'b'})
+    
+    with zipfile.ZipFile(zip_path) as zip_ref:
+        names = [info.filename for info in ZipIngestService._select_members(zip_ref)]
+    
+    assert names == ['a.pdf', 'dir/b.PDF']
+
+def test_select_members_rejects_large_declared_size(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'ZIP_MAX_MEMBER_SIZE', 100)
+    zip_path = make_zip(tmp_path, {'small.pdf': b'x' * 100, 'big.pdf': b'x' * 101})
+    
+    with zipfile.ZipFile(zip_path) as zip_ref, pytest.raises(ZipIngestError, match='big.pdf'):
+        ZipIngestService._select_members(zip_ref)
+
+def test_select_members_rejects_total_size(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'ZIP_MAX_TOTAL_SIZE', 150)
+    zip_path = make_zip(tmp_path, {'a.pdf': b'a' * 100, 'b.pdf': b'b' * 100})
+    
+    with zipfile.ZipFile(zip_path) as zip_ref, pytest.raises(ZipIngestError):
+        ZipIngestService._select_members(zip_ref)
+
+def test_select_members_rejects_suspicious_ratio(tmp_path):
+    zip_path = make_zip(tmp_path, {'bomb.pdf': b'\0' * (1024 * 1024)}, zipfile.ZIP_DEFLATED)
+    
+    with zipfile.ZipFile(zip_path) as zip_ref, pytest.raises(ZipIngestError, match='bomb.pdf'):
+        ZipIngestService._select_members(zip_ref)
+
+def test_stream_member_enforces_member_limit(monkeypatch, tmp_path):
+    zip_path = make_zip(tmp_path, {'big.pdf': b'x' * (3 * ZipIngestService.READ_CHUNK_SIZE)})
+    target_path = os.path.join(tmp_path, 'big.pdf')
+    monkeypatch.setattr(Config, 'ZIP_MAX_MEMBER_SIZE', ZipIngestService.READ_CHUNK_SIZE)
+    
+    with zipfile.ZipFile(zip_path) as zip_ref, pytest.raises(ZipIngestError, match='big.pdf'):
+        ZipIngestService._stream_member(zip_ref, zip_ref.getinfo('big.pdf'), target_path)
+    
+    assert not os.path.exists(target_path)
+
+def test_stream_member_removes_file_with_forged_size(tmp_path):
+    zip_path = make_zip(tmp_path, {'forged.pdf': b'x' * 1000})
+    target_path = os.path.join(tmp_path, 'forged.pdf')
+    
+    with zipfile.ZipFile(zip_path) as zip_ref:
+        info = zip_ref.getinfo('forged.pdf')
+        # Заголовок обещает меньше, чем реально лежит в архиве
+        info.file_size = 10
+        # Остановит либо наша проверка размера, либо проверка CRC в zipfile
+        with pytest.raises((ZipIngestError, zipfile.BadZipFile)):
+            ZipIngestService._stream_member(zip_ref, info, target_path)
+    
+    assert not os.path.exists(target_path)
+
+def test_duplicates_in_one_archive_are_stored_once(tmp_path):
+    zip_path = make_zip(tmp_path, {'a.pdf': b'same', 'b.pdf': b'same', 'c.pdf': b'other'})
+    before = upload_folder_names()
+    
+    assert ZipIngestService.ingest(zip_path) == {'processed': 2, 'duplicates': 1}
+    assert [row.original_name for row in stored_files()] == ['a.pdf', 'c.pdf']
+    assert len(upload_folder_names() - before) == 2
+
+def test_reuploaded_archive_adds_nothing(tmp_path):
+    zip_path = make_zip(tmp_path, {'a.pdf': b'first', 'b.pdf': b'second'})
+    ZipIngestService.ingest(zip_path)
+    before = upload_folder_names()
+    
+    assert ZipIngestService.ingest(zip_path) == {'processed': 0, 'duplicates': 2}
+    assert len(stored_files()) == 2
+    assert upload_folder_names() == before
+
+def test_reupload_restores_missing_file(tmp_path):
+    zip_path = make_zip(tmp_path, {'a.pdf': b'ticket'})
+    ZipIngestService.ingest(zip_path)
+    session = Session()
+    try:
+        session.execute(update(File).values(claim_state=ClaimService.STATE_MISSING))
+        session.commit()
+    finally:
+        session.close()
+    
+    assert ZipIngestService.ingest(zip_path) == {'processed': 1, 'duplicates': 0}
+    
+    [row] = stored_files()
+    assert row.claim_state == ClaimService.STATE_FREE
+    assert os.path.exists(row.file_path)
\ No newline at end of file
@@ -0,0 +1,123 @@
+import csv
+import os
+import uuid
+from datetime import datetime
+from sqlalchemy import select
+from database.session import Session
+from database.models import User, File, FileDelivery
+from config import Config
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    # Без openpyxl отчеты формируются в CSV
+    Workbook = None
+
+class ExcelGenerator:
+    """Потоковая выгрузка отчетов в XLSX (или CSV без openpyxl)"""
+    
+    REPORTS = {
+        'subscribers': "Подписчики",
+        'deliveries': "Доставки",
+        'inventory': "Файлы"
+    }
+    
+    @staticmethod
+    def _subscribers_query():
+        return (
+            ["ID в Telegram", "Username", "Имя", "Уникальный ID", "Дата подписки", "Получено файлов", "Последний файл"],
+            select(
+                User.user_id, User.username, User.first_name, User.file_hash,
+                User.subscription_date, User.files_received, User.last_file_sent
+            ).where(User.has_access == True).order_by(User.id)
+        )
+    
+    @staticmethod
+    def _deliveries_query():
+        return (
+            ["ID доставки", "ID в Telegram", "Username", "Файл", "Статус", "Дата", "Попыток восстановления", "Ошибка"],
+            select(
+                FileDelivery.id, FileDelivery.user_id, User.username, File.original_name,
+                FileDelivery.delivery_status, FileDelivery.sent_at, FileDelivery.recovery_attempts,
+                FileDelivery.error_message
+            )
+            .outerjoin(User, User.user_id == FileDelivery.user_id)
+            .outerjoin(File, File.id == FileDelivery.file_id)
+            .order_by(FileDelivery.id)
+        )
+    
+    @staticmethod
+    def _inventory_query():
+        return (
+            ["ID файла", "Исходное имя", "Хэш-имя", "Состояние", "Выдан", "Кому", "Когда"],
+            select(
+                File.id, File.original_name, File.hash_name, File.claim_state,
+                File.distributed, File.distributed_to, File.distributed_at
+            ).order_by(File.id)
+        )
+    
+    @staticmethod
+    def _iter_rows(query):
+        """Строки отчета порциями, без загрузки всей таблицы в память"""
+        session = Session()
+        try:
+            result = session.execute(query.execution_options(yield_per=Config.REPORT_BATCH_SIZE))
+            for row in result:
+                yield tuple(row)
+        finally:
+            session.close()
+    
+    @staticmethod
+    def _write_xlsx(path: str, title: str, headers: list, rows) -> int:
+        """Пишет книгу в режиме write_only: строки сразу уходят на диск"""
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(title)
+        sheet.append(headers)
+        count = 0
+        for row in rows:
+            sheet.append(row)
+            count += 1
+        workbook.save(path)
+        return count
+    
+    @staticmethod
+    def _write_csv(path: str, headers: list, rows) -> int:
+        """Пишет CSV с BOM, чтобы Excel правильно открыл кириллицу"""
+        count = 0
+        with open(path, 'w', newline='', encoding='utf-8-sig') as csv_file:
+            writer = csv.writer(csv_file, delimiter=';')
+            writer.writerow(headers)
+            for row in rows:
+                writer.writerow(
+                    value.strftime('%d.%m.%Y %H:%M') if isinstance(value, datetime) else value
+                    for value in row
+                )
+                count += 1
+        return count
+    
+    @staticmethod
+    def generate_report(report_type: str) -> tuple:
+        """Формирует отчет (синхронно, для рабочего потока), возвращает (путь, число строк)"""
+        if report_type not in ExcelGenerator.REPORTS:
+            raise ValueError(f"Неизвестный тип отчета: {report_type}")
+        
+        headers, query = getattr(ExcelGenerator, f"_{report_type}_query")()
+        extension = 'xlsx' if Workbook is not None else 'csv'
+        path = os.path.join(
+            Config.EXCEL_FOLDER,
+            f"{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}.{extension}"
+        )
+        
+        rows = ExcelGenerator._iter_rows(query)
+        try:
+            if Workbook is not None:
+                count = ExcelGenerator._write_xlsx(path, ExcelGenerator.REPORTS[report_type], headers, rows)
+            else:
+                count = ExcelGenerator._write_csv(path, headers, rows)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        finally:
+            rows.close()
+        return path, count
\ No newline at end of file